@@ -0,0 +1,849 @@
+"""
+Proxy Manager CLI - Asyncio Engine
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Event-loop forwarding engine for the local proxy servers. All servers share a
+single event loop running in a background thread, so one process can hold
+thousands of concurrent tunnels without a thread per connection.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, BinaryIO, Callable, List, Optional, Set, Tuple, cast
+
+import socks
+
+from connections import STATE_ACTIVE, STATE_IDLE, ConnectionTracker, TrackedConnection
+from defaults import DEFAULT_BACKLOG
+from http_cache import (
+    CACHE_BYPASS,
+    CACHE_HIT,
+    CACHE_REVALIDATE,
+    CACHE_UNAVAILABLE,
+    COALESCE_TIMEOUT,
+    BodyCollector,
+    CacheEntry,
+    HTTPCache,
+    Lookup,
+)
+from http_parser import (
+    MAX_HEADER_SIZE,
+    HEAD_TERMINATOR,
+    BODY_NONE,
+    BODY_LENGTH,
+    BODY_CHUNKED,
+    BODY_UNTIL_CLOSE,
+    BadRequestBody,
+    RequestHead,
+    ResponseHead,
+    ResponseHeadParser,
+    parse_request_head,
+    parse_response_head,
+    build_head,
+    refusal_head,
+    request_framing,
+    response_framing,
+    parse_chunk_size,
+    check_chunk_end,
+)
+from metrics import (
+    CONNECTIONS_ACTIVE,
+    CONNECTIONS_TOTAL,
+    ERRORS_TOTAL,
+    REQUESTS_TOTAL,
+    TUNNEL_SECONDS,
+    UPSTREAM_CONNECT_SECONDS,
+    record_bytes,
+    record_error,
+    record_tunnel,
+)
+from proxy_auth import AUTH_REQUIRED, ProxyAuthError, answer_challenge, authorize
+from relay import DEFAULT_RELAY_MODE, DEFAULT_WATERMARKS, relay_async
+from resolver import connect_async, listen_address
+from shaping import RateLimits
+from socks_server import (
+    CMD_CONNECT,
+    CMD_UDP_ASSOCIATE,
+    SOCKS5_VERSION,
+    REP_SUCCEEDED,
+    REP_COMMAND_NOT_SUPPORTED,
+    REP_NOT_ALLOWED,
+    HANDSHAKE_TIMEOUT,
+    SocksError,
+    SocksRequest,
+    associate_group,
+    connect_group,
+    negotiate_async,
+    reply_code_for,
+)
+from upstream_pool import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_IDLE_TIMEOUT,
+    ConnectionPool,
+    UpstreamConnection,
+)
+from upstreams import Upstream, UpstreamGroup
+
+# Size of a single socket read in the relay loops
+BUFFER_SIZE = 65536
+
+# Listen backlog for the local listeners
+LISTEN_BACKLOG = DEFAULT_BACKLOG
+
+# Threads available for blocking PySocks upstream handshakes
+HANDSHAKE_WORKERS = 256
+
+# Seconds a keep-alive client connection may sit idle between requests
+CLIENT_IDLE_TIMEOUT = 60.0
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _raise_fd_limit()
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='proxy-event-loop')
+            thread.daemon = True
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def _raise_fd_limit() -> None:
+    """Raise the soft open-file limit to the hard limit (POSIX only).
+
+    Every tunnel holds two sockets, so the common default of 1024 caps the
+    engine at roughly 500 concurrent tunnels.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+class SocketReader:
+    """Buffered reader over a non-blocking socket driven by the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket) -> None:
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+
+    async def _fill(self) -> bool:
+        data = await self.loop.sock_recv(self.sock, BUFFER_SIZE)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    async def read_until(self, separator: bytes, limit: int = MAX_HEADER_SIZE) -> bytes:
+        """Read up to and including separator.
+
+        Raises:
+            ConnectionError: If the peer closes before the separator arrives
+            ValueError: If more than limit bytes arrive without a separator
+        """
+        start = 0
+        while True:
+            index = self.buffer.find(separator, start)
+            if index >= 0:
+                end = index + len(separator)
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            if len(self.buffer) > limit:
+                raise ValueError("Header block too large")
+            start = max(0, len(self.buffer) - len(separator) + 1)
+            if not await self._fill():
+                raise ConnectionError("Connection closed unexpectedly")
+
+    async def read_exact(self, size: int) -> bytes:
+        """Read exactly size bytes."""
+        while len(self.buffer) < size:
+            if not await self._fill():
+                raise ConnectionError("Connection closed unexpectedly")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def read(self, size: int = BUFFER_SIZE) -> bytes:
+        """Read at most size bytes, serving buffered data first."""
+        if not self.buffer:
+            return await self.loop.sock_recv(self.sock, size)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def take_buffer(self) -> bytes:
+        """Return and clear any bytes read past the last parsed message."""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+async def copy_body(reader: SocketReader, destination: socket.socket, framing: str, length: int = 0,
+                    tee: Optional[Callable[[bytes], Any]] = None) -> int:
+    """Stream a message body from reader to destination without buffering it.
+
+    Args:
+        reader: Reader positioned at the start of the body
+        destination: Socket to write the body to
+        framing: One of the http_parser BODY_* framing kinds
+        length: Body length for BODY_LENGTH framing
+        tee: Also called with every piece written, e.g. to fill the cache
+
+    Returns:
+        Bytes written to destination, including chunk framing
+    """
+    loop = reader.loop
+
+    async def send(data: bytes) -> None:
+        await loop.sock_sendall(destination, data)
+        if tee is not None:
+            tee(data)
+
+    copied = 0
+    if framing == BODY_LENGTH:
+        copied = await _copy_exact(reader, send, length)
+    elif framing == BODY_CHUNKED:
+        end = b""  # CRLF after the previous chunk's data, sent along with the next size line
+        while True:
+            line = await reader.read_until(b"\r\n", limit=MAX_HEADER_SIZE)
+            size = parse_chunk_size(line)
+            line = end + line
+            if size == 0:
+                # Last chunk: forward the trailer section up to the blank line
+                while line != b"\r\n":
+                    await send(line)
+                    copied += len(line)
+                    line = await reader.read_until(b"\r\n", limit=MAX_HEADER_SIZE)
+                await send(line)
+                copied += len(line)
+                break
+            await send(line)
+            copied += len(line) + await _copy_exact(reader, send, size)
+            end = await reader.read_exact(2)
+            check_chunk_end(end)
+    elif framing == BODY_UNTIL_CLOSE:
+        while True:
+            data = await reader.read()
+            if not data:
+                break
+            await send(data)
+            copied += len(data)
+    return copied
+
+
+async def _copy_exact(reader: SocketReader, send: Callable[[bytes], Awaitable[None]], remaining: int) -> int:
+    total = remaining
+    while remaining > 0:
+        data = await reader.read(min(remaining, BUFFER_SIZE))
+        if not data:
+            raise ConnectionError("Connection closed mid-body")
+        await send(data)
+        remaining -= len(data)
+    return total
+
+
+def create_listener(server_address: Tuple[str, int], backlog: int = LISTEN_BACKLOG,
+                    reuse_port: bool = False) -> socket.socket:
+    """Create a non-blocking listening socket for server_address.
+
+    Args:
+        server_address: (host, port) to bind; host may be an IPv6 address
+        backlog: Listen backlog
+        reuse_port: Set SO_REUSEPORT so several worker processes can share the port
+    """
+    family, address = listen_address(*server_address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if hasattr(socket, 'SO_REUSEADDR') and not hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class AsyncProxyServer:
+    """Base class for event-loop proxy servers.
+
+    Mirrors the ``shutdown()``/``server_close()`` interface of the
+    socketserver classes so both engines can share ``running_servers``.
+    """
+
+    # Tunnel relay mode, one of relay.RELAY_MODES, and its per-direction buffer bounds
+    relay_mode = DEFAULT_RELAY_MODE
+    relay_watermarks = DEFAULT_WATERMARKS
+
+    # Bandwidth and new-tunnel limits, or None when nothing is limited
+    rate_limits: Optional[RateLimits] = None
+
+    # Label of this front-end in metrics
+    frontend = 'http'
+
+    def __init__(self, server_address: Tuple[str, int], upstreams: UpstreamGroup, reuse_port: bool = False,
+                 backlog: int = LISTEN_BACKLOG) -> None:
+        self.loop = get_event_loop()
+        self.upstreams = upstreams
+        self.socket = create_listener(server_address, backlog, reuse_port)
+        self.server_address = self.socket.getsockname()[:2]
+        self.connections = ConnectionTracker()
+        self._tasks: Set[asyncio.Task] = set()
+        self._accept_task: Optional[asyncio.Task] = None
+
+    def serve(self) -> None:
+        """Start accepting connections on the shared event loop."""
+        started = threading.Event()
+
+        def _start() -> None:
+            self._accept_task = self.loop.create_task(self._accept_loop())
+            started.set()
+
+        self.loop.call_soon_threadsafe(_start)
+        started.wait()
+
+    async def _accept_loop(self) -> None:
+        while True:
+            try:
+                client, address = await self.loop.sock_accept(self.socket)
+            except OSError:
+                break
+            client.setblocking(False)
+            try:
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+            task = self.loop.create_task(self._serve_client(client, address))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _serve_client(self, client: socket.socket, address: Any) -> None:
+        CONNECTIONS_TOTAL.inc(frontend=self.frontend)
+        CONNECTIONS_ACTIVE.inc(frontend=self.frontend)
+        connection = self.connections.open(client)
+        try:
+            await self.handle(client, address, connection)
+        except (OSError, ConnectionError, ValueError) as e:
+            record_error('client', e)  # Connection closed
+        finally:
+            self.connections.close(connection)
+            CONNECTIONS_ACTIVE.dec(frontend=self.frontend)
+            client.close()
+
+    async def handle(self, client: socket.socket, address: Any, connection: TrackedConnection) -> None:
+        """Serve one client connection, keeping its tracked state current. Implemented by subclasses."""
+        raise NotImplementedError
+
+    async def open_upstream(self, upstream: Upstream) -> socket.socket:
+        """Open a non-blocking TCP connection to an upstream proxy.
+
+        The outcome and connect time are recorded in the upstream group.
+        """
+        started = time.monotonic()
+        try:
+            sock = await connect_async(self.loop, upstream.host, upstream.port)
+        except OSError as e:
+            self.upstreams.record_failure(upstream)
+            record_error('upstream_connect', e)
+            raise
+        elapsed = time.monotonic() - started
+        self.upstreams.record_success(upstream, elapsed)
+        UPSTREAM_CONNECT_SECONDS.observe(elapsed, upstream=upstream.name)
+        return sock
+
+    async def _stop(self) -> None:
+        if self._accept_task is not None:
+            self._accept_task.cancel()
+            await asyncio.gather(self._accept_task, return_exceptions=True)
+        tasks: List[asyncio.Task] = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stop_accepting(self) -> None:
+        if self._accept_task is not None:
+            self._accept_task.cancel()
+            await asyncio.gather(self._accept_task, return_exceptions=True)
+        self.socket.close()
+
+    def stop_accepting(self) -> None:
+        """Stop accepting and close the listening socket; open connections carry on."""
+        asyncio.run_coroutine_threadsafe(self._stop_accepting(), self.loop).result()
+
+    def shutdown(self) -> None:
+        """Stop accepting connections and cancel active ones."""
+        future = asyncio.run_coroutine_threadsafe(self._stop(), self.loop)
+        future.result()
+
+    def server_close(self) -> None:
+        """Close the listening socket."""
+        self.socket.close()
+
+
+async def send_error(loop: asyncio.AbstractEventLoop, client: socket.socket, code: int, message: str) -> None:
+    """Send a minimal HTTP error response to the client."""
+    body = message.encode('utf-8', errors='replace')
+    response = (
+        f"HTTP/1.1 {code} {message}\r\n"
+        f"Content-Type: text/plain\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n"
+    ).encode('latin-1', errors='replace') + body
+    try:
+        await loop.sock_sendall(client, response)
+    except OSError:
+        pass
+
+
+class AsyncHTTPProxy(AsyncProxyServer):
+    """HTTP proxy that forwards every request to an upstream HTTP proxy of its group.
+
+    Plain HTTP requests reuse pooled keep-alive connections to the upstream,
+    and client connections stay open between requests when the client asks.
+    """
+
+    # Response cache for plain HTTP GET requests, or None
+    cache: Optional[HTTPCache] = None
+
+    def __init__(self, server_address: Tuple[str, int], upstreams: UpstreamGroup,
+                 pool_size: int = DEFAULT_POOL_SIZE, pool_idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 reuse_port: bool = False, backlog: int = LISTEN_BACKLOG) -> None:
+        super().__init__(server_address, upstreams, reuse_port, backlog)
+        self.pool = ConnectionPool(pool_size, pool_idle_timeout)
+
+    async def acquire_upstream(self, tried: List[Upstream]) -> Tuple[Upstream, UpstreamConnection]:
+        """Pick an upstream not in tried and return a pooled or new connection to it.
+
+        Upstreams that cannot be reached are appended to tried and the next
+        one is picked.
+
+        Raises:
+            OSError: If no upstream is left to try
+        """
+        error: Optional[OSError] = None
+        while True:
+            upstream = self.upstreams.pick(tried)
+            if upstream is None:
+                raise error or OSError("No upstream proxy available")
+            connection = self.pool.acquire(upstream.key)
+            if connection is not None:
+                return upstream, connection
+            try:
+                sock = await self.open_upstream(upstream)
+            except OSError as e:
+                tried.append(upstream)
+                error = e
+                continue
+            return upstream, UpstreamConnection(sock, SocketReader(self.loop, sock))
+
+    async def handle(self, client: socket.socket, address: Any, connection: TrackedConnection) -> None:
+        reader = SocketReader(self.loop, client)
+        while True:
+            try:
+                raw = await asyncio.wait_for(reader.read_until(HEAD_TERMINATOR), CLIENT_IDLE_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError):
+                return  # Idle keep-alive connection or client went away
+            self.connections.set_state(connection, STATE_ACTIVE)
+            try:
+                request = parse_request_head(raw)
+            except ValueError:
+                await send_error(self.loop, client, 400, "Bad request")
+                return
+
+            if request.method.upper() == 'CONNECT':
+                await self._connect(client, reader, request.target, address[0])
+                return
+            if not await self._forward(client, reader, request):
+                return
+            if not reader.buffer:
+                self.connections.set_state(connection, STATE_IDLE)
+
+    async def _connect(self, client: socket.socket, reader: SocketReader, target: str, client_ip: str) -> None:
+        REQUESTS_TOTAL.inc(frontend=self.frontend, kind='connect')
+        if self.rate_limits is not None and not self.rate_limits.allow_connect(client_ip):
+            ERRORS_TOTAL.inc(stage='connect_rate', error='limited')
+            await send_error(self.loop, client, 429, "Too many new connections")
+            return
+        tried: List[Upstream] = []
+        challenged: List[Upstream] = []
+        refusal: Optional[ResponseHead] = None
+        while True:
+            try:
+                upstream, connection = await self.acquire_upstream(tried)
+            except OSError as e:
+                if refusal is not None:
+                    # Out of upstreams: pass on the last refusal (and any challenge) as is
+                    await self.loop.sock_sendall(client, refusal_head(refusal))
+                else:
+                    await send_error(self.loop, client, 502, f"Upstream proxy connection failed: {e}")
+                return
+            headers, credentials = authorize([('Host', target)], upstream.auth, 'CONNECT', target)
+            started = time.monotonic()
+            try:
+                await self.loop.sock_sendall(connection.sock, build_head(f"CONNECT {target} HTTP/1.1", headers))
+                # Parse the response head however the upstream splits it into segments
+                parser = ResponseHeadParser()
+                response = None
+                while response is None:
+                    data = await connection.reader.read()
+                    if not data:
+                        raise ConnectionError("Upstream proxy closed the connection during CONNECT")
+                    response = parser.feed(data)
+            except (OSError, ConnectionError, ValueError) as e:
+                connection.close()
+                if not connection.reused:
+                    # A stale pooled connection is retried; a fresh one failing counts against the upstream
+                    self.upstreams.record_failure(upstream)
+                    record_error('upstream_handshake', e)
+                    tried.append(upstream)
+                continue
+            if response.status == AUTH_REQUIRED:
+                connection.close()
+                try:
+                    answer_challenge(upstream.auth, response, credentials, upstream in challenged)
+                except ProxyAuthError as e:
+                    record_error('upstream_auth', e)
+                    refusal = response
+                    tried.append(upstream)
+                    continue
+                challenged.append(upstream)
+                continue  # Retry with the credentials the upstream asked for
+            if not 200 <= response.status < 300:
+                # The upstream refused this destination; try the next one
+                ERRORS_TOTAL.inc(stage='upstream_refused', error=f"HTTP {response.status}")
+                connection.close()
+                refusal = response
+                tried.append(upstream)
+                continue
+            self.upstreams.record_success(upstream, time.monotonic() - started)
+            break
+
+        try:
+            with self.upstreams.using(upstream, client, connection.sock):
+                # Forward what the client already sent (e.g. its TLS ClientHello) right away,
+                # then answer it along with any tunnel bytes that came with the upstream's head
+                pending = reader.take_buffer()
+                if pending:
+                    await self.loop.sock_sendall(connection.sock, pending)
+                await self.loop.sock_sendall(client, b"HTTP/1.1 200 Connection established\r\n\r\n" + parser.rest)
+                started = time.monotonic()
+                shaping = self.rate_limits.tunnel(client_ip, upstream.name) if self.rate_limits else None
+                moved = await relay_async(self.loop, client, connection.sock, self.relay_mode, self.relay_watermarks,
+                                          shaping)
+                record_tunnel(self.frontend, time.monotonic() - started,
+                              (moved[0] + len(pending), moved[1] + len(parser.rest)))
+        finally:
+            connection.close()
+
+    async def _forward(self, client: socket.socket, reader: SocketReader, request: RequestHead) -> bool:
+        """Relay one plain HTTP request and its response, streaming both bodies.
+
+        Returns:
+            Whether the client connection can be kept alive for another request
+        """
+        try:
+            framing, length = request_framing(request)
+        except ValueError:
+            await send_error(self.loop, client, 400, "Bad request")
+            return False
+
+        REQUESTS_TOTAL.inc(frontend=self.frontend, kind='http')
+        if self.cache is None:
+            return await self._fetch(client, reader, request, framing, length, None)
+        lookup = await self._cache_lookup(request)
+        try:
+            if lookup.action == CACHE_HIT:
+                return await self._send_cached(client, request, lookup)
+            if lookup.action == CACHE_UNAVAILABLE:
+                await send_error(self.loop, client, 504, "Not in cache")
+                return False
+            return await self._fetch(client, reader, request, framing, length, lookup)
+        finally:
+            lookup.release()
+
+    async def _cache_lookup(self, request: RequestHead) -> Lookup:
+        """Ask the cache about a request, waiting for another request's fetch of the same URL."""
+        cache = cast(HTTPCache, self.cache)
+        lookup = cache.lookup(request)
+        if lookup.flight is not None:
+            landed = self.loop.create_future()
+
+            def wake() -> None:
+                if not landed.done():
+                    landed.set_result(None)
+            lookup.flight.add_done_callback(lambda: self.loop.call_soon_threadsafe(wake))
+            try:
+                await asyncio.wait_for(landed, COALESCE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            lookup = cache.lookup(request, coalesce=False)
+            cache.count_coalesced(lookup)
+        return lookup
+
+    async def _send_cached(self, client: socket.socket, request: RequestHead, lookup: Lookup) -> bool:
+        """Answer a request from a cache entry: the body from memory or with sendfile() from disk."""
+        entry = cast(CacheEntry, lookup.entry)
+        not_modified = entry.not_modified(request)
+        keep_alive = request.keep_alive(request.version)
+        headers = entry.response_headers(time.time(), not_modified) + [('X-Cache', 'HIT')]
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+        elif request.version == 'HTTP/1.0':
+            headers.append(('Connection', 'keep-alive'))
+        head = build_head('HTTP/1.1 304 Not Modified' if not_modified else entry.status_line, headers)
+        await self.loop.sock_sendall(client, head)
+        sent = len(head)
+        if not not_modified and request.method.upper() == 'GET' and entry.length:
+            if entry.body is not None:
+                await self.loop.sock_sendall(client, entry.body)
+            else:
+                await self.loop.sock_sendfile(client, cast(BinaryIO, lookup.body_file), 0, entry.length)
+            sent += entry.length
+        record_bytes(self.frontend, 0, sent)
+        return keep_alive
+
+    async def _fetch(self, client: socket.socket, reader: SocketReader, request: RequestHead,
+                     framing: str, length: int, lookup: Optional[Lookup]) -> bool:
+        """Forward a request to an upstream and relay its response."""
+        start_line = f"{request.method} {request.target} HTTP/1.1"
+        headers = request.forward_headers()
+        if lookup is not None:
+            headers = lookup.forward_headers(headers)
+        tried: List[Upstream] = []
+        challenged: List[Upstream] = []
+        auth_error: Optional[ProxyAuthError] = None
+        while True:
+            try:
+                upstream, connection = await self.acquire_upstream(tried)
+            except OSError as e:
+                if auth_error is not None:
+                    await send_error(self.loop, client, 502, f"Upstream proxy authentication failed: {auth_error}")
+                else:
+                    await send_error(self.loop, client, 502, f"Upstream proxy connection failed: {e}")
+                return False
+            upstream_headers, credentials = authorize(headers, upstream.auth, request.method, request.target)
+            head = build_head(start_line, upstream_headers)
+            with self.upstreams.using(upstream, client, connection.sock):
+                started = time.monotonic()
+                try:
+                    await self.loop.sock_sendall(connection.sock, head)
+                    try:
+                        sent = len(head) + await copy_body(reader, connection.sock, framing, length)
+                    except ValueError as e:
+                        raise BadRequestBody(str(e)) from e
+                    response = await self._read_response_head(client, connection.reader)
+                    response_body, response_length = response_framing(response, request.method)
+                except BadRequestBody as e:
+                    connection.close()
+                    record_error('client_request', e)
+                    await send_error(self.loop, client, 400, f"Bad request body: {e}")
+                    return False
+                except (OSError, ConnectionError, ValueError) as e:
+                    connection.close()
+                    record_error('upstream_request', e)
+                    if isinstance(e, ValueError) or framing != BODY_NONE:
+                        await send_error(self.loop, client, 502, f"Invalid upstream response: {e}")
+                        return False
+                    # The upstream may close a pooled connection while it sits idle; replay
+                    # on a fresh connection, or on another upstream if a fresh one failed
+                    if not connection.reused:
+                        self.upstreams.record_failure(upstream)
+                        tried.append(upstream)
+                    continue
+                if response.status == AUTH_REQUIRED and upstream.auth is not None:
+                    connection.close()
+                    try:
+                        answer_challenge(upstream.auth, response, credentials, upstream in challenged)
+                        if framing != BODY_NONE:
+                            raise ProxyAuthError("Upstream proxy asked for other credentials after the request body was sent")
+                    except ProxyAuthError as e:
+                        record_error('upstream_auth', e)
+                        if framing != BODY_NONE:
+                            await send_error(self.loop, client, 502, f"Upstream proxy authentication failed: {e}")
+                            return False
+                        auth_error = e
+                        tried.append(upstream)
+                        continue
+                    challenged.append(upstream)
+                    continue  # Retry with the credentials the upstream asked for
+                if framing == BODY_NONE:
+                    self.upstreams.record_success(upstream, time.monotonic() - started)
+                record_bytes(self.frontend, sent, 0)
+                return await self._relay_response(client, request, upstream, connection, response,
+                                                  response_body, response_length, lookup)
+
+    async def _relay_response(self, client: socket.socket, request: RequestHead, upstream: Upstream,
+                              connection: UpstreamConnection, response: ResponseHead,
+                              framing: str, length: int, lookup: Optional[Lookup] = None) -> bool:
+        if lookup is not None and lookup.action == CACHE_REVALIDATE and response.status == 304:
+            # Still current: refresh the entry and answer from it
+            cast(HTTPCache, self.cache).refresh(lookup, response)
+            if response.keep_alive(response.version):
+                self.pool.release(upstream.key, connection)
+            else:
+                connection.close()
+            return await self._send_cached(client, request, lookup)
+
+        keep_alive = request.keep_alive(request.version) and framing != BODY_UNTIL_CLOSE
+        headers = response.forward_headers()
+        collector: Optional[BodyCollector] = None
+        if lookup is not None and lookup.action != CACHE_BYPASS:
+            headers.append(('X-Cache', 'MISS'))
+            collector = cast(HTTPCache, self.cache).collector(lookup, request, response, framing, length)
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+        elif request.version == 'HTTP/1.0':
+            headers.append(('Connection', 'keep-alive'))
+
+        try:
+            response_head = build_head(response.start_line, headers)
+            await self.loop.sock_sendall(client, response_head)
+            copied = await copy_body(connection.reader, client, framing, length,
+                                     collector.feed if collector is not None else None)
+            record_bytes(self.frontend, 0, len(response_head) + copied)
+            if collector is not None:
+                # Off the loop: a stored body may be written to the disk tier
+                await self.loop.run_in_executor(None, cast(HTTPCache, self.cache).store, collector)
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            if collector is not None:
+                collector.abandon()  # No-op once stored
+
+        if response.keep_alive(response.version) and framing != BODY_UNTIL_CLOSE:
+            self.pool.release(upstream.key, connection)
+        else:
+            connection.close()
+        return keep_alive
+
+    async def _read_response_head(self, client: socket.socket, upstream_reader: SocketReader) -> ResponseHead:
+        """Read the final response head, relaying interim 1xx responses."""
+        while True:
+            raw = await upstream_reader.read_until(HEAD_TERMINATOR)
+            response = parse_response_head(raw)
+            if 100 <= response.status < 200 and response.status != 101:
+                await self.loop.sock_sendall(client, raw)
+                continue
+            return response
+
+    async def _stop(self) -> None:
+        await super()._stop()
+        self.pool.close_all()
+
+
+class AsyncSocksProxy(AsyncProxyServer):
+    """SOCKS4/4a/5 front-end that chains each request to the upstream proxy.
+
+    PySocks performs the blocking upstream handshake on a dedicated thread
+    pool; the established tunnel is then relayed on the event loop.
+    """
+
+    frontend = 'socks'
+
+    def __init__(self, server_address: Tuple[str, int], upstreams: UpstreamGroup, reuse_port: bool = False,
+                 backlog: int = LISTEN_BACKLOG) -> None:
+        super().__init__(server_address, upstreams, reuse_port, backlog)
+        self.executor = ThreadPoolExecutor(max_workers=HANDSHAKE_WORKERS, thread_name_prefix='socks-upstream')
+
+    async def handle(self, client: socket.socket, address: Any, connection: TrackedConnection) -> None:
+        reader = SocketReader(self.loop, client)
+        try:
+            request = await asyncio.wait_for(negotiate_async(reader), HANDSHAKE_TIMEOUT)
+        except SocksError as e:
+            record_error('handshake', e)
+            reply = e.failure_reply()
+            if reply:
+                await self.loop.sock_sendall(client, reply)
+            return
+        except (asyncio.TimeoutError, UnicodeError) as e:
+            record_error('handshake', e)
+            return
+        self.connections.set_state(connection, STATE_ACTIVE)
+
+        if request.command == CMD_CONNECT:
+            await self._connect(client, reader, request, address[0])
+        elif request.command == CMD_UDP_ASSOCIATE and request.version == SOCKS5_VERSION:
+            await self._associate(client, reader, request, address)
+        else:
+            await self.loop.sock_sendall(client, request.reply(REP_COMMAND_NOT_SUPPORTED))
+
+    async def _connect(self, client: socket.socket, reader: SocketReader, request: SocksRequest, client_ip: str) -> None:
+        REQUESTS_TOTAL.inc(frontend=self.frontend, kind='connect')
+        if self.rate_limits is not None and not self.rate_limits.allow_connect(client_ip):
+            ERRORS_TOTAL.inc(stage='connect_rate', error='limited')
+            await self.loop.sock_sendall(client, request.reply(REP_NOT_ALLOWED))
+            return
+        upstreams = self.upstreams  # Fixed for this connection even if the server is switched
+        try:
+            upstream, sock = await self.loop.run_in_executor(
+                self.executor, connect_group, upstreams, request.host, request.port)
+        except (OSError, socks.ProxyError) as e:
+            await self.loop.sock_sendall(client, request.reply(reply_code_for(e)))
+            return
+        try:
+            with upstreams.using(upstream, client, sock):
+                sock.setblocking(False)
+                await self.loop.sock_sendall(client, request.reply(REP_SUCCEEDED))
+                pending = reader.take_buffer()
+                if pending:
+                    await self.loop.sock_sendall(sock, pending)
+                started = time.monotonic()
+                shaping = self.rate_limits.tunnel(client_ip, upstream.name) if self.rate_limits else None
+                moved = await relay_async(self.loop, client, sock, self.relay_mode, self.relay_watermarks, shaping)
+                record_tunnel(self.frontend, time.monotonic() - started, (moved[0] + len(pending), moved[1]))
+        finally:
+            sock.close()
+
+    async def _associate(self, client: socket.socket, reader: SocketReader, request: SocksRequest, address: Any) -> None:
+        REQUESTS_TOTAL.inc(frontend=self.frontend, kind='udp')
+        upstreams = self.upstreams
+        try:
+            upstream, association = await self.loop.run_in_executor(
+                self.executor, associate_group, upstreams, address[0], client.getsockname()[0])
+        except SocksError as e:
+            await self.loop.sock_sendall(client, request.reply(e.reply))
+            return
+        except (OSError, socks.ProxyError) as e:
+            await self.loop.sock_sendall(client, request.reply(reply_code_for(e)))
+            return
+        try:
+            with upstreams.using(upstream, client):
+                await self.loop.sock_sendall(client, request.reply(REP_SUCCEEDED, *association.bound_address))
+                association.start()
+                started = time.monotonic()
+                # The association lives as long as the control connection
+                try:
+                    while await reader.read():
+                        pass
+                finally:
+                    TUNNEL_SECONDS.observe(time.monotonic() - started, frontend=self.frontend)
+        finally:
+            association.close()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False)
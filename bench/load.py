@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Load test for the local proxy forwarding paths
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Starts a stand-in origin server and stand-in upstream proxies (HTTP and
+SOCKS5) on loopback, runs the local proxy under test in its own process and
+drives it from an asyncio load generator. Each scenario reports requests/s,
+MB/s, p50/p99 latency and the proxy process's CPU time and peak RSS, so the
+numbers are not mixed with the load generator's own cost.
+
+Scenarios:
+    http-get       plain GET requests through the HTTP front-end
+    http-connect   GET requests through a CONNECT tunnel on the HTTP front-end
+    socks-connect  GET requests through a SOCKS5 tunnel on the SOCKS front-end
+
+Everything runs offline on one machine.
+
+Usage:
+    python bench/load.py [--scenario all] [--engine asyncio threaded]
+                         [--concurrency 1 50] [--payload 1k 64k 1m]
+                         [--requests-per-conn 1 100] [--duration 5] [--json] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import struct
+import sys
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxy_server import ENGINES, start_profile_proxy, stop_all_servers  # noqa: E402
+from relay import DEFAULT_RELAY_MODE, RELAY_MODES  # noqa: E402
+
+SCENARIOS = ('http-get', 'http-connect', 'socks-connect')
+
+# Seconds a single request may take before it counts as an error
+REQUEST_TIMEOUT = 30.0
+
+CHUNK = 256 * 1024
+
+HEAD_END = b'\r\n\r\n'
+
+
+def parse_size(text: str) -> int:
+    """Parse a payload size such as 512, 64k or 1m into bytes."""
+    units = {'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024}
+    text = text.strip().lower().rstrip('b')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# --- Stand-in servers -------------------------------------------------------
+
+async def _read_head(reader: asyncio.StreamReader) -> Optional[bytes]:
+    try:
+        return await reader.readuntil(HEAD_END)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+
+
+_payloads: Dict[int, bytes] = {}
+
+
+def _payload(size: int) -> bytes:
+    payload = _payloads.get(size)
+    if payload is None:
+        payload = _payloads[size] = b'x' * size
+    return payload
+
+
+async def _serve_get(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                     head: Optional[bytes]) -> None:
+    """Answer keep-alive GET /<size> requests with size bytes."""
+    while head:
+        target = head.split(b' ', 2)[1]
+        path = target.rsplit(b'/', 1)[-1]
+        size = int(path) if path.isdigit() else 0
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % size)
+        writer.write(_payload(size))
+        await writer.drain()
+        head = await _read_head(reader)
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(CHUNK)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        writer.write_eof()
+    except (ConnectionError, OSError):
+        # Reset: close so the other direction sees EOF instead of hanging
+        writer.close()
+
+
+async def _tunnel(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int,
+                  reply: bytes) -> None:
+    origin_reader, origin_writer = await asyncio.open_connection(host, port)
+    writer.write(reply)
+    await asyncio.gather(_pipe(reader, origin_writer), _pipe(origin_reader, writer))
+    origin_writer.close()
+
+
+async def _origin_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        await _serve_get(reader, writer, await _read_head(reader))
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _http_upstream_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Stand-in HTTP proxy: CONNECT is tunnelled to the origin, plain GETs are answered directly."""
+    try:
+        head = await _read_head(reader)
+        if head and head.startswith(b'CONNECT '):
+            host, _, port = head.split(b' ', 2)[1].decode('latin-1').rpartition(':')
+            await _tunnel(reader, writer, host, int(port), b'HTTP/1.1 200 Connection established\r\n\r\n')
+        else:
+            await _serve_get(reader, writer, head)
+    except (ConnectionError, OSError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _socks_upstream_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Stand-in SOCKS5 proxy without authentication, CONNECT only."""
+    try:
+        _, count = await reader.readexactly(2)
+        await reader.readexactly(count)
+        writer.write(b'\x05\x00')
+        _, _, _, atyp = await reader.readexactly(4)
+        if atyp == 1:
+            host = socket.inet_ntoa(await reader.readexactly(4))
+        elif atyp == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode('idna')
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        port, = struct.unpack('!H', await reader.readexactly(2))
+        await _tunnel(reader, writer, host, port, b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+# asyncio.start_server keeps only weak references to its handler tasks
+_handler_tasks: Set['asyncio.Task[None]'] = set()
+
+
+def _keep_alive(handler: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+                ) -> Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]:
+    """Hold a strong reference to each handler task so idle tunnels are not garbage collected."""
+    async def run(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        _handler_tasks.add(task)
+        try:
+            await handler(reader, writer)
+        finally:
+            _handler_tasks.discard(task)
+    return run
+
+
+def _standins_main(ready: Connection) -> None:
+    """Process running the origin and both stand-in upstreams until terminated."""
+    async def run() -> None:
+        servers = [
+            await asyncio.start_server(_keep_alive(handler), '127.0.0.1', 0, backlog=1024)
+            for handler in (_origin_client, _http_upstream_client, _socks_upstream_client)
+        ]
+        ready.send([server.sockets[0].getsockname()[1] for server in servers])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+# --- Proxy under test -------------------------------------------------------
+
+def _usage() -> Dict[str, float]:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is KiB on Linux
+    return {'cpu_s': usage.ru_utime + usage.ru_stime, 'max_rss_mb': usage.ru_maxrss / 1024}
+
+
+def _proxy_main(profile: Dict[str, str], local_port: int, options: Dict[str, Any],
+                control: Connection) -> None:
+    """Process running the local proxy; answers 'usage' and 'stop' on the control pipe."""
+    # The threaded engine logs every request; keep the cost but not the noise
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        start_profile_proxy({'bench': profile}, local_port, **options)
+    except (OSError, ValueError) as e:
+        control.send(str(e))
+        return
+    control.send(None)
+    while True:
+        command = control.recv()
+        if command == 'usage':
+            control.send(_usage())
+        else:
+            break
+    stop_all_servers()
+
+
+class ProxyProcess:
+    """The local proxy under test, isolated in its own process."""
+
+    def __init__(self, profile: Dict[str, str], options: Dict[str, Any]) -> None:
+        self.port = _free_port()
+        self._control, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_proxy_main, args=(profile, self.port, options, child), daemon=True)
+        self._process.start()
+        child.close()
+        error = self._control.recv()
+        if error is not None:
+            self._process.join()
+            raise OSError(error)
+
+    def usage(self) -> Dict[str, float]:
+        self._control.send('usage')
+        return self._control.recv()
+
+    def stop(self) -> None:
+        self._control.send('stop')
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+
+# --- Load generator ---------------------------------------------------------
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(HEAD_END)
+    length = 0
+    for line in head.split(b'\r\n'):
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    received = 0
+    while received < length:
+        data = await reader.read(min(CHUNK, length - received))
+        if not data:
+            raise ConnectionError("response truncated")
+        received += len(data)
+    return received
+
+
+async def _open(scenario: str, proxy_port: int, origin_port: int
+                ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    if scenario == 'http-connect':
+        writer.write(b'CONNECT 127.0.0.1:%d HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n\r\n' % (origin_port, origin_port))
+        head = await reader.readuntil(HEAD_END)
+        if head.split(b' ', 2)[1:2] != [b'200']:
+            raise ConnectionError(f"CONNECT refused: {head.splitlines()[0]!r}")
+    elif scenario == 'socks-connect':
+        writer.write(b'\x05\x01\x00')
+        if await reader.readexactly(2) != b'\x05\x00':
+            raise ConnectionError("SOCKS5 method rejected")
+        writer.write(b'\x05\x01\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', origin_port))
+        reply = await reader.readexactly(10)
+        if reply[1] != 0:
+            raise ConnectionError(f"SOCKS5 CONNECT failed with reply {reply[1]}")
+    return reader, writer
+
+
+async def _client(scenario: str, proxy_port: int, origin_port: int, payload: int, per_conn: int,
+                  deadline: float, latencies: List[float], totals: Dict[str, int]) -> None:
+    if scenario == 'http-get':
+        request = (b'GET http://127.0.0.1:%d/%d HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n\r\n'
+                   % (origin_port, payload, origin_port))
+    else:
+        request = b'GET /%d HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % payload
+
+    while time.perf_counter() < deadline:
+        writer: Optional[asyncio.StreamWriter] = None
+        try:
+            # Connection setup counts towards the first request's latency
+            started = time.perf_counter()
+            reader, writer = await asyncio.wait_for(_open(scenario, proxy_port, origin_port), REQUEST_TIMEOUT)
+            for _ in range(per_conn):
+                writer.write(request)
+                totals['bytes'] += await asyncio.wait_for(_read_response(reader), REQUEST_TIMEOUT)
+                now = time.perf_counter()
+                latencies.append(now - started)
+                started = now
+                if now >= deadline:
+                    break
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                asyncio.TimeoutError, ValueError):
+            totals['errors'] += 1
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+async def drive(scenario: str, proxy_port: int, origin_port: int, concurrency: int, payload: int,
+                per_conn: int, duration: float) -> Dict[str, Any]:
+    """Run concurrency clients for duration seconds and summarise the results."""
+    latencies: List[float] = []
+    totals = {'bytes': 0, 'errors': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        _client(scenario, proxy_port, origin_port, payload, per_conn, deadline, latencies, totals)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def _percentile(fraction: float) -> Optional[float]:
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+
+    return {
+        'requests': len(latencies),
+        'errors': totals['errors'],
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'mb_per_s': round(totals['bytes'] / elapsed / (1024 * 1024), 2),
+        'p50_ms': _percentile(0.50),
+        'p99_ms': _percentile(0.99),
+    }
+
+
+def run_case(scenario: str, engine: str, relay_mode: str, ports: List[int], concurrency: int,
+             payload: int, per_conn: int, duration: float) -> Dict[str, Any]:
+    """Benchmark one scenario/engine/load combination on a fresh proxy process."""
+    origin_port, http_port, socks_port = ports
+    if scenario == 'socks-connect':
+        profile = {'type': 'socks5', 'host': '127.0.0.1', 'port': str(socks_port)}
+    else:
+        profile = {'type': 'http', 'host': '127.0.0.1', 'port': str(http_port)}
+    proxy = ProxyProcess(profile, {'engine': engine, 'relay_mode': relay_mode})
+    try:
+        before = proxy.usage()
+        result = asyncio.run(drive(scenario, proxy.port, origin_port, concurrency, payload, per_conn, duration))
+        after = proxy.usage()
+    finally:
+        proxy.stop()
+    return {
+        'scenario': scenario,
+        'engine': engine,
+        'concurrency': concurrency,
+        'payload_bytes': payload,
+        'requests_per_conn': per_conn,
+        **result,
+        'proxy_cpu_s': round(after['cpu_s'] - before['cpu_s'], 3),
+        'proxy_max_rss_mb': round(after['max_rss_mb'], 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Load test the local proxy forwarding paths')
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS + ('all',), default=['all'], help='Scenarios to run')
+    parser.add_argument('--engine', nargs='+', choices=ENGINES, default=list(ENGINES), help='Engines to test')
+    parser.add_argument('--relay', choices=RELAY_MODES, default=DEFAULT_RELAY_MODE, help='Tunnel relay mode')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 50], help='Concurrent client connections')
+    parser.add_argument('--payload', nargs='+', type=parse_size, default=[parse_size('1k'), parse_size('1m')],
+                        help='Response sizes, e.g. 1k 64k 1m')
+    parser.add_argument('--requests-per-conn', nargs='+', type=int, default=[1, 100],
+                        help='Requests sent on each client connection before it is closed (1 = full churn)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per case')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--output', type=str, default=None, help='Also write the JSON results to this file')
+    args = parser.parse_args()
+
+    scenarios = list(SCENARIOS) if 'all' in args.scenario else args.scenario
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    standins = multiprocessing.Process(target=_standins_main, args=(sender,), daemon=True)
+    standins.start()
+    ports = receiver.recv()
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for scenario in scenarios:
+            for engine in args.engine:
+                for concurrency in args.concurrency:
+                    for payload in args.payload:
+                        for per_conn in args.requests_per_conn:
+                            result = run_case(scenario, engine, args.relay, ports, concurrency, payload,
+                                              per_conn, args.duration)
+                            results.append(result)
+                            if not args.json:
+                                print(f"{scenario:<14} {engine:<9} c={concurrency:<4} size={payload:<8} "
+                                      f"per-conn={per_conn:<4} {result['rps']:>9.1f} req/s "
+                                      f"{result['mb_per_s']:>8.2f} MB/s p50={result['p50_ms']}ms "
+                                      f"p99={result['p99_ms']}ms cpu={result['proxy_cpu_s']}s "
+                                      f"rss={result['proxy_max_rss_mb']}MB errors={result['errors']}")
+    finally:
+        standins.terminate()
+        standins.join()
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'relay': args.relay,
+        'duration': args.duration,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
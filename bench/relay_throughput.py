@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Throughput comparison for the tunnel relay implementations
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Pushes a payload over loopback through each relay (source -> relay -> sink)
+and reports MB/s. 'legacy' is the original select() + recv(4096)/send loop
+that the relay module replaced.
+
+Usage:
+    python bench/relay_throughput.py [--size-mb 512] [--runs 3] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import select
+import socket
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relay import relay_blocking, relay_async, splice_supported  # noqa: E402
+
+CHUNK = 256 * 1024
+
+
+def legacy_relay(client_sock: socket.socket, upstream_sock: socket.socket) -> None:
+    """The pre-relay.py loop from HTTPProxyHandler._forward_data."""
+    try:
+        while True:
+            ready, _, _ = select.select([client_sock, upstream_sock], [], [], 1)
+            if client_sock in ready:
+                data = client_sock.recv(4096)
+                if not data:
+                    break
+                upstream_sock.send(data)
+            if upstream_sock in ready:
+                data = upstream_sock.recv(4096)
+                if not data:
+                    break
+                client_sock.send(data)
+    except Exception:
+        pass
+    finally:
+        client_sock.close()
+        upstream_sock.close()
+
+
+def _listener() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    return sock
+
+
+def _async_relay(mode: str) -> Callable[[socket.socket, socket.socket], None]:
+    def run(client: socket.socket, upstream: socket.socket) -> None:
+        client.setblocking(False)
+        upstream.setblocking(False)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(relay_async(loop, client, upstream, mode))
+        finally:
+            loop.close()
+            client.close()
+            upstream.close()
+    return run
+
+
+def _blocking_relay(mode: str) -> Callable[[socket.socket, socket.socket], None]:
+    def run(client: socket.socket, upstream: socket.socket) -> None:
+        try:
+            relay_blocking(client, upstream, mode)
+        finally:
+            client.close()
+            upstream.close()
+    return run
+
+
+def measure(relay: Callable[[socket.socket, socket.socket], None], size: int) -> float:
+    """Return seconds needed to move size bytes through relay."""
+    sink_listener = _listener()
+    relay_listener = _listener()
+    received = [0]
+
+    def sink() -> None:
+        conn, _ = sink_listener.accept()
+        buffer = bytearray(CHUNK)
+        while True:
+            count = conn.recv_into(buffer)
+            if not count:
+                break
+            received[0] += count
+        conn.close()
+
+    def relay_side() -> None:
+        client, _ = relay_listener.accept()
+        upstream = socket.create_connection(sink_listener.getsockname())
+        relay(client, upstream)
+
+    threads = [threading.Thread(target=sink), threading.Thread(target=relay_side)]
+    for thread in threads:
+        thread.start()
+
+    source = socket.create_connection(relay_listener.getsockname())
+    payload = memoryview(bytearray(CHUNK))
+    start = time.perf_counter()
+    sent = 0
+    while sent < size:
+        sent += source.send(payload[:min(CHUNK, size - sent)])
+    source.shutdown(socket.SHUT_WR)
+    threads[0].join()
+    elapsed = time.perf_counter() - start
+    source.close()
+    threads[1].join()
+    sink_listener.close()
+    relay_listener.close()
+    if received[0] != size:
+        raise RuntimeError(f"relay lost data: {received[0]} of {size} bytes")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Compare tunnel relay throughput')
+    parser.add_argument('--size-mb', type=int, default=512, help='Payload per run in MiB')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per relay (best is reported)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    relays: Dict[str, Callable[[socket.socket, socket.socket], None]] = {
+        'legacy select+recv(4096)': legacy_relay,
+        'threaded copy': _blocking_relay('copy'),
+        'asyncio copy': _async_relay('copy'),
+    }
+    if splice_supported():
+        relays['threaded splice'] = _blocking_relay('splice')
+        relays['asyncio splice'] = _async_relay('splice')
+
+    size = args.size_mb * 1024 * 1024
+    results: List[Dict[str, object]] = []
+    for name, relay in relays.items():
+        best = min(measure(relay, size) for _ in range(args.runs))
+        results.append({'relay': name, 'seconds': round(best, 4), 'mb_per_s': round(args.size_mb / best, 1)})
+        if not args.json:
+            print(f"{name:<28} {args.size_mb / best:10.1f} MiB/s")
+
+    if args.json:
+        print(json.dumps({'size_mb': args.size_mb, 'runs': args.runs, 'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
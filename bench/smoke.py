@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Smoke test for starting the local proxy from the command line
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Runs `main.py use` the way people do, in its own process against a
+throwaway profile store and the stand-in origin and upstream of
+bench/load.py, once per output mode (rich and plain tables, ndjson) and
+with the optional local proxy flags that change the starting panel. Each
+run must serve a plain GET and a CONNECT tunnel, then stop cleanly on
+Ctrl+C. Catches a command that breaks before its listener comes up.
+
+Usage:
+    python bench/smoke.py [--timeout 15]
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load import HEAD_END, _free_port, _standins_main  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+# Output modes and extra flags each run starts `use` with
+CASES = {
+    'rich': [],
+    'plain': ['--plain'],
+    'ndjson': ['--output', 'ndjson'],
+    'limits': ['--plain', '--client-rate', '1m', '--upstream-rate', 'smoke=2m', '--connect-rate', '50',
+               '--metrics-port', '0'],
+    'threaded': ['--plain', '--engine', 'threaded'],
+    'workers': ['--plain', '--workers', '2'],
+}
+
+# Bytes each GET asks the stand-in origin for
+BODY_SIZE = 1024
+
+
+def _wait_listening(port: int, process: subprocess.Popen, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def _read_response(sock: socket.socket) -> Tuple[bytes, int]:
+    """Read one response; returns (status line, body bytes)."""
+    data = b''
+    while HEAD_END not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed before the response head")
+        data += chunk
+    head, body = data.split(HEAD_END, 1)
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    while len(body) < length:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        body += chunk
+    return head.split(b'\r\n', 1)[0], len(body)
+
+
+def _check_traffic(port: int, origin_port: int) -> Optional[str]:
+    """Send a plain GET and a tunnelled GET through the proxy; returns what went wrong, if anything."""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(b'GET http://127.0.0.1:%d/%d HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % (origin_port, BODY_SIZE))
+        status, size = _read_response(sock)
+        if b' 200 ' not in status + b' ' or size != BODY_SIZE:
+            return f"plain GET: {status!r}, {size} bytes"
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(b'CONNECT 127.0.0.1:%d HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % origin_port)
+        status, _ = _read_response(sock)
+        if b' 200 ' not in status + b' ':
+            return f"CONNECT: {status!r}"
+        sock.sendall(b'GET /%d HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % BODY_SIZE)
+        status, size = _read_response(sock)
+        if size != BODY_SIZE:
+            return f"tunnelled GET: {status!r}, {size} bytes"
+    return None
+
+
+def run_case(name: str, flags: List[str], env: Dict[str, str], origin_port: int, timeout: float) -> Optional[str]:
+    """Start `use` with flags, drive some traffic and stop it; returns what went wrong, if anything."""
+    port = _free_port()
+    if '--metrics-port' in flags:
+        flags = [str(_free_port()) if flag == '0' else flag for flag in flags]
+    output, rest = [], flags
+    if rest and rest[0] == '--plain':
+        output, rest = ['--plain'], rest[1:]
+    process = subprocess.Popen([sys.executable, MAIN] + output + ['use', 'smoke', '--listen', str(port)] + rest,
+                               env=env, cwd=ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True)
+    try:
+        if not _wait_listening(port, process, timeout):
+            problem = "the listener never came up"
+        else:
+            try:
+                problem = _check_traffic(port, origin_port)
+            except OSError as e:
+                problem = f"traffic failed: {e}"
+        process.send_signal(signal.SIGINT)
+        out, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        out, _ = process.communicate()
+        problem = "did not stop on Ctrl+C"
+    if problem is None and 'Traceback' in out:
+        problem = "printed a traceback"
+    if problem is not None:
+        return f"{problem}\n{out}"
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Start the local proxy from the command line in every output mode')
+    parser.add_argument('--timeout', type=float, default=15.0, help='Seconds a run may take to come up or stop')
+    args = parser.parse_args()
+
+    ready, child = multiprocessing.Pipe(False)
+    standins = multiprocessing.Process(target=_standins_main, args=(child,), daemon=True)
+    standins.start()
+    origin_port, http_port, _ = ready.recv()
+
+    home = tempfile.mkdtemp(prefix='proxy-cli-smoke-')
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    env.pop('PROXY_CLI_BACKEND', None)
+    env.pop('PROXY_CLI_PLAIN', None)
+    failed = False
+    try:
+        subprocess.run([sys.executable, MAIN, '--plain', 'add', 'smoke', '--type', 'http', '--host', '127.0.0.1',
+                        '--port', str(http_port)], env=env, cwd=ROOT, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, check=True)
+        for name, flags in CASES.items():
+            problem = run_case(name, flags, env, origin_port, args.timeout)
+            print(f"{name:<9} {'ok' if problem is None else 'FAIL'}")
+            if problem is not None:
+                print(problem)
+                failed = True
+    finally:
+        standins.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Startup time regression check for the CLI
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Runs quick commands (list, add, delete, --help) under `python -X importtime`
+against a throwaway profile store and reports, per command, the time spent
+importing the CLI's own modules and the wall time on top of a bare
+interpreter start. Fails (exit 1) when a command goes over the budget or
+imports a module that only the proxy, probe or rich output need, so a stray
+top-level import in main.py is caught before it ships.
+
+The budget applies to plain output (--plain), the mode meant for scripts.
+With --rich the timings are only reported, since importing rich alone costs
+more than the budget; the import checks still apply.
+
+Usage:
+    python bench/startup.py [--runs 7] [--budget-ms 50] [--rich] [--json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+# Quick commands scripts call in a loop
+COMMANDS = {
+    'list': ['list'],
+    'add': ['add', 'bench', '--type', 'http', '--host', '127.0.0.1', '--port', '8888'],
+    'delete': ['delete', 'missing-profile'],
+    'help': ['--help'],
+}
+
+# Modules none of the quick commands need; importing one means an eager import crept back in
+FORBIDDEN = ('asyncio', 'socks', 'http.server', 'http.client', 'ssl', 'sqlite3', 'proxy_server', 'probe', 'metrics')
+
+# Additionally forbidden in plain output mode
+FORBIDDEN_PLAIN = ('rich',)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse `-X importtime` output into (module, depth, cumulative microseconds)."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative)))
+    return imports
+
+
+def run(argv: List[str], env: Dict[str, str]) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """Run the interpreter once; returns (wall seconds, imports)."""
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env, cwd=ROOT,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - started, parse_importtime(process.stderr)
+
+
+def measure(name: str, argv: List[str], env: Dict[str, str], baseline: Set[str], runs: int,
+            forbidden: Tuple[str, ...]) -> Dict[str, Any]:
+    """Median wall and import time of one command, plus the forbidden modules it imported."""
+    walls: List[float] = []
+    import_costs: List[int] = []
+    loaded: Set[str] = set()
+    for _ in range(runs):
+        wall, imports = run([MAIN] + argv, env)
+        walls.append(wall)
+        import_costs.append(sum(cumulative for module, depth, cumulative in imports
+                                if depth == 0 and module not in baseline))
+        loaded.update(module for module, _, _ in imports)
+    bad = sorted(module for module in loaded
+                 if any(module == root or module.startswith(root + '.') for root in forbidden))
+    return {
+        'command': name,
+        'wall_ms': round(statistics.median(walls) * 1000, 1),
+        'import_ms': round(statistics.median(import_costs) / 1000, 1),
+        'forbidden_imports': bad,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Check that quick CLI commands start fast')
+    parser.add_argument('--runs', type=int, default=7, help='Runs per command (the median is reported)')
+    parser.add_argument('--budget-ms', type=float, default=50.0,
+                        help='Allowed milliseconds per command on top of a bare interpreter start')
+    parser.add_argument('--rich', action='store_true', help='Check rich output instead of --plain (budget not enforced)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='proxy-cli-startup-')
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    env.pop('PROXY_CLI_BACKEND', None)
+    env.pop('PROXY_CLI_PLAIN', None)
+    forbidden = FORBIDDEN if args.rich else FORBIDDEN + FORBIDDEN_PLAIN
+    prefix = [] if args.rich else ['--plain']
+
+    try:
+        # What a bare interpreter imports (site, encodings, ...) is not the CLI's cost
+        walls = []
+        baseline: Set[str] = set()
+        for _ in range(args.runs):
+            wall, imports = run(['-c', 'pass'], env)
+            walls.append(wall)
+            baseline.update(module for module, depth, _ in imports if depth == 0)
+        interpreter_ms = statistics.median(walls) * 1000
+
+        results = []
+        failed = False
+        for name, argv in COMMANDS.items():
+            result = measure(name, prefix + argv, env, baseline, args.runs, forbidden)
+            result['over_interpreter_ms'] = round(result['wall_ms'] - interpreter_ms, 1)
+            within_budget = args.rich or result['over_interpreter_ms'] <= args.budget_ms
+            result['ok'] = within_budget and not result['forbidden_imports']
+            failed = failed or not result['ok']
+            results.append(result)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({'interpreter_ms': round(interpreter_ms, 1), 'budget_ms': args.budget_ms,
+                          'results': results}, indent=2))
+    else:
+        print(f"bare interpreter: {interpreter_ms:.1f} ms, budget: {args.budget_ms:.0f} ms on top")
+        for result in results:
+            status = 'ok' if result['ok'] else 'FAIL'
+            print(f"{result['command']:<8} {result['over_interpreter_ms']:>7.1f} ms "
+                  f"(imports {result['import_ms']:.1f} ms, wall {result['wall_ms']:.1f} ms)  {status}")
+            if result['forbidden_imports']:
+                print(f"         imported: {', '.join(result['forbidden_imports'])}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Memory held by open tunnels in the local proxy
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Opens many CONNECT tunnels through the local proxy (run in its own process,
+as in bench/load.py) and reports how much the proxy's RSS grew per tunnel:
+
+    idle     tunnels that are open but carry nothing
+    stalled  each tunnel sends one request to a stand-in origin that then
+             writes as fast as it can, and the client never reads, so a
+             fast upstream keeps feeding a client that does not drain
+
+Kernel socket buffers are not part of the proxy's RSS; what is left is what
+the relay itself keeps per tunnel.
+
+Usage:
+    python bench/tunnel_memory.py [--tunnels 1000] [--engine asyncio threaded]
+                                  [--relay auto] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load import CHUNK, HEAD_END, ProxyProcess, _standins_main  # noqa: E402
+from proxy_server import ENGINES  # noqa: E402
+from relay import DEFAULT_RELAY_MODE, RELAY_MODES  # noqa: E402
+
+SCENARIOS = ('idle', 'stalled')
+
+# Seconds the proxy gets to fill its buffers before it is measured
+SETTLE_SECONDS = 2.0
+
+
+def _raise_fd_limit() -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def _firehose_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Stand-in origin: once the client says anything, write to it until it goes away."""
+    chunk = b'x' * CHUNK
+    try:
+        if await reader.read(1):
+            while True:
+                writer.write(chunk)
+                await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+def _firehose_main(ready: Connection) -> None:
+    """Process running the firehose origin until terminated."""
+    async def run() -> None:
+        server = await asyncio.start_server(_firehose_client, '127.0.0.1', 0, backlog=1024)
+        ready.send(server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def _spawn(target: Any) -> Any:
+    ready, child = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=target, args=(child,), daemon=True)
+    process.start()
+    return process, ready.recv()
+
+
+async def _open_tunnels(scenario: str, proxy_port: int, origin_port: int, count: int) -> List[asyncio.StreamWriter]:
+    async def open_one() -> asyncio.StreamWriter:
+        reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+        writer.write(b'CONNECT 127.0.0.1:%d HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n\r\n' % (origin_port, origin_port))
+        head = await reader.readuntil(HEAD_END)
+        if head.split(b' ', 2)[1:2] != [b'200']:
+            raise ConnectionError(f"CONNECT refused: {head.splitlines()[0]!r}")
+        if scenario == 'stalled':
+            # Start the firehose and never read from it
+            writer.write(b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n')
+        return writer
+
+    writers: List[asyncio.StreamWriter] = []
+    for start in range(0, count, 100):
+        writers += await asyncio.gather(*(open_one() for _ in range(min(100, count - start))))
+    return writers
+
+
+def run_case(scenario: str, engine: str, relay_mode: str, http_port: int, origin_port: int,
+             count: int) -> Dict[str, Any]:
+    """Measure one scenario/engine combination on a fresh proxy process."""
+    profile = {'type': 'http', 'host': '127.0.0.1', 'port': str(http_port)}
+    proxy = ProxyProcess(profile, {'engine': engine, 'relay_mode': relay_mode})
+
+    async def measure() -> Dict[str, float]:
+        writers = await _open_tunnels(scenario, proxy.port, origin_port, count)
+        await asyncio.sleep(SETTLE_SECONDS)
+        usage = proxy.usage()
+        for writer in writers:
+            writer.close()
+        return usage
+
+    try:
+        before = proxy.usage()
+        after = asyncio.run(measure())
+    finally:
+        proxy.stop()
+    grown = after['max_rss_mb'] - before['max_rss_mb']
+    return {
+        'scenario': scenario,
+        'engine': engine,
+        'tunnels': count,
+        'proxy_rss_mb': round(after['max_rss_mb'], 1),
+        'rss_growth_mb': round(grown, 1),
+        'kib_per_tunnel': round(grown * 1024 / count, 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Measure the local proxy memory held per open tunnel')
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS), help='Scenarios to run')
+    parser.add_argument('--engine', nargs='+', choices=ENGINES, default=list(ENGINES), help='Engines to measure')
+    parser.add_argument('--relay', choices=RELAY_MODES, default=DEFAULT_RELAY_MODE, help='Tunnel relay mode')
+    parser.add_argument('--tunnels', type=int, default=1000, help='Tunnels held open at once')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    _raise_fd_limit()
+    standins, (_, http_port, _) = _spawn(_standins_main)
+    firehose, origin_port = _spawn(_firehose_main)
+    results: List[Dict[str, Any]] = []
+    try:
+        for scenario in args.scenario:
+            for engine in args.engine:
+                result = run_case(scenario, engine, args.relay, http_port, origin_port, args.tunnels)
+                results.append(result)
+                if not args.json:
+                    print(f"{scenario:<8} {engine:<9} {result['tunnels']:>6} tunnels  "
+                          f"RSS {result['proxy_rss_mb']:8.1f} MiB  "
+                          f"+{result['rss_growth_mb']:.1f} MiB  ({result['kib_per_tunnel']:.1f} KiB/tunnel)")
+                time.sleep(0.5)  # Let the stand-ins close the previous run's connections
+    finally:
+        standins.terminate()
+        firehose.terminate()
+
+    if args.json:
+        print(json.dumps({'relay': args.relay, 'results': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,8 +23,13 @@ def install_pyinstaller():
         subprocess.check_call([sys.executable, "-m", "pip", "install", "pyinstaller"])
         print("PyInstaller installed successfully.")
 
-def build_executable():
-    """Build the executable using PyInstaller"""
+def build_executable(onedir=False):
+    """Build the executable using PyInstaller
+
+    A --onefile build unpacks itself to a temporary directory on every
+    launch; onedir=True builds a folder instead, which starts faster when
+    scripts run the CLI many times.
+    """
     install_pyinstaller()
     
     # Path to the main script
@@ -39,7 +44,7 @@ def build_executable():
     # Create the build command
     build_cmd = [
         "pyinstaller",
-        "--onefile",           # Create a single executable file
+        "--onedir" if onedir else "--onefile",  # Folder (fast start) or single file
         "--name", "proxy-cli", # Name of the executable
         "--distpath", "dist",  # Output directory
         main_script
@@ -49,7 +54,8 @@ def build_executable():
         # Use python -m PyInstaller instead of direct pyinstaller command
         subprocess.check_call([sys.executable, "-m", "PyInstaller"] + build_cmd[1:])
         print("Executable built successfully!")
-        print(f"Find your executable in the 'dist' folder: {Path('dist') / 'proxy-cli.exe'}")
+        exe_path = Path('dist') / 'proxy-cli' / 'proxy-cli.exe' if onedir else Path('dist') / 'proxy-cli.exe'
+        print(f"Find your executable in the 'dist' folder: {exe_path}")
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error during build: {e}")
@@ -60,7 +66,7 @@ def main():
     print("Proxy Manager CLI - Build Script")
     print("=" * 40)
     
-    success = build_executable()
+    success = build_executable(onedir='--onedir' in sys.argv[1:])
     
     if success:
         print("\nThe proxy manager CLI is now available as a standalone executable.")
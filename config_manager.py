@@ -5,16 +5,41 @@ Author: Rezaul Karim
 Email: work.rezaul@outlook.com
 Powered By: REZ LAB
 
-Handles proxy profile configuration.
+Handles proxy profile configuration. Profiles live in a pluggable storage
+backend: the default INI file, served from an in-memory index that is
+re-read only when profiles.ini changes on disk, or an indexed SQLite
+database (profile_db.py) for large inventories.
 """
 
 import os
 import configparser
+import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 CONFIG_DIR = Path.home() / ".proxy-cli"
 CONFIG_FILE = CONFIG_DIR / "profiles.ini"
+DB_FILE = CONFIG_DIR / "profiles.db"
+SETTINGS_FILE = CONFIG_DIR / "settings.ini"
+
+# Storage backends; PROXY_CLI_BACKEND overrides the one saved in settings.ini
+BACKENDS = ('ini', 'sqlite')
+DEFAULT_BACKEND = 'ini'
+BACKEND_ENV = 'PROXY_CLI_BACKEND'
+
+# Proxy types a profile may have
+PROFILE_TYPES = ('http', 'socks4', 'socks5')
+
+# Fields of a profile record, in file order
+PROFILE_FIELDS = ('type', 'host', 'port', 'username', 'password', 'group', 'tags', 'region')
+
+# Health fields maintained by record_health(), kept when a profile is updated
+HEALTH_FIELDS = ('latency_ms', 'checked_at')
+
+# Orders accepted by query_profiles()
+SORT_ORDERS = ('added', 'name', 'latency')
 
 def init_config() -> None:
     """Initialize the configuration directory and file."""
@@ -23,7 +48,270 @@ def init_config() -> None:
         with open(CONFIG_FILE, 'w') as f:
             f.write("[DEFAULT]\n")
 
-def add_profile(name: str, proxy_type: str, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None) -> None:
+def split_tags(tags: str) -> List[str]:
+    """Split a stored comma-separated tag list."""
+    return [tag for tag in (part.strip() for part in tags.split(',')) if tag]
+
+def _matches(record: Dict[str, str], proxy_type: Optional[str], tag: Optional[str], group: Optional[str],
+             region: Optional[str]) -> bool:
+    return ((proxy_type is None or record.get('type') == proxy_type)
+            and (group is None or record.get('group') == group)
+            and (region is None or record.get('region') == region)
+            and (tag is None or tag in split_tags(record.get('tags', ''))))
+
+def _latency_key(item: Tuple[str, Dict[str, str]]) -> Tuple[bool, float]:
+    latency = item[1].get('latency_ms')
+    return (not latency, float(latency) if latency else 0.0)
+
+class ProfileStore:
+    """Profiles of one INI file, parsed once and indexed by name.
+
+    The file is re-parsed only when its mtime, size or inode changes, so
+    repeated lookups cost a stat() instead of a full parse.
+
+    Args:
+        path: Path to the profiles file
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._profiles: Dict[str, Dict[str, str]] = {}
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._lock = threading.RLock()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def version(self) -> Any:
+        """A value that changes whenever the profiles file is written, by any process."""
+        return self._stat()
+
+    def _refresh(self) -> None:
+        signature = self._stat()
+        if signature is not None and signature == self._signature:
+            return
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(self.path)
+        self._profiles = {name: dict(config[name]) for name in config.sections()}
+        self._signature = signature
+
+    def _write(self) -> None:
+        # Write a temp file next to the target and rename it over, so readers
+        # never see a half-written file
+        config = configparser.ConfigParser(interpolation=None)
+        config.read_dict(self._profiles)
+        fd, temp_path = tempfile.mkstemp(prefix='.profiles-', suffix='.tmp', dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                config.write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._signature = self._stat()
+
+    def _merge(self, name: str, record: Dict[str, str]) -> Dict[str, str]:
+        current = self._profiles.get(name, {})
+        merged = {field: current[field] for field in HEALTH_FIELDS if field in current}
+        merged.update(record)
+        return merged
+
+    def names(self) -> List[str]:
+        """Profile names in file order."""
+        with self._lock:
+            self._refresh()
+            return list(self._profiles)
+
+    def get(self, name: str) -> Optional[Dict[str, str]]:
+        """A copy of one profile record, or None."""
+        with self._lock:
+            self._refresh()
+            record = self._profiles.get(name)
+            return dict(record) if record is not None else None
+
+    def all(self) -> Dict[str, Dict[str, str]]:
+        """Copies of every profile record keyed by name, in file order."""
+        with self._lock:
+            self._refresh()
+            return {name: dict(record) for name, record in self._profiles.items()}
+
+    def group(self, group: str) -> List[str]:
+        """Names of the profiles whose group is group."""
+        with self._lock:
+            self._refresh()
+            return [name for name, record in self._profiles.items() if record.get('group') == group]
+
+    def query(self, proxy_type: Optional[str] = None, tag: Optional[str] = None, group: Optional[str] = None,
+              region: Optional[str] = None, sort: str = 'added', limit: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        """Profiles matching every given filter, in the requested order."""
+        with self._lock:
+            self._refresh()
+            items = [(name, dict(record)) for name, record in self._profiles.items()
+                     if _matches(record, proxy_type, tag, group, region)]
+        if sort == 'name':
+            items.sort(key=lambda item: item[0])
+        elif sort == 'latency':
+            items.sort(key=_latency_key)
+        return dict(items[:limit] if limit is not None else items)
+
+    def put(self, name: str, record: Dict[str, str]) -> None:
+        """Add or replace a profile and write the file."""
+        with self._lock:
+            self._refresh()
+            self._profiles[name] = self._merge(name, record)
+            self._write()
+
+    def put_many(self, records: Iterable[Tuple[str, Dict[str, str]]], overwrite: bool = True) -> Tuple[int, int, int]:
+        """Add or replace many profiles with a single write.
+
+        Args:
+            records: (name, record) pairs
+            overwrite: Replace existing profiles that differ; otherwise keep them
+
+        Returns:
+            Counts of (added, updated, unchanged) profiles
+        """
+        added = updated = unchanged = 0
+        with self._lock:
+            self._refresh()
+            for name, record in records:
+                current = self._profiles.get(name)
+                merged = self._merge(name, record)
+                if current is None:
+                    added += 1
+                elif current == merged or not overwrite:
+                    unchanged += 1
+                    continue
+                else:
+                    updated += 1
+                self._profiles[name] = merged
+            if added or updated:
+                self._write()
+        return added, updated, unchanged
+
+    def record_health(self, results: Iterable[Tuple[str, bool, Optional[float]]]) -> None:
+        """Store the latest probe latency of each profile (cleared when the probe failed)."""
+        checked_at = f"{time.time():.0f}"
+        with self._lock:
+            self._refresh()
+            changed = False
+            for name, ok, latency_ms in results:
+                record = self._profiles.get(name)
+                if record is None:
+                    continue
+                record['latency_ms'] = f"{latency_ms:.1f}" if ok and latency_ms is not None else ''
+                record['checked_at'] = checked_at
+                changed = True
+            if changed:
+                self._write()
+
+    def delete(self, name: str) -> bool:
+        """Remove a profile and write the file; returns whether it existed."""
+        with self._lock:
+            self._refresh()
+            if name not in self._profiles:
+                return False
+            del self._profiles[name]
+            self._write()
+            return True
+
+    def close(self) -> None:
+        pass
+
+
+def get_backend_name() -> str:
+    """Name of the configured storage backend, one of BACKENDS."""
+    name = os.environ.get(BACKEND_ENV)
+    if not name:
+        settings = configparser.ConfigParser(interpolation=None)
+        settings.read(SETTINGS_FILE)
+        name = settings.get('storage', 'backend', fallback=DEFAULT_BACKEND)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {name}")
+    return name
+
+def open_store(backend: str) -> Any:
+    """Open a storage backend by name."""
+    if backend == 'sqlite':
+        from profile_db import SqliteProfileStore
+        return SqliteProfileStore(DB_FILE)
+    if backend == 'ini':
+        return ProfileStore(CONFIG_FILE)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+_store: Any = None
+_store_lock = threading.Lock()
+
+# Stores a forked child inherited from its parent, kept referenced so they are never closed
+_inherited_stores: List[Any] = []
+
+def _forget_store_after_fork() -> None:
+    # SQLite connections must not be used across fork(): the child (e.g. a --workers
+    # process) opens its own store on first use. Closing the inherited one could also
+    # disturb the parent's locks, so it is only set aside.
+    global _store, _store_lock
+    if _store is not None:
+        _inherited_stores.append(_store)
+    _store = None
+    _store_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_store_after_fork)
+
+def _get_store() -> Any:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(get_backend_name())
+        return _store
+
+def set_backend(backend: str, migrate: bool = True) -> int:
+    """Switch the storage backend, saved in settings.ini.
+
+    Args:
+        backend: One of BACKENDS
+        migrate: Copy every profile from the current backend into the new one
+
+    Returns:
+        Number of profiles copied
+    """
+    global _store
+    current = get_backend_name()
+    copied = 0
+    if migrate and backend != current:
+        source = _get_store()
+        target = open_store(backend)
+        try:
+            profiles = source.all()
+            added, updated, _ = target.put_many(
+                ((name, {field: record.get(field, '') for field in PROFILE_FIELDS}) for name, record in profiles.items()))
+            target.record_health((name, bool(record.get('latency_ms')), float(record['latency_ms']) if record.get('latency_ms') else None)
+                                 for name, record in profiles.items() if record.get('checked_at'))
+            copied = added + updated
+        finally:
+            target.close()
+    settings = configparser.ConfigParser(interpolation=None)
+    settings.read(SETTINGS_FILE)
+    if not settings.has_section('storage'):
+        settings.add_section('storage')
+    settings.set('storage', 'backend', backend)
+    with open(SETTINGS_FILE, 'w') as f:
+        settings.write(f)
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = None
+    return copied
+
+
+def add_profile(name: str, proxy_type: str, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                group: Optional[str] = None, tags: Optional[Iterable[str]] = None, region: Optional[str] = None) -> None:
     """Add a new proxy profile to the configuration.
 
     Args:
@@ -33,18 +321,38 @@ def add_profile(name: str, proxy_type: str, host: str, port: int, username: Opti
         port: Proxy server port number
         username: Optional authentication username
         password: Optional authentication password
+        group: Optional group name; `use @group` activates every profile in it
+        tags: Optional tags to filter `list` by
+        region: Optional region label
     """
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    config[name] = {
+    _get_store().put(name, make_record(proxy_type, host, port, username, password, group, tags, region))
+
+def make_record(proxy_type: str, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                group: Optional[str] = None, tags: Optional[Iterable[str]] = None,
+                region: Optional[str] = None) -> Dict[str, str]:
+    """Build a profile record as stored in the configuration."""
+    return {
         'type': proxy_type,
         'host': host,
         'port': str(port),  # Convert to string since configparser requires strings
         'username': username or '',
-        'password': password or ''
+        'password': password or '',
+        'group': group or '',
+        'tags': ','.join(sorted({tag.strip() for tag in tags or () if tag.strip()})),
+        'region': region or ''
     }
-    with open(CONFIG_FILE, 'w') as f:
-        config.write(f)
+
+def add_profiles(records: Iterable[Tuple[str, Dict[str, str]]], overwrite: bool = True) -> Tuple[int, int, int]:
+    """Add many proxy profiles in one atomic write.
+
+    Args:
+        records: (name, record) pairs, records as built by make_record()
+        overwrite: Replace existing profiles of the same name
+
+    Returns:
+        Counts of (added, updated, unchanged) profiles
+    """
+    return _get_store().put_many(records, overwrite)
 
 def list_profiles() -> List[str]:
     """List all available proxy profile names.
@@ -52,9 +360,7 @@ def list_profiles() -> List[str]:
     Returns:
         List of profile names (section names from config)
     """
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    return config.sections()
+    return _get_store().names()
 
 def get_profile(name: str) -> Optional[Dict[str, str]]:
     """Get a proxy profile by name.
@@ -65,21 +371,90 @@ def get_profile(name: str) -> Optional[Dict[str, str]]:
     Returns:
         Dictionary containing profile data, or None if not found
     """
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    if name in config:
-        return dict(config[name])
-    return None
+    return _get_store().get(name)
+
+def get_profiles() -> Dict[str, Dict[str, str]]:
+    """Get every proxy profile in one pass.
+
+    Returns:
+        Profile data keyed by profile name, in config order
+    """
+    return _get_store().all()
+
+def query_profiles(proxy_type: Optional[str] = None, tag: Optional[str] = None, group: Optional[str] = None,
+                   region: Optional[str] = None, sort: str = 'added', limit: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+    """Get the profiles matching every given filter.
+
+    Args:
+        proxy_type: Only profiles of this type
+        tag: Only profiles carrying this tag
+        group: Only profiles in this group
+        region: Only profiles in this region
+        sort: One of SORT_ORDERS; 'latency' puts the fastest measured first
+        limit: Return at most this many profiles
 
-def delete_profile(name: str) -> None:
+    Returns:
+        Profile data keyed by profile name, in the requested order
+    """
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order: {sort}")
+    return _get_store().query(proxy_type, tag, group, region, sort, limit)
+
+def get_group(group: str) -> List[str]:
+    """List the names of the profiles in a group.
+
+    Args:
+        group: Group name given with `add --group`
+
+    Returns:
+        Profile names in config order (empty if the group does not exist)
+    """
+    return _get_store().group(group)
+
+def resolve_profiles(names: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    """Look up profiles by name, expanding @group to every profile in the group.
+
+    Args:
+        names: Profile names and @group references
+
+    Returns:
+        Profile records keyed by name, in the order given
+
+    Raises:
+        KeyError: With the first name or @group that matches no profile
+    """
+    profiles: Dict[str, Dict[str, str]] = {}
+    store = _get_store()
+    for name in names:
+        members = store.group(name[1:]) if name.startswith('@') else [name]
+        found = [(member, store.get(member)) for member in members]
+        if not found or any(data is None for _, data in found):
+            raise KeyError(name)
+        profiles.update((member, data) for member, data in found if data is not None)
+    return profiles
+
+def store_version() -> Any:
+    """A value that changes whenever the profile store is written, by any process.
+
+    Cheap enough to poll: a stat() for the INI file, a pragma for SQLite.
+    """
+    return _get_store().version()
+
+def record_health(results: Iterable[Tuple[str, bool, Optional[float]]]) -> None:
+    """Save probe outcomes so `list --sort latency` can use them.
+
+    Args:
+        results: (profile name, reachable, latency in ms) triples
+    """
+    _get_store().record_health(results)
+
+def delete_profile(name: str) -> bool:
     """Delete a proxy profile.
 
     Args:
         name: Name of the proxy profile to delete
+
+    Returns:
+        Whether the profile existed
     """
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    if name in config:
-        del config[name]
-        with open(CONFIG_FILE, 'w') as f:
-            config.write(f)
+    return _get_store().delete(name)
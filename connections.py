@@ -0,0 +1,166 @@
+"""
+Proxy Manager CLI - Connection Tracking
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Per-connection bookkeeping for the local proxy servers of both engines, so
+they can shut down gracefully: stop accepting, let the connections that
+are serving a request or tunnel finish, close idle keep-alive connections
+at once, and close whatever is left when the drain deadline passes.
+Waiting is driven by connections closing rather than by polling, so a
+drain costs time proportional to the open connections, not to timeouts.
+"""
+
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+# Connection states
+STATE_HANDSHAKE = 'handshake'  # Reading the first request
+STATE_ACTIVE = 'active'        # Serving a request or relaying a tunnel
+STATE_IDLE = 'idle'            # Keep-alive connection waiting for its next request
+STATES = (STATE_HANDSHAKE, STATE_ACTIVE, STATE_IDLE)
+
+# Seconds between progress reports while draining
+PROGRESS_INTERVAL = 1.0
+
+# Progress callback: (connections still open, seconds left before they are closed)
+ProgressCallback = Callable[[int, float], None]
+
+
+def _shutdown(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed
+
+
+class TrackedConnection:
+    """One client connection and the upstream sockets it currently uses."""
+
+    __slots__ = ('client', 'upstreams', 'state', 'since')
+
+    def __init__(self, client: socket.socket) -> None:
+        self.client = client
+        self.upstreams: List[socket.socket] = []
+        self.state = STATE_HANDSHAKE
+        self.since = time.monotonic()
+
+    def abort(self) -> None:
+        """Shut down every socket of the connection, waking whoever is blocked on it."""
+        _shutdown(self.client)
+        for sock in list(self.upstreams):
+            _shutdown(sock)
+
+
+class ConnectionTracker:
+    """The open connections of one server, with their states.
+
+    Thread safe: the threaded engine updates it from handler threads, the
+    asyncio engine from the event loop, and shutdown waits on it from
+    another thread.
+    """
+
+    def __init__(self) -> None:
+        self._connections: Set[TrackedConnection] = set()
+        self._changed = threading.Condition()
+        self.draining = False
+
+    def __len__(self) -> int:
+        with self._changed:
+            return len(self._connections)
+
+    def open(self, client: socket.socket) -> TrackedConnection:
+        """Start tracking a newly accepted client connection."""
+        connection = TrackedConnection(client)
+        with self._changed:
+            self._connections.add(connection)
+        return connection
+
+    def close(self, connection: TrackedConnection) -> None:
+        """Stop tracking a connection once its handler is done with it."""
+        with self._changed:
+            self._connections.discard(connection)
+            self._changed.notify_all()
+
+    def set_state(self, connection: TrackedConnection, state: str) -> None:
+        """Record what a connection is doing; an idle connection is closed at once while draining."""
+        with self._changed:
+            connection.state = state
+            connection.since = time.monotonic()
+            abort = self.draining and state == STATE_IDLE
+        if abort:
+            connection.abort()
+
+    def attach(self, connection: TrackedConnection, sock: socket.socket) -> None:
+        """Register an upstream socket, so a forced close also unblocks reads from it."""
+        with self._changed:
+            connection.upstreams.append(sock)
+
+    def detach(self, connection: TrackedConnection, sock: socket.socket) -> None:
+        """Forget an upstream socket, e.g. when it goes back to the pool."""
+        with self._changed:
+            if sock in connection.upstreams:
+                connection.upstreams.remove(sock)
+
+    def counts(self) -> Dict[str, int]:
+        """Open connections per state."""
+        with self._changed:
+            counts = dict.fromkeys(STATES, 0)
+            for connection in self._connections:
+                counts[connection.state] += 1
+            return counts
+
+    def start_draining(self) -> int:
+        """Close idle connections now and those that go idle from now on.
+
+        Returns:
+            Idle connections closed
+        """
+        with self._changed:
+            self.draining = True
+            idle = [connection for connection in self._connections if connection.state == STATE_IDLE]
+        for connection in idle:
+            connection.abort()
+        return len(idle)
+
+    def wait(self, deadline: float, progress: Optional[ProgressCallback] = None,
+             interval: float = PROGRESS_INTERVAL) -> int:
+        """Wait until every connection has closed or the monotonic deadline passes.
+
+        Args:
+            deadline: time.monotonic() value to stop waiting at
+            progress: Called every interval seconds while connections are open
+            interval: Seconds between progress calls
+
+        Returns:
+            Connections still open
+        """
+        next_report = time.monotonic()
+        while True:
+            with self._changed:
+                now = time.monotonic()
+                remaining = len(self._connections)
+                if not remaining or now >= deadline:
+                    return remaining
+                if progress is None or now < next_report:
+                    wake = deadline if progress is None else min(deadline, next_report)
+                    self._changed.wait(wake - now)
+                    continue
+            next_report = now + interval
+            progress(remaining, deadline - now)
+
+    def abort_all(self) -> int:
+        """Shut down every open connection.
+
+        Returns:
+            Connections shut down
+        """
+        with self._changed:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.abort()
+        return len(connections)
@@ -0,0 +1,456 @@
+"""
+Proxy Manager CLI - Background Daemon
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Runs the local proxy as a detached background process. `daemon start`
+launches `daemon run` in a new session and waits for its control socket, a
+Unix-domain socket next to the profile store. Later CLI calls send one JSON
+request per connection and read one JSON reply, so the daemon can switch
+the profiles behind a listener, add or remove listeners, reload profiles
+and report its state without restarting, and without dropping tunnels
+that are already established. Profiles are also reloaded on SIGHUP and,
+unless disabled, whenever the profile store changes.
+
+Control requests ({"command": ..., ...}):
+    status                       listeners, upstream counters and uptime
+    metrics                      the metrics exposition text
+    switch   port, names         point a listener at other profiles
+    listen   port, names         start another listener
+    unlisten port                stop a listener
+    reload                       re-read the profiles behind every listener
+    stop                         stop every listener and exit
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config_manager import CONFIG_DIR
+from defaults import DEFAULT_DRAIN_TIMEOUT
+from reloader import WATCH_INTERVAL, ProfileBinding, ReloadTrigger, connection_profiles
+from upstreams import DEFAULT_POLICY
+
+CONTROL_SOCKET = CONFIG_DIR / "daemon.sock"
+PID_FILE = CONFIG_DIR / "daemon.pid"
+LOG_FILE = CONFIG_DIR / "daemon.log"
+
+# Seconds `start` waits for the daemon's control socket, and `stop` for it to exit
+START_TIMEOUT = 10.0
+STOP_TIMEOUT = 10.0
+
+# Seconds a control request may take
+REQUEST_TIMEOUT = 10.0
+
+# Largest control request or reply accepted
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+
+# Local proxy options forwarded from `daemon start` to `daemon run`, with their flags
+OPTION_FLAGS = {
+    'engine': '--engine',
+    'policy': '--policy',
+    'pool_size': '--pool-size',
+    'pool_idle_timeout': '--pool-idle-timeout',
+    'relay_mode': '--relay',
+    'relay_high_water': '--relay-high-water',
+    'relay_low_water': '--relay-low-water',
+    'global_rate': '--global-rate',
+    'listener_rate': '--listener-rate',
+    'client_rate': '--client-rate',
+    'upstream_rate': '--upstream-rate',
+    'connect_rate': '--connect-rate',
+    'cache_memory': '--cache-memory',
+    'cache_disk': '--cache-disk',
+    'cache_dir': '--cache-dir',
+    'local_host': '--bind',
+    'allow_remote': '--allow-remote',
+    'backlog': '--backlog',
+}
+
+
+def supported() -> bool:
+    """Whether this platform has Unix-domain sockets for the control channel."""
+    return hasattr(socket, 'AF_UNIX')
+
+
+def request(command: str, socket_path: Optional[Path] = None, timeout: float = REQUEST_TIMEOUT,
+            **fields: Any) -> Dict[str, Any]:
+    """Send one control request to the running daemon.
+
+    Args:
+        command: One of the control commands
+        socket_path: Control socket (default: CONTROL_SOCKET)
+        timeout: Seconds allowed for the reply
+        **fields: Arguments of the command
+
+    Returns:
+        The daemon's reply
+
+    Raises:
+        OSError: If no daemon is listening on the socket
+        ValueError: If the daemon rejected the request
+    """
+    if not supported():
+        raise OSError("The daemon needs Unix-domain sockets, which this platform does not provide")
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(str(socket_path or CONTROL_SOCKET))
+        client.sendall(json.dumps(dict(fields, command=command)).encode('utf-8') + b'\n')
+        reply = client.makefile('rb').readline(MAX_MESSAGE_SIZE)
+    finally:
+        client.close()
+    if not reply:
+        raise OSError("The daemon closed the control connection without replying")
+    response = json.loads(reply)
+    if not response.get('ok'):
+        raise ValueError(response.get('error') or 'request failed')
+    return response
+
+
+def is_running(socket_path: Optional[Path] = None) -> bool:
+    """Whether a daemon answers on the control socket."""
+    try:
+        request('status', socket_path, timeout=2.0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _cli_command() -> List[str]:
+    """Command line that runs this CLI, as a script or as a frozen executable."""
+    if getattr(sys, 'frozen', False):
+        return [sys.executable]
+    return [sys.executable, str(Path(__file__).resolve().with_name('main.py'))]
+
+
+def start(names: List[str], port: int, options: Dict[str, Any], metrics_port: Optional[int] = None,
+          socket_path: Optional[Path] = None, timeout: float = START_TIMEOUT,
+          reload_grace: Optional[float] = None, watch: bool = True,
+          drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> Dict[str, Any]:
+    """Launch the daemon in the background and wait until it answers.
+
+    Args:
+        names: Profile names and @group references for the first listener
+        port: Local port of the first listener
+        options: Local proxy options (see OPTION_FLAGS)
+        metrics_port: Serve Prometheus metrics on this port
+        socket_path: Control socket (default: CONTROL_SOCKET)
+        timeout: Seconds to wait for the daemon to come up
+        reload_grace: Seconds tunnels may outlive a profile switch (None: until they close)
+        watch: Reload when the profile store changes
+        drain_timeout: Seconds open connections get to finish when the daemon stops
+
+    Returns:
+        The daemon's status
+
+    Raises:
+        OSError: If a daemon is already running or the new one failed to start
+    """
+    socket_path = socket_path or CONTROL_SOCKET
+    if is_running(socket_path):
+        raise OSError(f"A daemon is already running on {socket_path}")
+    argv = _cli_command() + ['daemon', 'run', *names, '--port', str(port), '--socket', str(socket_path)]
+    for option, flag in OPTION_FLAGS.items():
+        value = options.get(option)
+        if value is True:
+            argv.append(flag)  # A switch
+        elif value is not None and value is not False:
+            argv += [flag, str(value)]
+    if metrics_port is not None:
+        argv += ['--metrics-port', str(metrics_port)]
+    if reload_grace is not None:
+        argv += ['--reload-grace', str(reload_grace)]
+    if not watch:
+        argv.append('--no-watch')
+    if drain_timeout:
+        argv += ['--drain-timeout', str(drain_timeout)]
+
+    CONFIG_DIR.mkdir(exist_ok=True)
+    with open(LOG_FILE, 'ab') as log:
+        offset = log.tell()
+        # Plain output keeps the log free of box drawing and color codes
+        process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                   env=dict(os.environ, PROXY_CLI_PLAIN='1'), start_new_session=True, close_fds=True)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(LOG_FILE, 'rb') as log:
+                log.seek(offset)
+                lines = log.read().decode('utf-8', errors='replace').strip().splitlines()
+            reason = lines[-1] if lines else f"exit status {process.returncode}"
+            raise OSError(f"The daemon did not start: {reason} (see {LOG_FILE})")
+        try:
+            return request('status', socket_path, timeout=2.0)
+        except (OSError, ValueError):
+            time.sleep(0.05)
+    process.terminate()
+    raise OSError(f"The daemon did not start within {timeout:g}s; see {LOG_FILE}")
+
+
+def stop(socket_path: Optional[Path] = None, timeout: float = STOP_TIMEOUT) -> int:
+    """Ask the running daemon to exit and wait until it has.
+
+    The daemon first lets open connections drain, so it is given its
+    drain timeout on top of timeout.
+
+    Returns:
+        Process id of the stopped daemon
+
+    Raises:
+        OSError: If no daemon is running or it did not exit in time
+    """
+    socket_path = socket_path or CONTROL_SOCKET
+    reply = request('stop', socket_path)
+    pid = reply['pid']
+    deadline = time.monotonic() + reply.get('drain_timeout', 0) + timeout
+    while time.monotonic() < deadline:
+        if not socket_path.exists():
+            return pid
+        time.sleep(0.05)
+    raise OSError(f"The daemon (pid {pid}) did not exit within {timeout:g}s")
+
+
+class Listener(ProfileBinding):
+    """One local proxy server run by the daemon, with the profile names behind it."""
+
+    def __init__(self, port: int, names: List[str], profiles: Dict[str, Dict[str, str]], server: Any,
+                 policy: str = DEFAULT_POLICY, grace: Optional[float] = None) -> None:
+        super().__init__(server, names, profiles, policy, grace)
+        self.port = port
+        self.started = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        host, port = self.server.server_address[:2]
+        upstreams = self.server.upstreams.stats()
+        return {
+            'host': host,
+            'port': port,
+            'frontend': self.server.frontend,
+            'names': self.names,
+            'profiles': [entry['name'] for entry in upstreams],
+            'upstreams': upstreams,
+            'draining': self.draining(),
+            'started': self.started,
+        }
+
+
+class Daemon:
+    """The background process: local proxy listeners plus the control socket.
+
+    Args:
+        options: Local proxy options passed to start_profile_proxy()
+        socket_path: Control socket to serve
+        metrics_port: Serve Prometheus metrics on this port
+        reload_grace: Seconds tunnels may outlive a profile switch (None: until they close)
+        watch: Reload when the profile store changes
+        drain_timeout: Seconds open connections get to finish when the daemon stops
+    """
+
+    def __init__(self, options: Dict[str, Any], socket_path: Optional[Path] = None,
+                 metrics_port: Optional[int] = None, reload_grace: Optional[float] = None,
+                 watch: bool = True, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> None:
+        self.options = options
+        self._server_options = options
+        self.socket_path = socket_path or CONTROL_SOCKET
+        self.metrics_port = metrics_port
+        self.reload_grace = reload_grace
+        self.watch = watch
+        self.drain_timeout = drain_timeout
+        self.listeners: Dict[int, Listener] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._control: Optional[socketserver.BaseServer] = None
+        self._metrics_server: Any = None
+
+    def listen(self, port: int, names: List[str]) -> Listener:
+        """Start a listener on port for the given profiles.
+
+        Raises:
+            ValueError: If the port is taken by another listener or a profile is unknown
+            OSError: If the port cannot be bound
+        """
+        from proxy_server import start_profile_proxy
+
+        with self._lock:
+            if port in self.listeners:
+                raise ValueError(f"Already listening on port {port}")
+            profiles = connection_profiles(names)
+            server = start_profile_proxy(profiles, port, **self._server_options)
+            listener = Listener(port, names, profiles, server,
+                                self.options.get('policy', DEFAULT_POLICY), self.reload_grace)
+            self.listeners[port] = listener
+            return listener
+
+    def unlisten(self, port: int) -> None:
+        """Stop the listener on port; its established tunnels are closed."""
+        from proxy_server import stop_server
+
+        with self._lock:
+            listener = self._listener(port)
+            del self.listeners[port]
+        stop_server(listener.server)
+
+    def switch(self, port: int, names: List[str]) -> Listener:
+        """Point the listener on port at other profiles, letting established tunnels drain."""
+        with self._lock:
+            listener = self._listener(port)
+            listener.switch(names)
+            return listener
+
+    def reload(self) -> List[int]:
+        """Re-read the profiles behind every listener, so edited profiles take effect.
+
+        Listeners whose profiles did not change keep their upstream group and
+        its counters.
+
+        Returns:
+            Ports whose listener was updated
+        """
+        with self._lock:
+            return [port for port, listener in self.listeners.items() if listener.reload()]
+
+    def status(self) -> Dict[str, Any]:
+        """State of the daemon and its listeners."""
+        with self._lock:
+            listeners = [listener.as_dict() for listener in self.listeners.values()]
+        return {
+            'pid': os.getpid(),
+            'started': self.started,
+            'uptime': round(time.time() - self.started, 1),
+            'socket': str(self.socket_path),
+            'metrics_port': self.metrics_port,
+            'options': self.options,
+            'reload_grace': self.reload_grace,
+            'watch': self.watch,
+            'drain_timeout': self.drain_timeout,
+            'listeners': listeners,
+        }
+
+    def _listener(self, port: int) -> Listener:
+        listener = self.listeners.get(port)
+        if listener is None:
+            raise ValueError(f"No listener on port {port}")
+        return listener
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one control request and build its reply."""
+        command = message.get('command')
+        if command == 'status':
+            return self.status()
+        if command == 'metrics':
+            from metrics import REGISTRY
+            return {'text': REGISTRY.render()}
+        if command == 'switch':
+            return self.switch(int(message['port']), list(message['names'])).as_dict()
+        if command == 'listen':
+            return self.listen(int(message['port']), list(message['names'])).as_dict()
+        if command == 'unlisten':
+            self.unlisten(int(message['port']))
+            return {'port': int(message['port'])}
+        if command == 'reload':
+            return {'reloaded': self.reload()}
+        if command == 'stop':
+            self._stopping.set()
+            return {'pid': os.getpid(), 'drain_timeout': self.drain_timeout}
+        raise ValueError(f"Unknown command: {command}")
+
+    def _serve_control(self) -> None:
+        """Bind the control socket, replacing a stale one left by a crashed daemon."""
+        if self.socket_path.exists():
+            if is_running(self.socket_path):
+                raise OSError(f"A daemon is already running on {self.socket_path}")
+            self.socket_path.unlink()
+
+        daemon = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                try:
+                    message = json.loads(self.rfile.readline(MAX_MESSAGE_SIZE))
+                    reply = dict(daemon.handle(message), ok=True)
+                except (KeyError, TypeError, ValueError, OSError) as e:
+                    reply = {'ok': False, 'error': str(e) or type(e).__name__}
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+        class ControlServer(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        # Only the owner may control the daemon
+        umask = os.umask(0o177)
+        try:
+            self._control = ControlServer(str(self.socket_path), ControlHandler)
+        finally:
+            os.umask(umask)
+        thread = threading.Thread(target=self._control.serve_forever, daemon=True)
+        thread.start()
+
+    def run(self, names: List[str], port: int) -> None:
+        """Start the first listener and the control socket, then serve until stopped.
+
+        Raises:
+            OSError: If the port or the control socket cannot be bound
+            ValueError: If a profile is unknown
+        """
+        from proxy_server import share_cache, stop_all_servers
+
+        if not supported():
+            raise OSError("The daemon needs Unix-domain sockets, which this platform does not provide")
+        self._server_options = share_cache(self.options)  # One response cache for every listener
+        self._serve_control()
+        try:
+            self.listen(port, names)
+            if self.metrics_port is not None:
+                from metrics import start_metrics_server
+                self._metrics_server = start_metrics_server(self.metrics_port)
+            PID_FILE.write_text(f"{os.getpid()}\n")
+            signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+            trigger = ReloadTrigger(self.watch)
+            trigger.install_signal_handler()
+            while not self._stopping.wait(WATCH_INTERVAL):
+                if trigger.due():
+                    self._reload_logged()
+        finally:
+            # Drain while the control socket still answers status requests
+            closed = stop_all_servers(self.drain_timeout, lambda remaining, left: print(
+                f"Stopping: waiting for {remaining} connection(s) ({left:.0f}s left)", flush=True))
+            if closed:
+                print(f"Closed {closed} connection(s) that were still open", flush=True)
+            self._shutdown()
+
+    def _reload_logged(self) -> None:
+        try:
+            ports = self.reload()
+        except ValueError as e:
+            print(f"Reload failed, keeping the current profiles: {e}", flush=True)
+            return
+        for port in ports:
+            print(f"Reloaded profiles on port {port}: {', '.join(self.listeners[port].profiles)}", flush=True)
+
+    def _shutdown(self) -> None:
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+        if self._control is not None:
+            self._control.shutdown()
+            self._control.server_close()
+            try:
+                self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            if PID_FILE.read_text().strip() == str(os.getpid()):
+                PID_FILE.unlink()
+        except OSError:
+            pass
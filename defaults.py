@@ -0,0 +1,42 @@
+"""
+Proxy Manager CLI - Defaults
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Choices and default values the command line offers for the forwarding
+engine, relay, listener, shutdown, probe and metrics options. They live here, with no imports,
+so main.py can build its argument parser without loading the networking
+modules that define and use them.
+"""
+
+# Available forwarding engines: a shared asyncio event loop, or the
+# thread-per-connection socketserver implementation
+ENGINES = ('asyncio', 'threaded')
+DEFAULT_ENGINE = 'asyncio'
+
+# Relay modes: 'auto' picks splice when the platform supports it
+RELAY_MODES = ('auto', 'splice', 'copy')
+DEFAULT_RELAY_MODE = 'auto'
+
+# Probe target, per-probe timeout (seconds) and probes running at once
+DEFAULT_TARGET = 'http://example.com/'
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CONCURRENCY = 50
+
+# Port the stats command reads when none is given
+DEFAULT_METRICS_PORT = 9100
+
+# Seconds open connections get to finish when the local proxy stops (0: close at once)
+DEFAULT_DRAIN_TIMEOUT = 0.0
+
+# Where the local proxy listens unless told otherwise (IPv4 loopback), and its listen backlog
+DEFAULT_LISTEN_HOST = '127.0.0.1'
+DEFAULT_LOCAL_PORT = 8080
+DEFAULT_BACKLOG = 1024
+
+# KiB a tunnel buffers per direction: reading pauses at the high watermark
+# and resumes once the buffer drains to the low one
+DEFAULT_RELAY_HIGH_WATER = 64
+DEFAULT_RELAY_LOW_WATER = 16
@@ -0,0 +1,825 @@
+"""
+Proxy Manager CLI - HTTP Cache
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Shared cache for plain HTTP GET responses relayed by the HTTP front-end,
+following the RFC 9111 rules for a shared cache: Cache-Control (max-age,
+s-maxage, no-store, no-cache, private, must-revalidate), Expires, a
+heuristic lifetime from Last-Modified, Vary, and revalidation with ETag /
+Last-Modified validators.
+
+Entries live in an in-memory LRU tier bounded by bytes and, optionally, in
+a disk tier under a cache directory that worker processes and restarts
+share. Disk bodies are served with sendfile(). Concurrent misses for the
+same URL are coalesced: one request fetches from the upstream while the
+others wait for it and are then served from the cache.
+
+The cache is I/O agnostic and shared by both forwarding engines: they ask
+lookup() what to do with a request, relay the response through a
+BodyCollector, and store() it once the body is complete.
+"""
+
+import calendar
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from config_manager import CONFIG_DIR
+from http_parser import (
+    BODY_CHUNKED,
+    BODY_LENGTH,
+    BODY_NONE,
+    HOP_BY_HOP_HEADERS,
+    MessageHead,
+    RequestHead,
+    ResponseHead,
+    check_chunk_end,
+    parse_chunk_size,
+)
+
+# Disk tier location when --cache-dir is not given
+DEFAULT_CACHE_DIR = CONFIG_DIR / "http-cache"
+
+MIB = 1024 * 1024
+
+# Largest share of a tier one response may take
+OBJECT_FRACTION = 8
+
+# Seconds a request waits for another request's fetch of the same URL
+COALESCE_TIMEOUT = 30.0
+
+# Heuristic lifetime: this fraction of the time since Last-Modified, capped
+HEURISTIC_FRACTION = 0.1
+MAX_HEURISTIC_LIFETIME = 86400.0
+
+# Statuses that may be cached without explicit freshness information
+HEURISTIC_STATUSES = frozenset([200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501])
+
+# Unsafe methods whose success invalidates the cached target
+INVALIDATING_METHODS = frozenset(['POST', 'PUT', 'DELETE', 'PATCH'])
+
+# Request headers that make the client's request conditional
+CONDITIONAL_HEADERS = frozenset(['if-none-match', 'if-modified-since'])
+
+# Response headers that are recomputed when a cached response is served
+UNSTORED_HEADERS = HOP_BY_HOP_HEADERS | frozenset(['content-length', 'transfer-encoding', 'age'])
+
+# Headers a 304 Not Modified sent to the client carries over from the entry
+NOT_MODIFIED_HEADERS = frozenset(['cache-control', 'content-location', 'date', 'etag', 'expires',
+                                  'last-modified', 'vary'])
+
+# What lookup() tells the engine to do
+CACHE_BYPASS = 'bypass'          # Forward as usual, do not store
+CACHE_HIT = 'hit'                # Serve the entry
+CACHE_MISS = 'miss'              # Forward and store the response
+CACHE_REVALIDATE = 'revalidate'  # Forward with the entry's validators; a 304 refreshes it
+CACHE_UNAVAILABLE = 'unavailable'  # only-if-cached and nothing cached: answer 504
+
+
+def cache_key(target: str) -> Optional[str]:
+    """Normalize an absolute http:// request target, or None for anything else."""
+    try:
+        parts = urllib.parse.urlsplit(target)
+        port = parts.port
+    except ValueError:
+        return None
+    if parts.scheme.lower() != 'http' or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if ':' in host:
+        host = f"[{host}]"
+    if port not in (None, 80):
+        host = f"{host}:{port}"
+    path = parts.path or '/'
+    return f"http://{host}{path}" + (f"?{parts.query}" if parts.query else '')
+
+
+def cache_control(head: MessageHead) -> Dict[str, Optional[str]]:
+    """Parse the Cache-Control directives of a message (names lower-cased)."""
+    directives: Dict[str, Optional[str]] = {}
+    for value in head.get_all('cache-control'):
+        for item in value.split(','):
+            name, sep, argument = item.strip().partition('=')
+            if name:
+                directives.setdefault(name.lower(), argument.strip('"') if sep else None)
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(int(value))) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = email.utils.parsedate(value)
+    return float(calendar.timegm(parsed)) if parsed else None
+
+
+def _etag_matches(candidates: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match list against an entity tag."""
+    if candidates.strip() == '*':
+        return True
+    weak = etag[2:] if etag.startswith('W/') else etag
+    for candidate in candidates.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == weak:
+            return True
+    return False
+
+
+class CacheEntry:
+    """A stored response: head, freshness data, and the body in memory or on disk."""
+
+    __slots__ = ('key', 'status_line', 'headers', 'vary', 'response_time', 'initial_age', 'lifetime',
+                 'no_cache', 'length', 'body', 'body_path')
+
+    def __init__(self, key: str, status_line: str, headers: List[Tuple[str, str]],
+                 vary: List[Tuple[str, Optional[str]]], response_time: float, initial_age: float,
+                 lifetime: float, no_cache: bool, length: int) -> None:
+        self.key = key
+        self.status_line = status_line
+        self.headers = headers
+        self.vary = vary
+        self.response_time = response_time
+        self.initial_age = initial_age
+        self.lifetime = lifetime
+        self.no_cache = no_cache
+        self.length = length
+        self.body: Optional[bytes] = None
+        self.body_path: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        """Approximate bytes the entry takes in memory."""
+        return (self.length if self.body is not None else 0) + sum(len(k) + len(v) + 4 for k, v in self.headers)
+
+    def header(self, name: str) -> Optional[str]:
+        return MessageHead('', self.headers).get(name)
+
+    def age(self, now: float) -> float:
+        """Current age in seconds (RFC 9111 section 4.2.3)."""
+        return self.initial_age + max(0.0, now - self.response_time)
+
+    def is_fresh(self, now: float, max_age: Optional[float] = None) -> bool:
+        """Whether the entry may be served without revalidation."""
+        age = self.age(now)
+        if max_age is not None and age > max_age:
+            return False
+        return not self.no_cache and age < self.lifetime
+
+    def has_validators(self) -> bool:
+        return self.header('etag') is not None or self.header('last-modified') is not None
+
+    def matches(self, request: RequestHead) -> bool:
+        """Whether the request selects this entry under its Vary headers."""
+        return all((', '.join(request.get_all(name)) or None) == value for name, value in self.vary)
+
+    def not_modified(self, request: RequestHead) -> bool:
+        """Whether the client's own conditional headers let it keep its copy."""
+        candidates = request.get('if-none-match')
+        etag = self.header('etag')
+        if candidates is not None:
+            return etag is not None and _etag_matches(candidates, etag)
+        since = _http_date(request.get('if-modified-since'))
+        modified = _http_date(self.header('last-modified'))
+        return since is not None and modified is not None and modified <= since
+
+    def response_headers(self, now: float, not_modified: bool = False) -> List[Tuple[str, str]]:
+        """Headers to serve the entry with, before any Connection header."""
+        if not_modified:
+            headers = [(k, v) for k, v in self.headers if k.lower() in NOT_MODIFIED_HEADERS]
+        else:
+            headers = self.headers + [('Content-Length', str(self.length))]
+        return headers + [('Age', str(int(self.age(now))))]
+
+    def to_meta(self) -> Dict[str, Any]:
+        return {'key': self.key, 'status_line': self.status_line, 'headers': self.headers, 'vary': self.vary,
+                'response_time': self.response_time, 'initial_age': self.initial_age,
+                'lifetime': self.lifetime, 'no_cache': self.no_cache, 'length': self.length,
+                'body': os.path.basename(self.body_path or '')}
+
+    @classmethod
+    def from_meta(cls, meta: Dict[str, Any], directory: Path) -> 'CacheEntry':
+        entry = cls(meta['key'], meta['status_line'], [(k, v) for k, v in meta['headers']],
+                    [(k, v) for k, v in meta['vary']], meta['response_time'], meta['initial_age'],
+                    meta['lifetime'], meta['no_cache'], meta['length'])
+        entry.body_path = str(directory / meta['body'])
+        return entry
+
+
+class Flight:
+    """An upstream fetch that other requests for the same URL wait on."""
+
+    __slots__ = ('_done', '_callbacks', '_lock')
+
+    def __init__(self) -> None:
+        self._done = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def wait(self, timeout: float = COALESCE_TIMEOUT) -> bool:
+        """Block until the fetch has finished; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """Call callback (from any thread) once the fetch has finished."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self) -> None:
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class Lookup:
+    """What the cache decided for one request, plus what the engine needs to act on it."""
+
+    __slots__ = ('cache', 'action', 'key', 'entry', 'flight', 'leader', 'body_file')
+
+    def __init__(self, cache: 'HTTPCache', action: str, key: Optional[str] = None,
+                 entry: Optional[CacheEntry] = None) -> None:
+        self.cache = cache
+        self.action = action
+        self.key = key
+        self.entry = entry
+        self.flight: Optional[Flight] = None  # Set when another request is fetching the URL
+        self.leader = False                    # Whether this request fetches for the others
+        self.body_file: Optional[BinaryIO] = None
+
+    def forward_headers(self, headers: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Request headers to send upstream: the entry's validators replace the client's on revalidation."""
+        if self.action != CACHE_REVALIDATE or self.entry is None:
+            return headers
+        headers = [(k, v) for k, v in headers if k.lower() not in CONDITIONAL_HEADERS]
+        etag = self.entry.header('etag')
+        modified = self.entry.header('last-modified')
+        if etag is not None:
+            headers.append(('If-None-Match', etag))
+        if modified is not None:
+            headers.append(('If-Modified-Since', modified))
+        return headers
+
+    def close_body(self) -> None:
+        if self.body_file is not None:
+            self.body_file.close()
+            self.body_file = None
+
+    def release(self) -> None:
+        """Close the entry's body file and let waiting requests go. Always call when done."""
+        self.close_body()
+        if self.leader:
+            self.leader = False
+            self.cache._land(self.key)
+
+
+class _ChunkDecoder:
+    """Incremental decoder for a chunked body relayed in arbitrary pieces."""
+
+    __slots__ = ('state', 'line', 'remaining')
+
+    def __init__(self) -> None:
+        self.state = 'size'
+        self.line = bytearray()
+        self.remaining = 0
+
+    def feed(self, data: bytes, output: Callable[[bytes], None]) -> None:
+        view = memoryview(data)
+        while view:
+            if self.state == 'data':
+                take = min(self.remaining, len(view))
+                output(bytes(view[:take]))
+                view = view[take:]
+                self.remaining -= take
+                if not self.remaining:
+                    self.state, self.remaining = 'crlf', 2
+            elif self.state == 'crlf':
+                take = min(self.remaining, len(view))
+                self.line += view[:take]
+                view = view[take:]
+                self.remaining -= take
+                if not self.remaining:
+                    check_chunk_end(bytes(self.line))
+                    self.state, self.line = 'size', bytearray()
+            elif self.state == 'done':
+                return
+            else:
+                end = bytes(view).find(b'\n')
+                if end < 0:
+                    self.line += view
+                    return
+                self.line += view[:end + 1]
+                view = view[end + 1:]
+                line, self.line = bytes(self.line), bytearray()
+                if self.state == 'trailer':
+                    if line == b'\r\n':
+                        self.state = 'done'
+                    continue
+                size = parse_chunk_size(line)
+                self.state, self.remaining = ('data', size) if size else ('trailer', 0)
+
+
+class BodyCollector:
+    """Copy of a response body taken while it is relayed to the client.
+
+    Bodies that outgrow the memory object limit spill to a temporary file
+    in the cache directory; bodies that outgrow every tier are dropped.
+    Call feed() with the body bytes exactly as relayed (chunk framing
+    included), then HTTPCache.store().
+    """
+
+    def __init__(self, cache: 'HTTPCache', lookup: Lookup, entry: CacheEntry, framing: str, length: int) -> None:
+        self.cache = cache
+        self.lookup = lookup
+        self.entry = entry
+        self.framing = framing
+        self.expected = length if framing == BODY_LENGTH else None
+        self.size = 0
+        self.buffer: Optional[bytearray] = bytearray()
+        self.spill: Optional[BinaryIO] = None
+        self.spill_path: Optional[str] = None
+        self.failed = False
+        self._decoder = _ChunkDecoder() if framing == BODY_CHUNKED else None
+
+    def feed(self, data: bytes) -> None:
+        if self.failed:
+            return
+        if self._decoder is not None:
+            try:
+                self._decoder.feed(data, self._append)
+            except ValueError:
+                self.abandon()  # Malformed framing; the relay reports it
+        else:
+            self._append(data)
+
+    def _append(self, data: bytes) -> None:
+        if self.failed:
+            return
+        self.size += len(data)
+        try:
+            if self.buffer is not None and self.size > self.cache.memory_object_limit:
+                if self.size > self.cache.disk_object_limit:
+                    self.abandon()
+                    return
+                self.spill, self.spill_path = self.cache._temporary()
+                self.spill.write(self.buffer)
+                self.buffer = None
+            if self.spill is not None:
+                if self.size > self.cache.disk_object_limit:
+                    self.abandon()
+                    return
+                self.spill.write(data)
+            elif self.buffer is not None:
+                self.buffer += data
+        except OSError:
+            self.abandon()
+
+    def tee(self, write: Callable[[bytes], Any]) -> Callable[[bytes], None]:
+        """Wrap a write callable so whatever it relays is also collected."""
+        def relay(data: bytes) -> None:
+            write(data)
+            self.feed(data)
+        return relay
+
+    @property
+    def complete(self) -> bool:
+        if self.failed:
+            return False
+        if self._decoder is not None:
+            return self._decoder.state == 'done'
+        return self.expected is None or self.size == self.expected
+
+    def abandon(self) -> None:
+        """Give up on storing this body and free what was collected."""
+        self.failed = True
+        self.buffer = None
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        if self.spill_path is not None:
+            _remove(self.spill_path)
+            self.spill_path = None
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class HTTPCache:
+    """Two-tier (memory, disk) response cache for the HTTP front-end.
+
+    Args:
+        memory_bytes: Budget of the in-memory LRU tier
+        disk_bytes: Budget of the disk tier (0 disables it)
+        directory: Directory of the disk tier
+    """
+
+    def __init__(self, memory_bytes: int, disk_bytes: int = 0, directory: Optional[Path] = None) -> None:
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if directory is not None else 0
+        self.directory = directory
+        self.memory_object_limit = memory_bytes // OBJECT_FRACTION
+        self.disk_object_limit = max(self.disk_bytes // OBJECT_FRACTION, self.memory_object_limit)
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.coalesced = 0
+        self.stored = 0
+        if self.disk_bytes:
+            self.directory.mkdir(parents=True, exist_ok=True)  # type: ignore[union-attr]
+            self._disk_used = self._scan_disk()
+
+    # Lookup
+
+    def lookup(self, request: RequestHead, coalesce: bool = True) -> Lookup:
+        """Decide how to answer a request.
+
+        With coalesce, a miss either makes this request the leader that
+        fetches the URL or, when another request already does, returns a
+        Lookup whose flight the engine waits on before looking up again
+        with coalesce=False.
+        """
+        method = request.method.upper()
+        key = cache_key(request.target)
+        if key is None:
+            return Lookup(self, CACHE_BYPASS)
+        if method in INVALIDATING_METHODS:
+            self.invalidate(key)
+            return Lookup(self, CACHE_BYPASS)
+        if method not in ('GET', 'HEAD') or request.get('authorization') is not None \
+                or request.get('range') is not None or request.get('transfer-encoding') is not None \
+                or request.get('content-length') not in (None, '0'):
+            return Lookup(self, CACHE_BYPASS)
+        directives = cache_control(request)
+        if 'no-store' in directives:
+            return Lookup(self, CACHE_BYPASS)
+        no_cache = 'no-cache' in directives or (
+            not directives and 'no-cache' in (request.get('pragma') or '').lower())
+        max_age = _seconds(directives.get('max-age')) if 'max-age' in directives else None
+
+        lookup = Lookup(self, CACHE_MISS, key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.disk_bytes:
+            entry = self._load_disk(key, lookup)
+        if entry is not None and entry.matches(request):
+            lookup.entry = entry
+            if not no_cache and entry.is_fresh(now, max_age):
+                lookup.action = CACHE_HIT
+            elif method == 'GET' and entry.has_validators():
+                lookup.action = CACHE_REVALIDATE
+
+        with self._lock:
+            if lookup.action == CACHE_HIT:
+                self.hits += 1
+                return lookup
+            if coalesce and method == 'GET' and 'only-if-cached' not in directives:
+                lookup.flight = self._flights.get(key)
+                if lookup.flight is None:
+                    self._flights[key] = Flight()
+                    lookup.leader = True
+            if lookup.flight is None:
+                self.misses += 1  # A request waiting on another's fetch counts when it looks up again
+        if lookup.flight is not None or lookup.action == CACHE_MISS:
+            lookup.close_body()  # Only a revalidation may still serve the cached body
+        if 'only-if-cached' in directives:
+            lookup.action = CACHE_UNAVAILABLE
+        elif method != 'GET':
+            lookup.action = CACHE_BYPASS
+        return lookup
+
+    def count_coalesced(self, lookup: Lookup) -> None:
+        """Record that a request that waited on another's fetch was served from the cache."""
+        if lookup.action == CACHE_HIT:
+            with self._lock:
+                self.coalesced += 1
+
+    def _land(self, key: Optional[str]) -> None:
+        with self._lock:
+            flight = self._flights.pop(key, None) if key is not None else None
+        if flight is not None:
+            flight.finish()
+
+    # Storing
+
+    def collector(self, lookup: Lookup, request: RequestHead, response: ResponseHead,
+                  framing: str, length: int) -> Optional[BodyCollector]:
+        """Start collecting a response for storage, or None if it may not be stored."""
+        if lookup.action not in (CACHE_MISS, CACHE_REVALIDATE) or lookup.key is None:
+            return None
+        if framing not in (BODY_NONE, BODY_LENGTH, BODY_CHUNKED):
+            return None
+        if framing == BODY_LENGTH and length > self.disk_object_limit:
+            return None
+        directives = cache_control(response)
+        if 'no-store' in directives or 'private' in directives or response.get('set-cookie') is not None:
+            return None
+        vary_names = [name.strip().lower() for value in response.get_all('vary')
+                      for name in value.split(',') if name.strip()]
+        if '*' in vary_names:
+            return None
+
+        now = time.time()
+        date = _http_date(response.get('date'))
+        initial_age = max(_seconds(response.get('age')) or 0.0, now - date if date is not None else 0.0)
+        explicit = directives.get('s-maxage', directives.get('max-age'))
+        lifetime = _seconds(explicit) if explicit is not None else None
+        if lifetime is None and response.get('expires') is not None:
+            expires = _http_date(response.get('expires'))
+            lifetime = max(0.0, expires - (date or now)) if expires is not None else 0.0
+        if lifetime is None:
+            modified = _http_date(response.get('last-modified'))
+            if response.status in HEURISTIC_STATUSES and modified is not None:
+                lifetime = min(MAX_HEURISTIC_LIFETIME, max(0.0, (date or now) - modified) * HEURISTIC_FRACTION)
+            else:
+                lifetime = 0.0
+        if response.status not in HEURISTIC_STATUSES and explicit is None and response.get('expires') is None:
+            return None
+        entry = CacheEntry(
+            lookup.key, response.start_line,
+            [(k, v) for k, v in response.forward_headers() if k.lower() not in UNSTORED_HEADERS],
+            [(name, ', '.join(request.get_all(name)) or None) for name in vary_names],
+            now, initial_age, lifetime, 'no-cache' in directives, 0)
+        if not lifetime and not entry.has_validators():
+            return None
+        return BodyCollector(self, lookup, entry, framing, length)
+
+    def store(self, collector: BodyCollector) -> Optional[CacheEntry]:
+        """Store a fully relayed response; incomplete bodies are discarded."""
+        if not collector.complete:
+            collector.abandon()
+            return None
+        entry = collector.entry
+        entry.length = collector.size
+        if collector.spill is not None:
+            collector.spill.close()
+            collector.spill = None
+        try:
+            if self.disk_bytes:
+                self._store_disk(entry, collector)
+        except OSError:
+            pass
+        if collector.buffer is not None and entry.length <= self.memory_object_limit:
+            entry.body = bytes(collector.buffer)
+            self._store_memory(entry)
+        collector.abandon()  # Frees the buffer; a spill file was moved into place
+        with self._lock:
+            self.stored += 1
+        return entry
+
+    def refresh(self, lookup: Lookup, response: ResponseHead) -> CacheEntry:
+        """Update the entry that a 304 Not Modified answer confirmed (RFC 9111 section 4.3.4)."""
+        entry = lookup.entry
+        assert entry is not None
+        updates = [(k, v) for k, v in response.forward_headers() if k.lower() not in UNSTORED_HEADERS]
+        names = {k.lower() for k, _ in updates}
+        headers = [(k, v) for k, v in entry.headers if k.lower() not in names] + updates
+        refreshed = CacheEntry(entry.key, entry.status_line, headers, entry.vary, entry.response_time,
+                               entry.initial_age, entry.lifetime, entry.no_cache, entry.length)
+        directives = cache_control(MessageHead('', headers))
+        now = time.time()
+        date = _http_date(response.get('date'))
+        refreshed.response_time = now
+        refreshed.initial_age = max(_seconds(response.get('age')) or 0.0, now - date if date is not None else 0.0)
+        explicit = directives.get('s-maxage', directives.get('max-age'))
+        if explicit is not None:
+            refreshed.lifetime = _seconds(explicit) or 0.0
+        elif response.get('expires') is not None:
+            expires = _http_date(response.get('expires'))
+            refreshed.lifetime = max(0.0, expires - (date or now)) if expires is not None else 0.0
+        refreshed.no_cache = 'no-cache' in directives
+        refreshed.body, refreshed.body_path = entry.body, entry.body_path
+        if refreshed.body_path is not None:
+            try:
+                self._write_meta(refreshed)
+            except OSError:
+                pass
+        if refreshed.body is not None:
+            self._store_memory(refreshed)
+        with self._lock:
+            self.revalidated += 1
+        lookup.entry = refreshed
+        lookup.action = CACHE_HIT
+        return refreshed
+
+    def invalidate(self, key: str) -> None:
+        """Forget a URL after an unsafe request to it."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._memory_used -= entry.size
+        if self.disk_bytes:
+            self._remove_disk(self._name(key))
+
+    # Memory tier
+
+    def _store_memory(self, entry: CacheEntry) -> None:
+        with self._lock:
+            previous = self._entries.pop(entry.key, None)
+            if previous is not None:
+                self._memory_used -= previous.size
+            self._entries[entry.key] = entry
+            self._memory_used += entry.size
+            while self._memory_used > self.memory_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_used -= evicted.size
+
+    # Disk tier: <name>.meta holds the JSON head and names the body file,
+    # <name>.<token>.body the body. Writers rename complete files into place,
+    # so readers in other processes never see a partial entry.
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _temporary(self) -> Tuple[BinaryIO, str]:
+        if not self.disk_bytes:
+            raise OSError("No disk tier")
+        path = str(self.directory / f"tmp-{os.getpid()}-{os.urandom(6).hex()}")  # type: ignore[operator]
+        return open(path, 'wb'), path
+
+    def _load_disk(self, key: str, lookup: Lookup) -> Optional[CacheEntry]:
+        meta_path = self.directory / f"{self._name(key)}.meta"  # type: ignore[operator]
+        try:
+            with open(meta_path, 'rb') as meta_file:
+                entry = CacheEntry.from_meta(json.loads(meta_file.read()), self.directory)  # type: ignore[arg-type]
+            if entry.key != key:
+                return None
+            lookup.body_file = open(entry.body_path, 'rb')  # type: ignore[arg-type]
+            os.utime(meta_path)  # Most recently used
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if entry.length <= self.memory_object_limit and lookup.body_file is not None:
+            # Small entries are promoted to the memory tier
+            try:
+                entry.body = lookup.body_file.read(entry.length)
+                lookup.body_file.seek(0)
+            except OSError:
+                return entry
+            if len(entry.body) == entry.length:
+                self._store_memory(entry)
+            else:
+                entry.body = None
+        return entry
+
+    def _write_meta(self, entry: CacheEntry) -> None:
+        name = self._name(entry.key)
+        file, path = self._temporary()
+        with file:
+            file.write(json.dumps(entry.to_meta()).encode('utf-8'))
+        os.replace(path, self.directory / f"{name}.meta")  # type: ignore[operator]
+
+    def _store_disk(self, entry: CacheEntry, collector: BodyCollector) -> None:
+        if entry.length > self.disk_object_limit:
+            return
+        name = self._name(entry.key)
+        previous = self._body_files(name)
+        body_path = str(self.directory / f"{name}.{os.urandom(6).hex()}.body")  # type: ignore[operator]
+        if collector.spill_path is not None:
+            os.replace(collector.spill_path, body_path)
+            collector.spill_path = None
+        else:
+            file, path = self._temporary()
+            with file:
+                file.write(collector.buffer or b'')
+            os.replace(path, body_path)
+        entry.body_path = body_path
+        self._write_meta(entry)
+        freed = self._remove_bodies(previous)  # Open readers keep their descriptor
+        with self._lock:
+            self._disk_used += entry.length - freed
+            over = self._disk_used > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _body_files(self, name: str) -> List[str]:
+        try:
+            return [str(self.directory / file) for file in os.listdir(self.directory)  # type: ignore[operator]
+                    if file.startswith(name + '.') and file.endswith('.body')]
+        except OSError:
+            return []
+
+    def _remove_bodies(self, paths: List[str]) -> int:
+        """Remove body files; returns the bytes they held."""
+        freed = 0
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+        return freed
+
+    def _remove_disk(self, name: str) -> None:
+        _remove(str(self.directory / f"{name}.meta"))  # type: ignore[operator]
+        freed = self._remove_bodies(self._body_files(name))
+        with self._lock:
+            self._disk_used -= freed
+
+    def _scan_disk(self) -> int:
+        """Disk tier usage in bytes; also removes temporary files left by crashed writers."""
+        used = 0
+        stale = time.time() - 3600
+        for entry in os.scandir(self.directory):  # type: ignore[arg-type]
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            if entry.name.startswith('tmp-') and info.st_mtime < stale:
+                _remove(entry.path)
+            elif entry.name.endswith('.body'):
+                used += info.st_size
+        return used
+
+    def _evict_disk(self) -> None:
+        """Remove the least recently used entries until the tier is at 90% of its budget."""
+        bodies: Dict[str, List[os.DirEntry]] = {}
+        metas = []
+        for item in os.scandir(self.directory):  # type: ignore[arg-type]
+            name = item.name.split('.', 1)[0]
+            try:
+                if item.name.endswith('.meta'):
+                    metas.append((item.stat().st_mtime, name))
+                elif item.name.endswith('.body'):
+                    item.stat()  # Cached for the sizes below
+                    bodies.setdefault(name, []).append(item)
+            except OSError:
+                continue
+        sizes = {name: sum(item.stat().st_size for item in items) for name, items in bodies.items()}
+        total = sum(sizes.values())
+        for _, name in sorted(metas):
+            if total <= self.disk_bytes * 0.9:
+                break
+            _remove(str(self.directory / f"{name}.meta"))  # type: ignore[operator]
+            for item in bodies.get(name, []):
+                _remove(item.path)
+            total -= sizes.get(name, 0)
+        with self._lock:
+            self._disk_used = total
+
+    def clear(self) -> None:
+        """Drop the memory tier (the disk tier persists)."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_used = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters and tier usage."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'coalesced': self.coalesced,
+                'stored': self.stored,
+                'entries': len(self._entries),
+                'memory_bytes': self._memory_used,
+                'disk_bytes': self._disk_used,
+            }
+
+
+def create_cache(memory_mb: int = 0, disk_mb: int = 0, directory: Optional[str] = None) -> Optional[HTTPCache]:
+    """Build the cache the --cache-* options describe, or None when both tiers are off.
+
+    Args:
+        memory_mb: Memory tier budget in MiB
+        disk_mb: Disk tier budget in MiB (0 disables the disk tier)
+        directory: Disk tier directory (default: DEFAULT_CACHE_DIR)
+    """
+    if memory_mb < 0 or disk_mb < 0:
+        raise ValueError("Cache sizes cannot be negative")
+    if not memory_mb and not disk_mb:
+        return None
+    path = Path(directory).expanduser() if directory else DEFAULT_CACHE_DIR
+    return HTTPCache(memory_mb * MIB, disk_mb * MIB, path if disk_mb > 0 else None)
@@ -0,0 +1,310 @@
+"""
+Proxy Manager CLI - HTTP Parser
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Bytes-level HTTP/1.1 message head parsing and body framing rules shared by
+both forwarding engines.
+"""
+
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+
+# Upper bound for a request/response header block
+MAX_HEADER_SIZE = 65536
+
+# Blank line terminating a header block
+HEAD_TERMINATOR = b"\r\n\r\n"
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection',
+    'proxy-connection',
+    'keep-alive',
+    'te',
+    'trailer',
+    'upgrade',
+])
+
+# Body framing kinds returned by request_framing()/response_framing()
+BODY_NONE = 'none'
+BODY_LENGTH = 'length'
+BODY_CHUNKED = 'chunked'
+BODY_UNTIL_CLOSE = 'close'
+
+# Exact forms of a Content-Length value and a chunk size (RFC 9112 sections 6.3, 7.1);
+# int() also takes signs, underscores, whitespace and 0x prefixes that the next hop may read differently
+CONTENT_LENGTH_PATTERN = re.compile(r'[0-9]+')
+CHUNK_SIZE_PATTERN = re.compile(rb'[0-9A-Fa-f]+')
+
+# Line ending that closes a chunk-size line and follows each chunk's data
+CRLF = b"\r\n"
+
+
+class BadRequestBody(ValueError):
+    """A client's request body does not follow its framing, e.g. a malformed chunk size."""
+
+
+class MessageHead:
+    """Start line and header fields of an HTTP message."""
+
+    def __init__(self, start_line: str, headers: Iterable[Tuple[str, str]]) -> None:
+        self.start_line = start_line
+        self.headers: List[Tuple[str, str]] = list(headers)
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the first value of header name (case-insensitive)."""
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def get_all(self, name: str) -> List[str]:
+        """Return every value of header name (case-insensitive)."""
+        name = name.lower()
+        return [value for key, value in self.headers if key.lower() == name]
+
+    def connection_tokens(self) -> Set[str]:
+        """Return the lower-cased tokens of the Connection headers."""
+        tokens = set()
+        for value in self.get_all('connection') + self.get_all('proxy-connection'):
+            tokens.update(token.strip().lower() for token in value.split(',') if token.strip())
+        return tokens
+
+    def forward_headers(self) -> List[Tuple[str, str]]:
+        """Return the headers that may be forwarded to the next hop.
+
+        Content-Length is dropped when Transfer-Encoding is present: the
+        body is framed by the transfer coding, and forwarding both would let
+        the next hop pick the other framing (request smuggling, RFC 9112
+        section 6.3).
+        """
+        dropped = HOP_BY_HOP_HEADERS | self.connection_tokens()
+        if self.get('transfer-encoding') is not None:
+            dropped = dropped | {'content-length'}
+        return [(key, value) for key, value in self.headers if key.lower() not in dropped]
+
+    def keep_alive(self, version: str) -> bool:
+        """Whether the connection persists after this message.
+
+        Args:
+            version: HTTP version of the message, e.g. 'HTTP/1.1'
+        """
+        tokens = self.connection_tokens()
+        if 'close' in tokens:
+            return False
+        if version == 'HTTP/1.0':
+            return 'keep-alive' in tokens
+        return version.startswith('HTTP/1.')
+
+    def is_chunked(self) -> bool:
+        """Whether the final transfer coding is chunked."""
+        codings = ','.join(self.get_all('transfer-encoding'))
+        if not codings:
+            return False
+        return codings.split(',')[-1].strip().lower() == 'chunked'
+
+    def content_length(self) -> Optional[int]:
+        """Return the Content-Length value, or None if absent.
+
+        Raises:
+            ValueError: If the header is malformed or the values disagree
+        """
+        values = {value.strip() for value in self.get_all('content-length')}
+        if not values:
+            return None
+        if len(values) > 1:
+            raise ValueError("Conflicting Content-Length headers")
+        value = values.pop()
+        if not CONTENT_LENGTH_PATTERN.fullmatch(value):
+            raise ValueError(f"Malformed Content-Length: {value!r}")
+        return int(value)
+
+
+class RequestHead(MessageHead):
+    """Parsed HTTP request line and headers."""
+
+    def __init__(self, start_line: str, headers: Iterable[Tuple[str, str]]) -> None:
+        super().__init__(start_line, headers)
+        parts = start_line.split(' ')
+        if len(parts) != 3:
+            raise ValueError(f"Malformed request line: {start_line!r}")
+        self.method, self.target, self.version = parts
+
+
+class ResponseHead(MessageHead):
+    """Parsed HTTP status line and headers."""
+
+    def __init__(self, start_line: str, headers: Iterable[Tuple[str, str]]) -> None:
+        super().__init__(start_line, headers)
+        parts = start_line.split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise ValueError(f"Malformed status line: {start_line!r}")
+        self.version = parts[0]
+        self.status = int(parts[1])
+        self.reason = parts[2] if len(parts) > 2 else ''
+
+
+def parse_head(data: bytes) -> Tuple[str, List[Tuple[str, str]]]:
+    """Split a raw header block into its start line and header fields.
+
+    Args:
+        data: Header block, with or without the terminating blank line
+
+    Returns:
+        Tuple of (start line, list of (name, value) pairs)
+    """
+    lines = data.decode('latin-1').split('\n')
+    start_line = lines[0].rstrip('\r')
+    headers: List[Tuple[str, str]] = []
+    for line in lines[1:]:
+        line = line.rstrip('\r')
+        if not line:
+            break
+        if line[0] in ' \t' and headers:
+            # Obsolete line folding: append to the previous value
+            name, value = headers[-1]
+            headers[-1] = (name, f"{value} {line.strip()}")
+            continue
+        name, sep, value = line.partition(':')
+        if not sep or not name or name != name.strip():
+            raise ValueError(f"Malformed header line: {line!r}")
+        headers.append((name, value.strip()))
+    return start_line, headers
+
+
+def parse_request_head(data: bytes) -> RequestHead:
+    """Parse a raw request header block."""
+    start_line, headers = parse_head(data)
+    return RequestHead(start_line, headers)
+
+
+def parse_response_head(data: bytes) -> ResponseHead:
+    """Parse a raw response header block."""
+    start_line, headers = parse_head(data)
+    return ResponseHead(start_line, headers)
+
+
+class ResponseHeadParser:
+    """Incremental parser for a response head arriving in arbitrary segments.
+
+    Feed it whatever each recv() returned; once the blank line has arrived
+    feed() returns the parsed head, and any bytes that came after it (the
+    first tunnel bytes of a CONNECT, say) are kept in ``rest``.
+
+    Args:
+        limit: Largest header block accepted
+    """
+
+    def __init__(self, limit: int = MAX_HEADER_SIZE) -> None:
+        self.limit = limit
+        self.rest = b""
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def feed(self, data: bytes) -> Optional[ResponseHead]:
+        """Add received bytes, returning the head once it is complete.
+
+        Raises:
+            ValueError: If the head is malformed or larger than limit
+        """
+        self._buffer += data
+        # A terminator may straddle two segments, so rescan the last few bytes
+        start = max(0, self._scanned - 3)
+        ends = [index + len(terminator) for terminator in (HEAD_TERMINATOR, b"\n\n")
+                for index in (self._buffer.find(terminator, start),) if index >= 0]
+        if not ends:
+            if len(self._buffer) > self.limit:
+                raise ValueError("Header block too large")
+            self._scanned = len(self._buffer)
+            return None
+        end = min(ends)
+        head = parse_response_head(bytes(self._buffer[:end]))
+        self.rest = bytes(self._buffer[end:])
+        self._buffer.clear()
+        self._scanned = 0
+        return head
+
+
+def build_head(start_line: str, headers: Iterable[Tuple[str, str]]) -> bytes:
+    """Serialize a start line and headers into a raw header block."""
+    lines = [start_line]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def refusal_head(response: ResponseHead) -> bytes:
+    """Serialize an upstream's refusal of a CONNECT for the client.
+
+    Keeps the status line and any Proxy-Authenticate challenges; the
+    refusal's body is not relayed.
+    """
+    headers = [(name, value) for name, value in response.headers if name.lower() == 'proxy-authenticate']
+    headers += [('Content-Length', '0'), ('Connection', 'close')]
+    return build_head(f"HTTP/1.1 {response.status} {response.reason}".rstrip(), headers)
+
+
+def request_framing(head: MessageHead) -> Tuple[str, int]:
+    """Determine how the body of a request is delimited.
+
+    Returns:
+        Tuple of (framing kind, content length); the length is only
+        meaningful for BODY_LENGTH
+    """
+    if head.get('transfer-encoding') is not None:
+        if not head.is_chunked():
+            raise ValueError("Unsupported transfer coding in request")
+        return BODY_CHUNKED, 0
+    length = head.content_length()
+    if length:
+        return BODY_LENGTH, length
+    return BODY_NONE, 0
+
+
+def response_framing(head: ResponseHead, request_method: str) -> Tuple[str, int]:
+    """Determine how the body of a response is delimited.
+
+    Args:
+        head: Parsed response head
+        request_method: Method of the request this response answers
+
+    Returns:
+        Tuple of (framing kind, content length)
+    """
+    if request_method.upper() == 'HEAD' or head.status < 200 or head.status in (204, 304):
+        return BODY_NONE, 0
+    if head.get('transfer-encoding') is not None:
+        if head.is_chunked():
+            return BODY_CHUNKED, 0
+        return BODY_UNTIL_CLOSE, 0
+    length = head.content_length()
+    if length is not None:
+        return (BODY_LENGTH, length) if length else (BODY_NONE, 0)
+    return BODY_UNTIL_CLOSE, 0
+
+
+def parse_chunk_size(line: bytes) -> int:
+    """Parse the size from a CRLF-terminated chunk-size line, ignoring chunk extensions.
+
+    Raises:
+        ValueError: If the line is not terminated by CRLF or the size is not plain hex digits
+    """
+    if not line.endswith(CRLF):
+        raise ValueError("Chunk size line not terminated by CRLF")
+    size = line[:-2].split(b';', 1)[0].rstrip(b' \t')
+    if not CHUNK_SIZE_PATTERN.fullmatch(size):
+        raise ValueError(f"Malformed chunk size: {size[:32]!r}")
+    return int(size, 16)
+
+
+def check_chunk_end(data: bytes) -> None:
+    """Check the two bytes that follow a chunk's data.
+
+    Raises:
+        ValueError: If they are not CRLF
+    """
+    if data != CRLF:
+        raise ValueError("Chunk data not followed by CRLF")
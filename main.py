@@ -9,12 +9,12 @@ Main CLI application with rich formatting.
 """
 
 import argparse
+import json
 import os
 import sys
-import subprocess
-import platform
 import time
-from typing import Dict, List, Optional, Any
+from pathlib import Path
+from typing import Callable, Dict, List, NoReturn, Optional, Tuple, Any, cast
 
 # Import specific functions to avoid wildcard import issues
 from config_manager import (
@@ -22,23 +22,66 @@ from config_manager import (
     add_profile,
     list_profiles,
     get_profile,
-    delete_profile
+    get_profiles,
+    query_profiles,
+    delete_profile,
+    record_health,
+    resolve_profiles as lookup_profiles,
+    split_tags,
+    get_backend_name,
+    set_backend,
+    BACKENDS,
+    SORT_ORDERS
 )
 
-from proxy_server import (
-    start_http_proxy,
-    start_socks_proxy,
-    stop_all_servers
+from upstream_pool import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from upstreams import POLICIES, DEFAULT_POLICY
+from defaults import (
+    ENGINES,
+    DEFAULT_ENGINE,
+    RELAY_MODES,
+    DEFAULT_RELAY_MODE,
+    DEFAULT_TARGET,
+    DEFAULT_TIMEOUT,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_METRICS_PORT,
+    DEFAULT_DRAIN_TIMEOUT,
+    DEFAULT_LISTEN_HOST,
+    DEFAULT_LOCAL_PORT,
+    DEFAULT_BACKLOG,
+    DEFAULT_RELAY_HIGH_WATER,
+    DEFAULT_RELAY_LOW_WATER
 )
-
-# Import rich for better formatting and colors
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.text import Text
-from rich.prompt import Confirm
-
-console = Console()
+from profile_io import FORMATS as PROFILE_FORMATS, import_profiles, export_profiles
+
+# Environment variable that selects plain output like --plain
+PLAIN_ENV = 'PROXY_CLI_PLAIN'
+
+# --output choices: rich/plain text, one JSON document, or one JSON object per line
+OUTPUT_FORMATS = ('table', 'json', 'ndjson')
+
+# Output classes, bound by load_ui() once the command line is parsed: rich's,
+# or the unstyled stand-ins from plain_output. The networking modules and rich
+# are imported by the commands that need them, so quick commands like list,
+# add and delete start fast.
+console: Any = None
+Table: Any = None
+Panel: Any = None
+Confirm: Any = None
+escape: Any = None
+
+def load_ui(plain: bool = False) -> None:
+    """Bind console, Table, Panel, Confirm and escape to rich or plain output."""
+    global console, Table, Panel, Confirm, escape
+    if plain:
+        from plain_output import Console, Table, Panel, Confirm, escape
+    else:
+        from rich.console import Console
+        from rich.table import Table
+        from rich.panel import Panel
+        from rich.markup import escape
+        from rich.prompt import Confirm
+    console = Console()
 
 def show_help_information():
     """Display comprehensive help and usage information."""
@@ -88,12 +131,17 @@ def show_help_information():
         "• python main.py add <name> --type http --host <host> --port <port>\n"
         "• python main.py list\n"
         "• python main.py delete <name>\n"
-        "• python main.py use <name> --mode local\n\n"
+        "• python main.py use <name> --mode local\n"
+        "• python main.py probe --all\n"
+        "• python main.py import proxies.csv\n"
+        "• python main.py export backup.jsonl\n"
+        "• python main.py stats --metrics-port 9100\n"
+        "• python main.py daemon start <name>   (then: daemon status | switch | reload | stop)\n\n"
 
         "[italic]Examples:[/italic]\n"
         "• python main.py add work-proxy --type socks5 --host proxy.company.com --port 1080 --username myuser --password mypass\n"
         "• python main.py use work-proxy --mode local\n"
-        "• python main.py list\n"
+        "• python main.py list --tag residential --output ndjson\n"
         "• python main.py delete old-proxy\n\n"
 
         "[bold yellow]🔒 Security Notes:[/bold yellow]\n"
@@ -175,7 +223,7 @@ def show_interactive_menu():
 
 def list_proxy_profiles():
     """List all proxy profiles in a formatted table."""
-    profiles = list_profiles()
+    profiles = get_profiles()
     if profiles:
         console.print(Panel(
             f"📋 Proxy Profiles ({len(profiles)} total)",
@@ -194,8 +242,7 @@ def list_proxy_profiles():
         table.add_column("Port", style="blue", justify="center")
         table.add_column("Auth", style="red", justify="center")
 
-        for p in profiles:
-            profile_data = get_profile(p)
+        for p, profile_data in profiles.items():
             if profile_data:  # Type assertion for Pylance
                 has_auth = "✅ Yes" if profile_data.get('username') else "❌ No"
                 profile_type = profile_data.get('type', 'N/A').upper()
@@ -217,6 +264,196 @@ def list_proxy_profiles():
             border_style="yellow"
         ))
 
+def resolve_profiles(names: List[str], output: str = 'table') -> Dict[str, Dict[str, str]]:
+    """Look up profiles by name, expanding @group; exits with an error if one is missing."""
+    try:
+        return lookup_profiles(names)
+    except KeyError as e:
+        name = e.args[0]
+        kind = 'Group' if name.startswith('@') else 'Profile'
+        if output != 'table':
+            emit_error(f"{kind} '{name}' not found", output, name=name)
+        console.print(Panel(
+            f"{kind} '{name}' not found!\n\n"
+            f"Please check the profile name and try again.",
+            title="Error",
+            border_style="red"
+        ))
+        sys.exit(1)
+
+def profile_json(name: str, data: Dict[str, str]) -> Dict[str, Any]:
+    """A profile as a JSON record; the password is left out (use export for credentials)."""
+    return {
+        'name': name,
+        'type': data.get('type'),
+        'host': data.get('host'),
+        'port': int(data['port']),
+        'username': data.get('username') or None,
+        'auth': bool(data.get('username')),
+        'group': data.get('group') or None,
+        'tags': split_tags(data.get('tags', '')),
+        'region': data.get('region') or None,
+        'latency_ms': float(data['latency_ms']) if data.get('latency_ms') else None,
+        'checked_at': float(data['checked_at']) if data.get('checked_at') else None,
+    }
+
+def emit(record: Dict[str, Any], output: str) -> None:
+    """Print one record: indented for json, a single line for ndjson."""
+    print(json.dumps(record, indent=2 if output == 'json' else None), flush=True)
+
+def emit_error(message: str, output: str, **fields: Any) -> NoReturn:
+    """Report an error as a JSON record on stdout and exit with status 1."""
+    emit(dict(event='error', error=message, **fields), output)
+    sys.exit(1)
+
+def stream_profiles(profiles: Dict[str, Dict[str, str]], output: str) -> None:
+    """Write profiles as a JSON array or as NDJSON, one record at a time."""
+    write = sys.stdout.write
+    if output == 'ndjson':
+        for name, data in profiles.items():
+            write(json.dumps(profile_json(name, data)) + '\n')
+        return
+    separator = '\n  '
+    write('[')
+    for name, data in profiles.items():
+        write(separator + json.dumps(profile_json(name, data)))
+        separator = ',\n  '
+    write('\n]\n' if profiles else ']\n')
+
+def show_probe_results(results: List[Dict[str, Any]], target: str) -> None:
+    """Print probe results as a table, fastest first."""
+    table = Table(title=f"Probe: {target}", show_header=True, header_style="bold yellow")
+    table.add_column("Name", style="bold green", no_wrap=True)
+    table.add_column("Type", style="cyan", no_wrap=True)
+    table.add_column("Address", style="magenta")
+    table.add_column("Connect (ms)", justify="right")
+    table.add_column("Handshake (ms)", justify="right")
+    table.add_column("First Byte (ms)", justify="right")
+    table.add_column("Total (ms)", style="bold", justify="right")
+    table.add_column("Status")
+
+    def _ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.1f}"
+
+    for result in results:
+        table.add_row(
+            result['name'],
+            result['type'].upper(),
+            result['address'],
+            _ms(result['connect_ms']),
+            _ms(result['handshake_ms']),
+            _ms(result['ttfb_ms']),
+            _ms(result['total_ms']),
+            "[green]OK[/green]" if result['ok'] else f"[red]{escape(result['error'] or 'failed')}[/red]"
+        )
+    console.print(table)
+    alive = sum(1 for result in results if result['ok'])
+    console.print(f"{alive} of {len(results)} profiles reachable.")
+
+def show_upstream_stats(stats: List[Dict[str, Any]]) -> None:
+    """Print per-upstream balancing counters as a table."""
+    table = Table(title="Upstreams", show_header=True, header_style="bold yellow")
+    table.add_column("Name", style="bold green", no_wrap=True)
+    table.add_column("Address", style="magenta")
+    table.add_column("Active", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Failures", style="red", justify="right")
+    table.add_column("Ejections", style="red", justify="right")
+    table.add_column("Latency (ms)", style="cyan", justify="right")
+    for entry in stats:
+        latency = entry['latency_ms']
+        table.add_row(
+            entry['name'] + (" (ejected)" if entry['ejected'] else ""),
+            entry['address'],
+            str(entry['active']),
+            str(entry['total']),
+            str(entry['failures']),
+            str(entry['ejections']),
+            "-" if latency is None else f"{latency:.1f}"
+        )
+    console.print(table)
+
+def show_metrics_summary(samples: Dict[Any, float], source: str) -> None:
+    """Print a running instance's metrics as tables."""
+    from metrics import sum_samples, label_values, histogram_quantile
+
+    overview = Table(title=f"Proxy Metrics ({source})", show_header=True, header_style="bold yellow")
+    overview.add_column("Front-end", style="bold green")
+    overview.add_column("Active", justify="right")
+    overview.add_column("Connections", justify="right")
+    overview.add_column("Requests", justify="right")
+    overview.add_column("Bytes In", style="cyan", justify="right")
+    overview.add_column("Bytes Out", style="cyan", justify="right")
+    overview.add_column("Tunnel p50 (s)", justify="right")
+    for frontend in label_values(samples, 'proxy_connections_total', 'frontend'):
+        p50 = histogram_quantile(samples, 'proxy_tunnel_duration_seconds', 0.5, frontend=frontend)
+        overview.add_row(
+            frontend,
+            f"{sum_samples(samples, 'proxy_connections_active', frontend=frontend):.0f}",
+            f"{sum_samples(samples, 'proxy_connections_total', frontend=frontend):.0f}",
+            f"{sum_samples(samples, 'proxy_requests_total', frontend=frontend):.0f}",
+            f"{sum_samples(samples, 'proxy_bytes_total', frontend=frontend, direction='in'):.0f}",
+            f"{sum_samples(samples, 'proxy_bytes_total', frontend=frontend, direction='out'):.0f}",
+            "-" if p50 is None else f"{p50:g}"
+        )
+    console.print(overview)
+
+    upstream_names = label_values(samples, 'proxy_upstream_connect_seconds_count', 'upstream')
+    if upstream_names:
+        upstreams = Table(title="Upstream Connect Latency", show_header=True, header_style="bold yellow")
+        upstreams.add_column("Upstream", style="bold green")
+        upstreams.add_column("Connects", justify="right")
+        upstreams.add_column("Avg (ms)", justify="right")
+        upstreams.add_column("p50 (ms)", justify="right")
+        upstreams.add_column("p99 (ms)", justify="right")
+        for name in upstream_names:
+            count = sum_samples(samples, 'proxy_upstream_connect_seconds_count', upstream=name)
+            total = sum_samples(samples, 'proxy_upstream_connect_seconds_sum', upstream=name)
+            p50 = histogram_quantile(samples, 'proxy_upstream_connect_seconds', 0.5, upstream=name)
+            p99 = histogram_quantile(samples, 'proxy_upstream_connect_seconds', 0.99, upstream=name)
+            upstreams.add_row(
+                name,
+                f"{count:.0f}",
+                f"{total / count * 1000:.1f}" if count else "-",
+                "-" if p50 is None else f"<= {p50 * 1000:g}",
+                "-" if p99 is None else f"<= {p99 * 1000:g}"
+            )
+        console.print(upstreams)
+
+    limits = [dict(labels) for (name, labels), _ in samples.items() if name == 'proxy_rate_limit_bytes_per_second']
+    if limits:
+        from shaping import format_rate
+        table = Table(title="Rate Limits", show_header=True, header_style="bold yellow")
+        table.add_column("Listener", style="bold green")
+        table.add_column("Scope")
+        table.add_column("Key")
+        table.add_column("Limit", justify="right")
+        table.add_column("In", style="cyan", justify="right")
+        table.add_column("Out", style="cyan", justify="right")
+        for labels in sorted(limits, key=lambda item: (item['listener'], item['scope'], item['key'])):
+            table.add_row(
+                labels['listener'],
+                labels['scope'],
+                escape(labels['key']) or "-",
+                format_rate(sum_samples(samples, 'proxy_rate_limit_bytes_per_second', **labels)),
+                format_rate(sum_samples(samples, 'proxy_rate_bytes_per_second', direction='in', **labels)),
+                format_rate(sum_samples(samples, 'proxy_rate_bytes_per_second', direction='out', **labels))
+            )
+        console.print(table)
+
+    errors = [(dict(labels), value) for (name, labels), value in samples.items()
+              if name == 'proxy_errors_total' and value]
+    if errors:
+        table = Table(title="Errors", show_header=True, header_style="bold yellow")
+        table.add_column("Stage", style="bold red")
+        table.add_column("Error")
+        table.add_column("Count", justify="right")
+        for labels, value in sorted(errors, key=lambda item: -item[1]):
+            table.add_row(labels.get('stage', ''), escape(labels.get('error', '')), f"{value:.0f}")
+        console.print(table)
+    else:
+        console.print("No errors recorded.")
+
 def add_proxy_profile_interactive():
     """Interactively add a new proxy profile."""
     console.print(Panel(
@@ -397,26 +634,48 @@ def use_proxy_profile_interactive():
                     border_style="red"
                 ))
         else:
+            listen = console.input(f"[bold yellow]Local address [default: {DEFAULT_LISTEN_HOST}:{DEFAULT_LOCAL_PORT}]: [/bold yellow]").strip()
+            try:
+                host, port, _ = parse_listen(listen) if listen else (None, DEFAULT_LOCAL_PORT, [])
+            except argparse.ArgumentTypeError as e:
+                console.print(Panel(f"❌ Invalid local address: {e}", title="Error", border_style="red"))
+                return
+            endpoint = format_endpoint(host or DEFAULT_LISTEN_HOST, port)
+            allow_remote = False
+            if host is not None:
+                from resolver import is_loopback, listen_address
+                try:
+                    allow_remote = not is_loopback(listen_address(host, port)[1][0])
+                except OSError:
+                    pass  # Starting the server reports the lookup error
+                if allow_remote and not Confirm.ask(f"⚠️  Anyone who can reach {endpoint} could use this proxy without "
+                                                    f"authenticating. Listen there anyway?", default=False):
+                    return
             console.print(Panel(
                 f"🚀 Starting local proxy server...\n\n"
                 f"📡 Upstream Proxy: {profile['host']}:{profile['port']} ({profile['type'].upper()})\n"
-                f"🔌 Local Endpoint: localhost:8080\n"
+                f"🔌 Local Endpoint: {endpoint}\n"
                 f"🔐 Auth Configured: {'✅ Yes' if profile.get('username') else '❌ No'}\n\n"
                 f"💡 Press Ctrl+C to stop the proxy server",
                 title="🔄 Local Proxy Server",
                 border_style="blue"
             ))
 
+            from proxy_server import start_http_proxy, start_socks_proxy
+
             try:
                 if profile['type'].startswith('socks'):
-                    server = start_socks_proxy(8080, profile['host'], int(profile['port']), profile.get('username'), profile.get('password'))
+                    server = start_socks_proxy(port, profile['host'], int(profile['port']), profile.get('username'), profile.get('password'), proxy_type=profile['type'],
+                                               local_host=host or DEFAULT_LISTEN_HOST, allow_remote=allow_remote)
                 else:
-                    server = start_http_proxy(8080, profile['host'], int(profile['port']))
+                    server = start_http_proxy(port, profile['host'], int(profile['port']), local_host=host or DEFAULT_LISTEN_HOST,
+                                              username=profile.get('username'), password=profile.get('password'),
+                                              allow_remote=allow_remote)
 
                 console.print(Panel(
-                    f"✅ Local proxy is now running on localhost:8080\n\n"
+                    f"✅ Local proxy is now running on {endpoint}\n\n"
                     f"🌍 Applications can now use this proxy to route traffic through {profile['host']}:{profile['port']}\n\n"
-                    f"⚙️  Configure your applications to use HTTP proxy at localhost:8080",
+                    f"⚙️  Configure your applications to use HTTP proxy at {endpoint}",
                     title="✅ Active",
                     border_style="green"
                 ))
@@ -450,7 +709,233 @@ def use_proxy_profile_interactive():
             border_style="red"
         ))
 
+def add_local_proxy_options(parser: argparse.ArgumentParser) -> None:
+    """Add the local proxy options shared by use and daemon start/run."""
+    parser.add_argument('--policy', choices=POLICIES, default=DEFAULT_POLICY, help='How local mode balances connections across several profiles')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE, help='Forwarding engine for local mode')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help='Idle keep-alive connections kept to an HTTP upstream (0 disables pooling)')
+    parser.add_argument('--pool-idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT, help='Seconds a pooled upstream connection may stay idle')
+    parser.add_argument('--relay', choices=RELAY_MODES, default=DEFAULT_RELAY_MODE, help='Tunnel relay: splice (Linux zero-copy), copy, or auto')
+    parser.add_argument('--relay-high-water', type=int, default=DEFAULT_RELAY_HIGH_WATER, metavar='KIB', help=f'Stop reading from a tunnel side once this much waits for the other side (default: {DEFAULT_RELAY_HIGH_WATER})')
+    parser.add_argument('--relay-low-water', type=int, default=DEFAULT_RELAY_LOW_WATER, metavar='KIB', help=f'Resume reading once the waiting bytes drain to this much (default: {DEFAULT_RELAY_LOW_WATER})')
+    parser.add_argument('--global-rate', type=rate_arg, default=0, metavar='RATE', help='Limit tunnel traffic of every listener together to this many bytes/s each way, e.g. 10m (default: unlimited)')
+    parser.add_argument('--listener-rate', type=rate_arg, default=0, metavar='RATE', help='Limit tunnel traffic of each listener to this many bytes/s each way (default: unlimited)')
+    parser.add_argument('--client-rate', type=rate_arg, default=0, metavar='RATE', help='Limit tunnel traffic of each client address to this many bytes/s each way (default: unlimited)')
+    parser.add_argument('--upstream-rate', type=upstream_rate_arg, metavar='[NAME=]RATE[,...]', help='Limit tunnel traffic through each upstream profile, or the named ones, to this many bytes/s each way')
+    parser.add_argument('--connect-rate', type=float, default=0, metavar='PER_SECOND', help='New tunnels each client address may open per second; more are refused (default: unlimited)')
+    parser.add_argument('--cache-memory', type=int, default=0, metavar='MIB', help='Cache plain HTTP GET responses in this much memory (default: no cache)')
+    parser.add_argument('--cache-disk', type=int, default=0, metavar='MIB', help='Also cache responses on disk, up to this much (default: no disk tier)')
+    parser.add_argument('--cache-dir', metavar='PATH', help='Directory of the disk cache (default: ~/.proxy-cli/http-cache)')
+    parser.add_argument('--reload-grace', type=float, metavar='SECONDS', help='Close tunnels still open this long after a profile reload (default: let them finish)')
+    parser.add_argument('--no-watch', dest='watch', action='store_false', help='Reload profiles only on SIGHUP, not when the profile store changes')
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT, metavar='SECONDS', help='On shutdown, stop accepting and give open connections this long to finish (default: close at once)')
+    parser.add_argument('--bind', default=DEFAULT_LISTEN_HOST, metavar='HOST', help=f'Local address to listen on, e.g. 0.0.0.0 or :: for every interface with --allow-remote (default: {DEFAULT_LISTEN_HOST})')
+    parser.add_argument('--allow-remote', action='store_true', help='Allow listening on non-loopback addresses; anyone who can reach them can use the proxy and its upstream credentials')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG, help='Listen backlog: connections the kernel queues during accept bursts')
+
+def rate_arg(text: str) -> int:
+    """Parse a --*-rate value, e.g. 500k or 2m (bytes per second).
+
+    Raises:
+        argparse.ArgumentTypeError: If text is not a rate
+    """
+    from shaping import parse_rate
+    try:
+        return parse_rate(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+def upstream_rate_arg(text: str) -> str:
+    """Check an --upstream-rate value, returning it unchanged so it can be passed on as given.
+
+    Raises:
+        argparse.ArgumentTypeError: If text is malformed
+    """
+    from shaping import parse_upstream_rates
+    try:
+        parse_upstream_rates(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+    return text
+
+def local_proxy_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """Options for start_profile_proxy() from the parsed local proxy flags."""
+    return {
+        'engine': args.engine,
+        'pool_size': args.pool_size,
+        'pool_idle_timeout': args.pool_idle_timeout,
+        'relay_mode': args.relay,
+        'relay_high_water': args.relay_high_water,
+        'relay_low_water': args.relay_low_water,
+        'global_rate': args.global_rate,
+        'listener_rate': args.listener_rate,
+        'client_rate': args.client_rate,
+        'upstream_rate': args.upstream_rate,
+        'connect_rate': args.connect_rate,
+        'policy': args.policy,
+        'cache_memory': args.cache_memory,
+        'cache_disk': args.cache_disk,
+        # Absolute, so a daemon or worker started elsewhere uses the same directory
+        'cache_dir': str(Path(args.cache_dir).expanduser().resolve()) if args.cache_dir else None,
+        'local_host': args.bind,
+        'allow_remote': args.allow_remote,
+        'backlog': args.backlog,
+    }
+
+def parse_listen(spec: str) -> Tuple[Optional[str], int, List[str]]:
+    """Parse a --listen value: [HOST:]PORT[=NAME[,NAME...]], with IPv6 hosts in brackets.
+
+    Returns:
+        (host or None for --bind, port, profile names or [] for the positional names)
+
+    Raises:
+        argparse.ArgumentTypeError: If spec is malformed
+    """
+    address, _, names = spec.partition('=')
+    host: Optional[str] = None
+    port = address
+    if address.startswith('['):
+        host, separator, port = address[1:].partition(']:')
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected [IPV6]:PORT, got '{address}'")
+    elif ':' in address:
+        host, _, port = address.rpartition(':')
+        if ':' in host:
+            raise argparse.ArgumentTypeError(f"put IPv6 addresses in brackets, e.g. [::1]:{port}")
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError(f"invalid port in '{address}'")
+    return host or None, int(port), [name.strip() for name in names.split(',') if name.strip()]
+
+def format_endpoint(host: str, port: int) -> str:
+    """host:port, with IPv6 addresses in brackets."""
+    return f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+def interrupt(signum: int, frame: Any) -> NoReturn:
+    """Signal handler that stops the foreground proxy the way Ctrl+C does."""
+    raise KeyboardInterrupt
+
+def drain_progress(output: str = 'table') -> Callable[[int, float], None]:
+    """Progress callback for stop_all_servers() that reports the connections still open."""
+    def report(remaining: int, seconds_left: float) -> None:
+        if output != 'table':
+            emit({'event': 'draining', 'connections': remaining, 'seconds_left': round(seconds_left, 1)}, output)
+        else:
+            console.print(f"Waiting for {remaining} connection(s) to finish ({seconds_left:.0f}s left)...")
+    return report
+
+def reload_local_proxy(binding: Any, output: str = 'table') -> None:
+    """Re-read the profiles behind the foreground proxy and report a switch."""
+    try:
+        switched = binding.reload()
+    except ValueError as e:
+        if output != 'table':
+            emit({'event': 'reload_failed', 'error': str(e)}, output)
+        else:
+            console.print(f"[yellow]Reload failed, keeping the current profiles: {escape(str(e))}[/yellow]")
+        return
+    if not switched:
+        return
+    if output != 'table':
+        emit({'event': 'reloaded', 'profiles': list(binding.profiles)}, output)
+    else:
+        console.print(f"[green]Profiles reloaded:[/green] {escape(', '.join(binding.profiles))}; open tunnels are kept.")
+
+def show_daemon_status(status: Dict[str, Any]) -> None:
+    """Print the daemon's listeners and their upstreams."""
+    console.print(Panel(
+        f"PID: {status['pid']}\n"
+        f"Uptime: {status['uptime']:.0f}s\n"
+        f"Control socket: {escape(status['socket'])}"
+        + (f"\nMetrics: http://localhost:{status['metrics_port']}/metrics" if status['metrics_port'] else ""),
+        title="Daemon",
+        border_style="blue"
+    ))
+    table = Table(title="Listeners", show_header=True, header_style="bold yellow")
+    table.add_column("Address", style="bold green", no_wrap=True)
+    table.add_column("Front-end", style="cyan")
+    table.add_column("Profiles", style="magenta")
+    table.add_column("Active", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Draining", justify="right")
+    for listener in status['listeners']:
+        table.add_row(
+            f"{listener['host']}:{listener['port']}",
+            listener['frontend'].upper(),
+            escape(', '.join(listener['names'])),
+            str(sum(entry['active'] for entry in listener['upstreams'])),
+            str(sum(entry['total'] for entry in listener['upstreams'])),
+            str(listener['draining'])
+        )
+    console.print(table)
+
+def run_daemon_command(args: argparse.Namespace) -> None:
+    """Carry out `daemon <start|run|stop|status|reload|switch|listen|unlisten>`."""
+    import daemon
+
+    machine = args.output != 'table'
+
+    def fail(message: str) -> NoReturn:
+        if machine:
+            emit_error(message, args.output)
+        console.print(Panel(escape(message), title="Error", border_style="red"))
+        sys.exit(1)
+
+    if not daemon.supported():
+        fail("The daemon needs Unix-domain sockets, which this platform does not provide.")
+
+    if args.daemon_command == 'run':
+        try:
+            daemon.Daemon(local_proxy_options(args), args.socket, args.metrics_port,
+                          args.reload_grace, args.watch, args.drain_timeout).run(args.names, args.port)
+        except KeyboardInterrupt:
+            pass
+        except (OSError, ValueError) as e:
+            fail(f"Daemon failed: {e}")
+        return
+
+    try:
+        if args.daemon_command == 'start':
+            resolve_profiles(args.names, args.output)
+            reply = daemon.start(args.names, args.port, local_proxy_options(args), args.metrics_port, args.socket,
+                                 reload_grace=args.reload_grace, watch=args.watch, drain_timeout=args.drain_timeout)
+            event, message = 'started', f"Daemon started (PID {reply['pid']})."
+        elif args.daemon_command == 'stop':
+            reply = {'pid': daemon.stop(args.socket)}
+            event, message = 'stopped', f"Daemon (PID {reply['pid']}) stopped."
+        elif args.daemon_command == 'status':
+            reply = daemon.request('status', args.socket)
+            event, message = 'status', ''
+        elif args.daemon_command == 'reload':
+            reply = daemon.request('reload', args.socket)
+            event, message = 'reloaded', f"Reloaded the profiles of {len(reply['reloaded'])} listener(s)."
+        elif args.daemon_command == 'switch':
+            reply = daemon.request('switch', args.socket, port=args.port, names=args.names)
+            event, message = 'switched', f"Port {args.port} now forwards to {', '.join(reply['profiles'])}; open tunnels are kept."
+        elif args.daemon_command == 'listen':
+            reply = daemon.request('listen', args.socket, port=args.port, names=args.names)
+            event, message = 'listening', f"Listening on {reply['host']}:{reply['port']} for {', '.join(reply['profiles'])}."
+        else:
+            reply = daemon.request('unlisten', args.socket, port=args.port)
+            event, message = 'unlistened', f"Stopped the listener on port {args.port}."
+    except (FileNotFoundError, ConnectionRefusedError):
+        fail("No daemon is running. Start it with 'daemon start <name>'.")
+    except (OSError, ValueError) as e:
+        fail(str(e))
+
+    reply.pop('ok', None)
+    if machine:
+        emit(dict(reply, event=event), args.output)
+    elif event in ('started', 'status'):
+        if message:
+            console.print(Panel(escape(message), title="Daemon", border_style="green"))
+        show_daemon_status(reply)
+    else:
+        console.print(Panel(escape(message), title="Daemon", border_style="green"))
+
 def set_system_proxy(host, port, username=None, password=None):
+    import platform
+    import subprocess
+
     os_name = platform.system().lower()
     
     if os_name == 'windows':
@@ -471,6 +956,8 @@ def set_system_proxy(host, port, username=None, password=None):
 
 def main():
     parser = argparse.ArgumentParser(description='Proxy Manager CLI')
+    parser.add_argument('--plain', action='store_true', default=os.environ.get(PLAIN_ENV, '') not in ('', '0'),
+                        help=f'Plain text output without colors or boxes (also set by {PLAIN_ENV}=1)')
     subparsers = parser.add_subparsers(dest='command')
 
     add_parser = subparsers.add_parser('add', help='Add a new proxy profile')
@@ -480,22 +967,99 @@ def main():
     add_parser.add_argument('--port', type=int, required=True, help='Proxy server port')
     add_parser.add_argument('--username', type=str, default=None, help='Authentication username (optional)')
     add_parser.add_argument('--password', type=str, default=None, help='Authentication password (optional)')
-
-    subparsers.add_parser('list', help='List all proxy profiles')
+    add_parser.add_argument('--group', type=str, default=None, help='Add the profile to a group usable as @group (optional)')
+    add_parser.add_argument('--tag', action='append', default=None, help='Tag the profile (repeatable, optional)')
+    add_parser.add_argument('--region', type=str, default=None, help='Region label (optional)')
+    add_parser.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format')
+
+    list_parser = subparsers.add_parser('list', help='List all proxy profiles')
+    list_parser.add_argument('--type', choices=['http', 'socks4', 'socks5'], default=None, help='Only profiles of this type')
+    list_parser.add_argument('--tag', type=str, default=None, help='Only profiles with this tag')
+    list_parser.add_argument('--group', type=str, default=None, help='Only profiles in this group')
+    list_parser.add_argument('--region', type=str, default=None, help='Only profiles in this region')
+    list_parser.add_argument('--sort', choices=SORT_ORDERS, default='added', help='Order: as added, by name, or by last probed latency')
+    list_parser.add_argument('--limit', type=int, default=None, help='Show at most this many profiles')
+    list_parser.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format (json/ndjson stream one record per profile)')
+
+    backend_parser = subparsers.add_parser('backend', help='Show or switch the profile storage backend')
+    backend_parser.add_argument('name', nargs='?', choices=BACKENDS, help='Backend to switch to')
+    backend_parser.add_argument('--no-migrate', action='store_true', help='Do not copy existing profiles into the new backend')
 
     del_parser = subparsers.add_parser('delete', help='Delete a proxy profile')
     del_parser.add_argument('name', type=str, help='Name of the proxy profile to delete')
+    del_parser.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format (json/ndjson never ask for confirmation)')
 
     use_parser = subparsers.add_parser('use', help='Activate a proxy profile')
-    use_parser.add_argument('name', type=str, help='Name of the proxy profile to use')
+    use_parser.add_argument('names', nargs='*', metavar='name', help='Proxy profile(s) to use; @group selects every profile in a group')
     use_parser.add_argument('--mode', choices=['system', 'local'], default='local', help='Activation mode')
+    use_parser.add_argument('--listen', type=parse_listen, action='append', default=None, metavar='[HOST:]PORT[=NAME,...]',
+                            help=f'Local listener (repeatable); without =NAME it serves the positional profiles (default: {DEFAULT_LISTEN_HOST}:{DEFAULT_LOCAL_PORT})')
+    add_local_proxy_options(use_parser)
+    use_parser.add_argument('--workers', type=int, default=1, help='Worker processes sharing the local port via SO_REUSEPORT')
+    use_parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this port (worker N uses port + N - 1)')
+    use_parser.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format (json/ndjson print one startup record)')
+
+    probe_parser = subparsers.add_parser('probe', help='Check which profiles are alive and how fast they are')
+    probe_parser.add_argument('names', nargs='*', metavar='name', help='Profile(s) to probe; @group selects every profile in a group')
+    probe_parser.add_argument('--all', action='store_true', help='Probe every saved profile')
+    probe_parser.add_argument('--target', type=str, default=DEFAULT_TARGET, help='URL fetched through each proxy to measure time to first byte')
+    probe_parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds allowed per probe')
+    probe_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Maximum probes running at once')
+    probe_parser.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format (ndjson: one result per line)')
+
+    import_parser = subparsers.add_parser('import', help='Add many proxy profiles from a file')
+    import_parser.add_argument('file', type=str, help="CSV, JSON lines or proxy URL file ('-' for stdin)")
+    import_parser.add_argument('--format', choices=PROFILE_FORMATS, default=None, help='Input format (default: from the file extension, else url)')
+    import_parser.add_argument('--group', type=str, default=None, help='Put every imported profile in this group')
+    import_parser.add_argument('--keep-existing', action='store_true', help='Skip profiles that already exist instead of updating them')
+
+    export_parser = subparsers.add_parser('export', help='Write proxy profiles to a file')
+    export_parser.add_argument('file', type=str, nargs='?', default='-', help="Output file (default: '-' for stdout)")
+    export_parser.add_argument('--format', choices=PROFILE_FORMATS, default=None, help='Output format (default: from the file extension, else url)')
+    export_parser.add_argument('--group', type=str, default=None, help='Only export the profiles of this group')
+
+    daemon_common = argparse.ArgumentParser(add_help=False)
+    daemon_common.add_argument('--socket', type=Path, default=None, help='Control socket (default: ~/.proxy-cli/daemon.sock)')
+    daemon_common.add_argument('--output', choices=OUTPUT_FORMATS, default='table', help='Output format')
+    daemon_parser = subparsers.add_parser('daemon', help='Run the local proxy in the background and control it')
+    daemon_commands = daemon_parser.add_subparsers(dest='daemon_command', required=True)
+    for name, help_text in (('start', 'Start the daemon in the background'),
+                            ('run', 'Run the daemon in the foreground (what start launches; for service managers)')):
+        daemon_start_parser = daemon_commands.add_parser(name, parents=[daemon_common], help=help_text)
+        daemon_start_parser.add_argument('names', nargs='+', metavar='name', help='Proxy profile(s) for the first listener; @group selects a group')
+        daemon_start_parser.add_argument('--port', type=int, default=DEFAULT_LOCAL_PORT, help='Local port of the first listener')
+        add_local_proxy_options(daemon_start_parser)
+        daemon_start_parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this port')
+    daemon_commands.add_parser('stop', parents=[daemon_common], help='Stop the daemon')
+    daemon_commands.add_parser('status', parents=[daemon_common], help='Show the listeners and upstreams of the daemon')
+    daemon_commands.add_parser('reload', parents=[daemon_common], help='Re-read the profiles behind every listener')
+    daemon_switch_parser = daemon_commands.add_parser('switch', parents=[daemon_common], help='Point a listener at other profiles without dropping open tunnels')
+    daemon_switch_parser.add_argument('names', nargs='+', metavar='name', help='Proxy profile(s) to use; @group selects a group')
+    daemon_switch_parser.add_argument('--port', type=int, default=DEFAULT_LOCAL_PORT, help='Port of the listener to switch')
+    daemon_listen_parser = daemon_commands.add_parser('listen', parents=[daemon_common], help='Add a listener')
+    daemon_listen_parser.add_argument('port', type=int, help='Local port to listen on')
+    daemon_listen_parser.add_argument('names', nargs='+', metavar='name', help='Proxy profile(s) to use; @group selects a group')
+    daemon_unlisten_parser = daemon_commands.add_parser('unlisten', parents=[daemon_common], help='Remove a listener')
+    daemon_unlisten_parser.add_argument('port', type=int, help='Port of the listener to remove')
+
+    stats_parser = subparsers.add_parser('stats', help="Show a running local proxy's metrics")
+    stats_parser.add_argument('--metrics-port', type=int, default=DEFAULT_METRICS_PORT, help='Port the instance serves metrics on')
+    stats_parser.add_argument('--host', type=str, default='localhost', help='Host the instance serves metrics on')
+    stats_parser.add_argument('--workers', type=int, default=1, help='Number of workers to read and add up (consecutive ports)')
+    stats_parser.add_argument('--raw', action='store_true', help='Print the exposition text as served')
+    stats_parser.add_argument('--daemon', action='store_true', help='Read the metrics of the background daemon over its control socket')
+    stats_parser.add_argument('--socket', type=Path, default=None, help='Control socket of the daemon (with --daemon)')
 
     args = parser.parse_args()
+    load_ui(args.plain)
     init_config()
 
     if args.command == 'add':
-        add_profile(args.name, args.type, args.host, args.port, args.username, args.password)
-        
+        add_profile(args.name, args.type, args.host, args.port, args.username, args.password, args.group, args.tag, args.region)
+        if args.output != 'table':
+            emit(dict(event='added', **profile_json(args.name, cast(Dict[str, str], get_profile(args.name)))), args.output)
+            return
+
         auth_status = "With Auth" if args.username else "No Auth"
         
         console.print(Panel(
@@ -503,13 +1067,20 @@ def main():
             f"Type: {args.type.upper()}\n"
             f"Host: {args.host}\n"
             f"Port: {args.port}\n"
-            f"Auth: {auth_status}",
+            f"Auth: {auth_status}"
+            + (f"\nGroup: {args.group}" if args.group else "")
+            + (f"\nTags: {', '.join(args.tag)}" if args.tag else "")
+            + (f"\nRegion: {args.region}" if args.region else ""),
             title="New Proxy Profile",
             border_style="green"
         ))
 
     elif args.command == 'list':
-        profiles = list_profiles()
+        profiles = query_profiles(args.type, args.tag, args.group, args.region, args.sort, args.limit)
+        if args.output != 'table':
+            stream_profiles(profiles, args.output)
+            return
+        show_latency = any(data.get('checked_at') for data in profiles.values())
         if profiles:
             console.print(Panel(
                 f"Proxy Profiles ({len(profiles)} total)",
@@ -527,20 +1098,24 @@ def main():
             table.add_column("Host", style="magenta")
             table.add_column("Port", style="blue", justify="center")
             table.add_column("Auth", style="red", justify="center")
+            if show_latency:
+                table.add_column("Latency (ms)", style="cyan", justify="right")
             
-            for p in profiles:
-                profile_data = get_profile(p)
+            for p, profile_data in profiles.items():
                 if profile_data:  # Type assertion for Pylance
                     has_auth = "Yes" if profile_data.get('username') else "No"
                     profile_type = profile_data.get('type', 'N/A').upper()
 
-                    table.add_row(
+                    row = [
                         f"{p}",
                         profile_type,
                         profile_data.get('host', 'N/A'),
                         str(profile_data.get('port', 'N/A')),
                         has_auth
-                    )
+                    ]
+                    if show_latency:
+                        row.append(profile_data.get('latency_ms') or "-")
+                    table.add_row(*row)
             
             console.print(table)
         else:
@@ -552,6 +1127,11 @@ def main():
             ))
 
     elif args.command == 'delete':
+        if args.output != 'table':
+            if not delete_profile(args.name):
+                emit_error(f"Profile '{args.name}' not found", args.output, name=args.name)
+            emit({'event': 'deleted', 'name': args.name}, args.output)
+            return
         profile = get_profile(args.name)
         if profile:
             # For Windows batch files and non-interactive environments, delete without confirmation
@@ -602,19 +1182,34 @@ def main():
             sys.exit(1)
 
     elif args.command == 'use':
-        profile = get_profile(args.name)
-        if not profile:
+        machine = args.output != 'table'
+        specs = args.listen or [(None, DEFAULT_LOCAL_PORT, [])]
+        if not args.names and (args.mode == 'system' or any(not names for _, _, names in specs)):
+            message = "Name the profiles to use, as arguments or per listener (--listen PORT=name)"
+            if machine:
+                emit_error(message, args.output)
+            console.print(Panel(f"{message}.", title="Error", border_style="red"))
+            sys.exit(1)
+        profiles = resolve_profiles(args.names, args.output) if args.names else {}
+
+        if args.mode == 'system' and len(profiles) > 1:
+            if machine:
+                emit_error("System mode can only activate a single profile", args.output)
             console.print(Panel(
-                f"Profile '{args.name}' not found!\n\n"
-                f"Please check the profile name and try again.",
+                "System mode can only activate a single profile.\n\n"
+                "Use local mode to balance across several profiles.",
                 title="Error",
                 border_style="red"
             ))
             sys.exit(1)
 
         if args.mode == 'system':
+            profile = next(iter(profiles.values()))
             try:
                 set_system_proxy(profile['host'], profile['port'], profile.get('username'), profile.get('password'))
+                if machine:
+                    emit(dict(event='system', **profile_json(*next(iter(profiles.items())))), args.output)
+                    return
                 console.print(Panel(
                     f"System proxy set to {profile['host']}:{profile['port']}\n\n"
                     f"Protocol: {profile['type'].upper()}\n"
@@ -624,6 +1219,8 @@ def main():
                     border_style="green"
                 ))
             except Exception as e:
+                if machine:
+                    emit_error(f"Failed to set system proxy: {e}", args.output)
                 console.print(Panel(
                     f"Failed to set system proxy: {str(e)}\n\n"
                     f"You may need administrator privileges to set system proxy.\n"
@@ -632,47 +1229,297 @@ def main():
                     border_style="red"
                 ))
         else:
+            # One (host, port, names, profiles) entry per listener
+            listeners = []
+            for host, port, names in specs:
+                names = names or args.names
+                listeners.append((host or args.bind, port, names,
+                                  resolve_profiles(names, args.output) if names != args.names else profiles))
+            if args.workers > 1 and len(listeners) > 1:
+                message = "Worker processes serve a single listener; drop --workers or use one --listen"
+                if machine:
+                    emit_error(message, args.output)
+                console.print(Panel(f"{message}.", title="Error", border_style="red"))
+                sys.exit(1)
+
+            def upstream_list(profiles: Dict[str, Dict[str, str]]) -> str:
+                return ', '.join(f"{data['host']}:{data['port']} ({data['type'].upper()})" for data in profiles.values())
+
+            endpoints = [format_endpoint(host, port) for host, port, _, _ in listeners]
+            from shaping import RateLimits
+            limits = RateLimits.create(args.global_rate, args.listener_rate, args.client_rate,
+                                       args.upstream_rate, args.connect_rate)
+            if not machine:
+                routes = ''.join(f"Listener {endpoint}: {upstream_list(listener[3])}\n"
+                                 for endpoint, listener in zip(endpoints, listeners))
+                console.print(Panel(
+                    f"Starting local proxy server...\n\n"
+                    + (f"Upstream Proxy: {upstream_list(listeners[0][3])}\n"
+                       f"Local Endpoint: {endpoints[0]}\n" if len(listeners) == 1 else routes) +
+                    (f"Balancing: {args.policy}\n" if any(len(listener[3]) > 1 for listener in listeners) else "") +
+                    f"Engine: {args.engine}\n"
+                    f"Workers: {args.workers}\n"
+                    + (f"Rate Limits: {', '.join(limits.describe())}\n" if limits else "")
+                    + (f"Metrics: http://localhost:{args.metrics_port}/metrics\n" if args.metrics_port else "") +
+                    f"Auth Configured: {'Yes' if any(data.get('username') for listener in listeners for data in listener[3].values()) else 'No'}\n\n"
+                    f"Press Ctrl+C to stop the proxy server",
+                    title="Local Proxy Server",
+                    border_style="blue"
+                ))
+
+            options = local_proxy_options(args)
+            from proxy_server import start_listeners, stop_all_servers
+            from metrics import start_metrics_server
+
+            servers: List[Any] = []
+            supervisor = None
+            metrics_server = None
+            try:
+                if args.workers > 1:
+                    from workers import WorkerSupervisor
+                    host, port, names, profiles = listeners[0]
+                    supervisor = WorkerSupervisor(profiles, port, dict(options, local_host=host), args.workers,
+                                                  args.metrics_port, names, args.reload_grace, args.watch,
+                                                  args.drain_timeout)
+                    supervisor.start()
+                else:
+                    servers = start_listeners([(host, port, profiles) for host, port, _, profiles in listeners], **options)
+                    if args.metrics_port is not None:
+                        metrics_server = start_metrics_server(args.metrics_port)
+
+                if machine:
+                    started = []
+                    for index, (host, port, _, profiles) in enumerate(listeners):
+                        address = servers[index].server_address if servers else (host, port)
+                        started.append({
+                            'host': address[0],
+                            'port': address[1],
+                            'frontend': 'http' if all(data['type'] == 'http' for data in profiles.values()) else 'socks',
+                            'profiles': list(profiles),
+                        })
+                    emit(dict(started[0], **{
+                        'event': 'started',
+                        'pid': os.getpid(),
+                        'worker_pids': supervisor.pids() if supervisor is not None else [],
+                        'engine': args.engine,
+                        'metrics_port': args.metrics_port,
+                        'listeners': started,
+                    }), args.output)
+                else:
+                    console.print(Panel(
+                        f"Local proxy is now running on {', '.join(endpoints)}\n\n"
+                        + (f"Applications can now use this proxy to route traffic through {upstream_list(listeners[0][3])}\n\n"
+                           if len(listeners) == 1 else "") +
+                        f"Configure your applications to use HTTP proxy at {endpoints[0]}",
+                        title="Active",
+                        border_style="green"
+                    ))
+                
+                # Keep the main thread alive to keep the proxy running; SIGTERM stops it like Ctrl+C
+                import signal
+                signal.signal(signal.SIGTERM, interrupt)
+                if supervisor is not None:
+                    if hasattr(signal, 'SIGHUP'):
+                        signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.reload())
+                    supervisor.run()
+                else:
+                    from reloader import WATCH_INTERVAL, ProfileBinding, ReloadTrigger, connection_profiles
+                    bindings = [ProfileBinding(server, names, connection_profiles(names), args.policy, args.reload_grace)
+                                for server, (_, _, names, _) in zip(servers, listeners)]
+                    trigger = ReloadTrigger(args.watch)
+                    trigger.install_signal_handler()
+                    while True:
+                        time.sleep(WATCH_INTERVAL)
+                        if trigger.due():
+                            for binding in bindings:
+                                reload_local_proxy(binding, args.output)
+            except KeyboardInterrupt:
+                if not machine:
+                    console.print(Panel(
+                        "Shutting down proxy server...\n\n"
+                        + (f"Waiting up to {args.drain_timeout:g}s for open connections...\n" if args.drain_timeout else "")
+                        + "Cleaning up resources...",
+                        title="Disconnected",
+                        border_style="yellow"
+                    ))
+                if supervisor is not None:
+                    supervisor.stop()
+                    if machine:
+                        emit({'event': 'stopped'}, args.output)
+                        sys.exit(0)
+                    console.print(f"Stopped {args.workers} worker processes ({supervisor.restarts} restarts).")
+                    sys.exit(0)
+                pools = [server.pool for server in servers if getattr(server, 'pool', None) is not None]
+                cache = next((server.cache for server in servers if getattr(server, 'cache', None) is not None), None)
+                try:
+                    closed = stop_all_servers(args.drain_timeout, drain_progress(args.output))
+                except KeyboardInterrupt:
+                    closed = None  # Interrupted again: exit without waiting
+                if metrics_server is not None:
+                    metrics_server.shutdown()
+                    metrics_server.server_close()
+                if machine:
+                    emit({'event': 'stopped', 'closed': closed}, args.output)
+                    sys.exit(0)
+                console.print(f"Proxy server for '{escape(', '.join(dict.fromkeys(name for listener in listeners for name in listener[3])))}' has been stopped.")
+                if closed:
+                    console.print(f"[yellow]Closed {closed} connection(s) that were still open.[/yellow]")
+                if pools:
+                    stats = [pool.stats() for pool in pools]
+                    console.print(f"Upstream connection pool: {sum(stat['hits'] for stat in stats)} hits, "
+                                  f"{sum(stat['misses'] for stat in stats)} misses")
+                if cache is not None:
+                    stats = cache.stats()
+                    console.print(f"HTTP cache: {stats['hits']} hits, {stats['misses']} misses, "
+                                  f"{stats['revalidated']} revalidated, {stats['coalesced']} coalesced")
+                from resolver import RESOLVER
+                stats = RESOLVER.stats()
+                if stats['misses']:
+                    console.print(f"Upstream DNS cache: {stats['hits']} hits, {stats['misses']} misses")
+                for server, endpoint, listener in zip(servers, endpoints, listeners):
+                    if len(listener[3]) > 1:
+                        if len(listeners) > 1:
+                            console.print(f"Listener {endpoint}:")
+                        show_upstream_stats(server.upstreams.stats())
+                sys.exit(0)
+            except (OSError, ValueError) as e:
+                if machine:
+                    emit_error(f"Failed to start local proxy: {e}", args.output)
+                console.print(Panel(
+                    f"Failed to start local proxy: {str(e)}",
+                    title="Error",
+                    border_style="red"
+                ))
+                sys.exit(1)
+    
+    elif args.command == 'probe':
+        if args.all:
+            profiles = resolve_profiles(list_profiles(), args.output)
+        elif args.names:
+            profiles = resolve_profiles(args.names, args.output)
+        elif args.output != 'table':
+            emit_error("Name the profiles to probe, or pass --all", args.output)
+        else:
+            console.print(Panel(
+                "Name the profiles to probe, or pass --all.",
+                title="Error",
+                border_style="red"
+            ))
+            sys.exit(1)
+
+        from probe import probe_profiles
+
+        try:
+            if args.output == 'table':
+                with console.status(f"Probing {len(profiles)} profiles..."):
+                    results = probe_profiles(profiles, args.target, args.timeout, args.concurrency)
+            else:
+                results = probe_profiles(profiles, args.target, args.timeout, args.concurrency)
+        except ValueError as e:
+            if args.output != 'table':
+                emit_error(str(e), args.output)
+            console.print(Panel(str(e), title="Error", border_style="red"))
+            sys.exit(1)
+        record_health((result['name'], result['ok'], result['total_ms']) for result in results)
+
+        if args.output == 'json':
+            print(json.dumps({'target': args.target, 'results': results}, indent=2))
+        elif args.output == 'ndjson':
+            for result in results:
+                emit(dict(result, target=args.target), args.output)
+        else:
+            show_probe_results(results, args.target)
+        if profiles and not any(result['ok'] for result in results):
+            sys.exit(1)
+
+    elif args.command == 'backend':
+        current = get_backend_name()
+        if args.name is None or args.name == current:
             console.print(Panel(
-                f"Starting local proxy server...\n\n"
-                f"Upstream Proxy: {profile['host']}:{profile['port']} ({profile['type'].upper()})\n"
-                f"Local Endpoint: localhost:8080\n"
-                f"Auth Configured: {'Yes' if profile.get('username') else 'No'}\n\n"
-                f"Press Ctrl+C to stop the proxy server",
-                title="Local Proxy Server",
+                f"Profiles are stored in the '{current}' backend.",
+                title="Storage Backend",
                 border_style="blue"
             ))
-            
+        else:
             try:
-                if profile['type'].startswith('socks'):
-                    server = start_socks_proxy(8080, profile['host'], int(profile['port']), profile.get('username'), profile.get('password'))
-                else:
-                    server = start_http_proxy(8080, profile['host'], int(profile['port']))
-                
+                copied = set_backend(args.name, migrate=not args.no_migrate)
+            except (OSError, ValueError) as e:
+                console.print(Panel(f"Could not switch backend: {escape(str(e))}", title="Error", border_style="red"))
+                sys.exit(1)
+            console.print(Panel(
+                f"Profiles are now stored in the '{args.name}' backend.\n\n"
+                f"Copied {copied} profiles from '{current}'.",
+                title="Storage Backend",
+                border_style="green"
+            ))
+
+    elif args.command == 'import':
+        try:
+            report = import_profiles(args.file, args.format, args.group, not args.keep_existing)
+        except (OSError, UnicodeError) as e:
+            console.print(Panel(f"Import failed: {escape(str(e))}", title="Error", border_style="red"))
+            sys.exit(1)
+        details = "".join(f"\n  {escape(error)}" for error in report.errors)
+        if report.invalid > len(report.errors):
+            details += f"\n  ... and {report.invalid - len(report.errors)} more"
+        console.print(Panel(
+            f"Added: {report.added}\n"
+            f"Updated: {report.updated}\n"
+            f"Skipped: {report.skipped} "
+            f"({report.unchanged} unchanged, {report.duplicates} duplicates, {report.invalid} invalid)"
+            + (f"\n\nInvalid entries:{details}" if details else ""),
+            title="Import",
+            border_style="green" if not report.invalid else "yellow"
+        ))
+
+    elif args.command == 'export':
+        try:
+            count = export_profiles(args.file, args.format, args.group)
+        except OSError as e:
+            console.print(Panel(f"Export failed: {escape(str(e))}", title="Error", border_style="red"))
+            sys.exit(1)
+        if args.file != '-':
+            console.print(Panel(f"Exported {count} profiles to {escape(args.file)}", title="Export", border_style="green"))
+
+    elif args.command == 'stats':
+        from metrics import fetch_metrics, parse_metrics, merge_metrics
+
+        if args.daemon:
+            import daemon
+
+            source = "daemon"
+            try:
+                texts = [daemon.request('metrics', args.socket)['text']]
+            except (OSError, ValueError) as e:
                 console.print(Panel(
-                    f"Local proxy is now running on localhost:8080\n\n"
-                    f"Applications can now use this proxy to route traffic through {profile['host']}:{profile['port']}\n\n"
-                    f"Configure your applications to use HTTP proxy at localhost:8080",
-                    title="Active",
-                    border_style="green"
+                    f"Could not read metrics from the daemon: {escape(str(e))}\n\n"
+                    f"Start it with 'daemon start <name>' first.",
+                    title="Error",
+                    border_style="red"
                 ))
-                
-                # Keep the main thread alive to keep the proxy running
-                import time
-                while True:
-                    time.sleep(1)
-            except KeyboardInterrupt:
+                sys.exit(1)
+        else:
+            ports = [args.metrics_port + index for index in range(max(1, args.workers))]
+            source = f"{args.host}:{ports[0]}" + (f"-{ports[-1]}" if len(ports) > 1 else "")
+            try:
+                texts = [fetch_metrics(port, args.host) for port in ports]
+            except OSError as e:
                 console.print(Panel(
-                    "Shutting down proxy server...\n\n"
-                    f"Cleaning up resources...\n"
-                    f"Proxy server for '{args.name}' has been stopped.",
-                    title="Disconnected",
-                    border_style="yellow"
+                    f"Could not read metrics from {args.host}:{ports[0]}: {e}\n\n"
+                    f"Start the proxy with 'use <name> --metrics-port {args.metrics_port}' first.",
+                    title="Error",
+                    border_style="red"
                 ))
-                from proxy_server import stop_all_servers
-                stop_all_servers()
-                console.print("Proxy servers stopped successfully.")
-                sys.exit(0)
-    
+                sys.exit(1)
+        if args.raw:
+            for text in texts:
+                print(text, end='')
+        else:
+            show_metrics_summary(merge_metrics(parse_metrics(text) for text in texts), source)
+
+    elif args.command == 'daemon':
+        run_daemon_command(args)
+
     # If no command was provided, show interactive menu
     elif not args.command:
         show_interactive_menu()
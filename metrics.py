@@ -0,0 +1,452 @@
+"""
+Proxy Manager CLI - Metrics
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Counters, gauges and histograms for the local proxy servers, rendered in
+the Prometheus text exposition format and served over HTTP with
+--metrics-port. Metrics are updated per connection, never per chunk, so
+they stay off the relay hot path.
+"""
+
+import bisect
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from defaults import DEFAULT_METRICS_PORT
+
+# Label values of one series, in the order of the metric's label names
+LabelValues = Tuple[str, ...]
+
+# Buckets (seconds) for upstream connect latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets (seconds) for tunnel lifetimes
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0, 1800.0, 3600.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class: a named metric family with optional labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float, Sequence[str]]]:
+        """Yield (sample name, label values, value, label names) tuples."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, values, value, names in self.samples():
+            lines.append(f"{name}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing value per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float, Sequence[str]]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield self.name, key, value, self.label_names
+
+
+class Gauge(Counter):
+    """Value that can go up and down per label set."""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Metric):
+    """Cumulative bucketed observations per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (last slot is +Inf), sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float, Sequence[str]]]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._series.items()]
+        names = self.label_names + ('le',)
+        for key, counts, total in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (_format_value(bound),), cumulative, names
+            yield f"{self.name}_sum", key, total, self.label_names
+            yield f"{self.name}_count", key, cumulative, self.label_names
+
+
+class Registry:
+    """A set of metrics plus callbacks that refresh gauges before rendering."""
+
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        # Held from the collectors through rendering: collectors clear and refill gauges,
+        # so overlapping renders would otherwise see each other's half-built series
+        self._render_lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Any:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback: Callable[[], None]) -> None:
+        """Call callback before every render, e.g. to copy pool stats into gauges."""
+        with self._lock:
+            self._collectors.append(callback)
+
+    def remove_collector(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._collectors:
+                self._collectors.remove(callback)
+
+    def render(self) -> str:
+        """Render every metric in the text exposition format."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        with self._render_lock:
+            for callback in collectors:
+                callback()
+            for metric in metrics:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONNECTIONS_ACTIVE = REGISTRY.register(Gauge(
+    'proxy_connections_active', 'Client connections currently open.', ['frontend']))
+CONNECTIONS_TOTAL = REGISTRY.register(Counter(
+    'proxy_connections_total', 'Client connections accepted.', ['frontend']))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    'proxy_requests_total', 'Requests handled, by kind (connect, http, udp).', ['frontend', 'kind']))
+BYTES_TOTAL = REGISTRY.register(Counter(
+    'proxy_bytes_total', 'Payload bytes relayed; in is client to upstream, out is upstream to client.',
+    ['frontend', 'direction']))
+UPSTREAM_CONNECT_SECONDS = REGISTRY.register(Histogram(
+    'proxy_upstream_connect_seconds', 'Time to connect to an upstream proxy (SOCKS: including its handshake).',
+    ['upstream'], LATENCY_BUCKETS))
+TUNNEL_SECONDS = REGISTRY.register(Histogram(
+    'proxy_tunnel_duration_seconds', 'Lifetime of CONNECT tunnels and UDP associations.',
+    ['frontend'], DURATION_BUCKETS))
+ERRORS_TOTAL = REGISTRY.register(Counter(
+    'proxy_errors_total', 'Errors by stage and exception class.', ['stage', 'error']))
+UPSTREAM_ACTIVE = REGISTRY.register(Gauge(
+    'proxy_upstream_active', 'Connections currently using each upstream.', ['listener', 'upstream']))
+UPSTREAM_EJECTED = REGISTRY.register(Gauge(
+    'proxy_upstream_ejected', 'Whether an upstream is currently ejected (1) or not (0).', ['listener', 'upstream']))
+UPSTREAM_LATENCY_SECONDS = REGISTRY.register(Gauge(
+    'proxy_upstream_latency_seconds', 'Moving-average latency of each upstream.', ['listener', 'upstream']))
+POOL_EVENTS = REGISTRY.register(Gauge(
+    'proxy_pool_events', 'Upstream connection pool hits, misses and discards since start.', ['listener', 'event']))
+POOL_IDLE = REGISTRY.register(Gauge(
+    'proxy_pool_idle_connections', 'Idle upstream connections held in the pool.', ['listener']))
+HTTP_CACHE_EVENTS = REGISTRY.register(Gauge(
+    'proxy_http_cache_events', 'HTTP response cache hits, misses, revalidations, coalesced waits and stores '
+    'since start.', ['listener', 'event']))
+HTTP_CACHE_BYTES = REGISTRY.register(Gauge(
+    'proxy_http_cache_bytes', 'Bytes held by each tier of the HTTP response cache.', ['listener', 'tier']))
+DNS_EVENTS = REGISTRY.register(Gauge(
+    'proxy_dns_cache_events', 'Upstream name lookups answered from the cache (hits, negative_hits) '
+    'or resolved (misses, failures) since start.', ['event']))
+DNS_ENTRIES = REGISTRY.register(Gauge(
+    'proxy_dns_cache_entries', 'Upstream names held in the resolver cache.'))
+RATE_LIMIT = REGISTRY.register(Gauge(
+    'proxy_rate_limit_bytes_per_second', 'Configured tunnel bandwidth limit, each way, per listener and scope '
+    '(global, listener, client, upstream).', ['listener', 'scope', 'key']))
+RATE_CURRENT = REGISTRY.register(Gauge(
+    'proxy_rate_bytes_per_second', 'Tunnel bytes per second drawn from each limit over the last second.',
+    ['listener', 'scope', 'key', 'direction']))
+
+
+def record_error(stage: str, error: BaseException) -> None:
+    """Count an error at a named stage (e.g. 'upstream_connect', 'relay')."""
+    ERRORS_TOTAL.inc(stage=stage, error=type(error).__name__)
+
+
+def record_tunnel(frontend: str, duration: float, moved: Tuple[int, int]) -> None:
+    """Record a finished tunnel: its lifetime and (in, out) byte counts."""
+    TUNNEL_SECONDS.observe(duration, frontend=frontend)
+    record_bytes(frontend, *moved)
+
+
+def record_bytes(frontend: str, received: int, sent: int) -> None:
+    """Add bytes relayed client -> upstream (received) and upstream -> client (sent)."""
+    if received:
+        BYTES_TOTAL.inc(received, frontend=frontend, direction='in')
+    if sent:
+        BYTES_TOTAL.inc(sent, frontend=frontend, direction='out')
+
+
+# Watched proxy servers, keyed by id(server)
+_watched: Dict[int, Any] = {}
+
+# Gauges copied from the watched servers, labelled by listener
+_SERVER_GAUGES = (UPSTREAM_ACTIVE, UPSTREAM_EJECTED, UPSTREAM_LATENCY_SECONDS, POOL_EVENTS, POOL_IDLE,
+                  HTTP_CACHE_EVENTS, HTTP_CACHE_BYTES, RATE_LIMIT, RATE_CURRENT)
+
+
+def _collect_servers() -> None:
+    # Rebuilt on every render: servers, upstreams and client buckets come and go
+    for gauge in _SERVER_GAUGES:
+        gauge.clear()
+    for server in list(_watched.values()):
+        host, port = server.server_address[:2]
+        listener = f"{host}:{port}"
+        group = getattr(server, 'upstreams', None)
+        if group is not None:
+            for entry in group.stats():
+                labels = {'listener': listener, 'upstream': entry['name']}
+                UPSTREAM_ACTIVE.set(entry['active'], **labels)
+                UPSTREAM_EJECTED.set(1 if entry['ejected'] else 0, **labels)
+                if entry['latency_ms'] is not None:
+                    UPSTREAM_LATENCY_SECONDS.set(entry['latency_ms'] / 1000, **labels)
+        pool = getattr(server, 'pool', None)
+        if pool is not None:
+            stats = pool.stats()
+            for event in ('hits', 'misses', 'discarded'):
+                POOL_EVENTS.set(stats[event], listener=listener, event=event)
+            POOL_IDLE.set(stats['idle'], listener=listener)
+        cache = getattr(server, 'cache', None)
+        if cache is not None:
+            stats = cache.stats()
+            for event in ('hits', 'misses', 'revalidated', 'coalesced', 'stored'):
+                HTTP_CACHE_EVENTS.set(stats[event], listener=listener, event=event)
+            HTTP_CACHE_BYTES.set(stats['memory_bytes'], listener=listener, tier='memory')
+            HTTP_CACHE_BYTES.set(stats['disk_bytes'], listener=listener, tier='disk')
+        rate_limits = getattr(server, 'rate_limits', None)
+        if rate_limits is not None:
+            for entry in rate_limits.stats():
+                labels = {'listener': listener, 'scope': entry['scope'], 'key': entry['key']}
+                RATE_LIMIT.set(entry['limit'], **labels)
+                RATE_CURRENT.set(entry['in'], direction='in', **labels)
+                RATE_CURRENT.set(entry['out'], direction='out', **labels)
+
+
+REGISTRY.add_collector(_collect_servers)
+
+
+def watch_server(server: Any) -> None:
+    """Export a proxy server's upstream group, pool, cache and rate-limit counters as gauges.
+
+    Every series carries a listener label ("host:port") so several servers in
+    one process do not overwrite each other.
+    """
+    _watched[id(server)] = server
+
+
+def unwatch_server(server: Any) -> None:
+    """Stop exporting a server's gauges (called when it shuts down); its series go with it."""
+    _watched.pop(id(server), None)
+
+
+def watch_resolver(resolver: Any) -> None:
+    """Export a resolver's cache counters as gauges."""
+    def collect() -> None:
+        stats = resolver.stats()
+        for event in ('hits', 'misses', 'negative_hits', 'failures'):
+            DNS_EVENTS.set(stats[event], event=event)
+        DNS_ENTRIES.set(stats['entries'])
+
+    REGISTRY.add_collector(collect)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404, "Not found")
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # Scrapes are not worth a console line each
+
+
+def start_metrics_server(port: int, host: str = 'localhost') -> ThreadingHTTPServer:
+    """Serve REGISTRY on http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def fetch_metrics(port: int, host: str = 'localhost', timeout: float = 5.0) -> str:
+    """Fetch the exposition text from a running instance.
+
+    Raises:
+        OSError: If the instance cannot be reached
+    """
+    import urllib.request  # only the stats command fetches; keeps the import off the proxy's path
+
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=timeout) as response:
+        return response.read().decode('utf-8')
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Parse exposition text into {(sample name, sorted label pairs): value}."""
+    samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        series, _, value = line.rpartition(' ')
+        labels: List[Tuple[str, str]] = []
+        name = series
+        if '{' in series:
+            name, _, rest = series.partition('{')
+            rest = rest.rstrip('}')
+            while rest:
+                key, _, rest = rest.partition('="')
+                chars: List[str] = []
+                index = 0
+                while index < len(rest) and rest[index] != '"':
+                    if rest[index] == '\\' and index + 1 < len(rest):
+                        index += 1
+                        chars.append({'n': '\n'}.get(rest[index], rest[index]))
+                    else:
+                        chars.append(rest[index])
+                    index += 1
+                labels.append((key.lstrip(','), ''.join(chars)))
+                rest = rest[index + 1:]
+        samples[(name, tuple(sorted(labels)))] = float(value)
+    return samples
+
+
+def merge_metrics(parsed: Iterable[Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]]
+                  ) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Sum samples from several worker processes into one view."""
+    merged: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+    for samples in parsed:
+        for key, value in samples.items():
+            merged[key] = merged.get(key, 0.0) + value
+    return merged
+
+
+def sum_samples(samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float], name: str,
+                **match: str) -> float:
+    """Sum every sample called name whose labels include match."""
+    total = 0.0
+    for (sample, labels), value in samples.items():
+        if sample == name and all((key, value_) in labels for key, value_ in match.items()):
+            total += value
+    return total
+
+
+def label_values(samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float], name: str,
+                 label: str) -> List[str]:
+    """Return the distinct values of label across samples called name."""
+    values = {dict(labels).get(label) for sample, labels in samples if sample == name}
+    return sorted(value for value in values if value is not None)
+
+
+def histogram_quantile(samples: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float], name: str,
+                       quantile: float, **match: str) -> Optional[float]:
+    """Estimate a quantile from cumulative buckets (upper bound of the bucket reached)."""
+    buckets: Dict[float, float] = {}
+    for (sample, labels), value in samples.items():
+        if sample != f"{name}_bucket":
+            continue
+        label_map = dict(labels)
+        if any(label_map.get(key) != value_ for key, value_ in match.items()):
+            continue
+        bound = math.inf if label_map['le'] == '+Inf' else float(label_map['le'])
+        buckets[bound] = buckets.get(bound, 0.0) + value
+    if not buckets:
+        return None
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if not total:
+        return None
+    for bound in bounds:
+        if buckets[bound] >= quantile * total:
+            return bound
+    return bounds[-1]
@@ -0,0 +1,125 @@
+"""
+Proxy Manager CLI - Plain Output
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Unstyled stand-ins for the parts of rich the CLI uses: Console, Table,
+Panel, Confirm and escape. They accept the same arguments, drop colors,
+borders and markup, and need nothing beyond the standard library, which
+keeps rich's import cost out of scripted calls. Selected with --plain or
+PROXY_CLI_PLAIN=1.
+"""
+
+import re
+import sys
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, TextIO
+
+# Console markup tags as rich recognises them; '[1]' and the like stay literal
+_MARKUP = re.compile(r'(\\*)\[([a-z#/@][^\[]*?)\]')
+
+
+def escape(text: str) -> str:
+    """Escape text so its brackets are printed rather than read as markup."""
+    return _MARKUP.sub(lambda match: f"{match.group(1) * 2}\\[{match.group(2)}]", text)
+
+
+def strip_markup(text: str) -> str:
+    """Remove markup tags from text and undo escape()."""
+    def replace(match: 're.Match[str]') -> str:
+        backslashes = len(match.group(1))
+        literal = f"[{match.group(2)}]" if backslashes % 2 else ''
+        return '\\' * (backslashes // 2) + literal
+    return _MARKUP.sub(replace, text)
+
+
+def _render(renderable: Any) -> str:
+    if hasattr(renderable, 'render'):
+        return renderable.render()
+    return strip_markup(str(renderable))
+
+
+class Table:
+    """Columns of left or right aligned text, with an optional title and header."""
+
+    def __init__(self, title: Optional[str] = None, show_header: bool = True, **_: Any) -> None:
+        self.title = title
+        self.show_header = show_header
+        self.headers: List[str] = []
+        self.justify: List[str] = []
+        self.rows: List[List[str]] = []
+
+    def add_column(self, header: str = '', justify: str = 'left', **_: Any) -> None:
+        self.headers.append(strip_markup(header))
+        self.justify.append(justify)
+
+    def add_row(self, *cells: Any) -> None:
+        self.rows.append([_render(cell) for cell in cells])
+
+    def render(self) -> str:
+        lines = [self.headers] if self.show_header else []
+        lines.extend(self.rows)
+        widths = [max(len(line[index]) for line in lines if index < len(line)) for index in range(len(self.headers))]
+        output = [strip_markup(self.title).strip()] if self.title and self.title.strip() else []
+        for line in lines:
+            cells = []
+            for index, cell in enumerate(line[:len(widths)]):
+                if self.justify[index] == 'right':
+                    cells.append(cell.rjust(widths[index]))
+                elif self.justify[index] == 'center':
+                    cells.append(cell.center(widths[index]))
+                else:
+                    cells.append(cell.ljust(widths[index]))
+            output.append('  '.join(cells).rstrip())
+        return '\n'.join(output)
+
+
+class Panel:
+    """A block of text under its title."""
+
+    def __init__(self, renderable: Any, title: Optional[str] = None, **_: Any) -> None:
+        self.renderable = renderable
+        self.title = title
+
+    def render(self) -> str:
+        body = _render(self.renderable).strip('\n')
+        if self.title and self.title.strip():
+            return f"{strip_markup(self.title).strip()}:\n{body}"
+        return body
+
+
+class Console:
+    """Prints text and tables without styling."""
+
+    def __init__(self, file: Optional[TextIO] = None) -> None:
+        self.file = file
+
+    def print(self, *objects: Any, sep: str = ' ', end: str = '\n', **_: Any) -> None:
+        print(sep.join(_render(item) for item in objects), end=end, file=self.file or sys.stdout)
+
+    def input(self, prompt: str = '') -> str:
+        return input(strip_markup(prompt))
+
+    def clear(self) -> None:
+        pass
+
+    @contextmanager
+    def status(self, *_: Any, **__: Any) -> Iterator[None]:
+        yield
+
+
+class Confirm:
+    """Yes/no prompt."""
+
+    @classmethod
+    def ask(cls, prompt: str, default: bool = False, **_: Any) -> bool:
+        while True:
+            answer = input(f"{strip_markup(prompt)} [y/n]: ").strip().lower()
+            if not answer:
+                return default
+            if answer in ('y', 'yes'):
+                return True
+            if answer in ('n', 'no'):
+                return False
@@ -0,0 +1,279 @@
+"""
+Proxy Manager CLI - Profile Probe
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Concurrent health and latency checks for saved profiles. Every profile is
+probed on one asyncio event loop: TCP connect to the proxy, the proxy
+handshake (HTTP CONNECT or SOCKS4/5) to the target, then time to first
+byte of a GET request sent through the tunnel.
+"""
+
+import asyncio
+import base64
+import socket
+import ssl
+import struct
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+from defaults import DEFAULT_TARGET, DEFAULT_TIMEOUT, DEFAULT_CONCURRENCY
+from http_parser import HEAD_TERMINATOR, parse_response_head
+from socks_server import (
+    SOCKS4_VERSION,
+    SOCKS5_VERSION,
+    SOCKS4_GRANTED,
+    CMD_CONNECT,
+    ATYP_IPV4,
+    ATYP_IPV6,
+    AUTH_NONE,
+    AUTH_USERPASS,
+    REP_SUCCEEDED,
+    encode_address,
+    decode_address,
+)
+
+# Largest proxy handshake response read while probing
+MAX_RESPONSE_SIZE = 65536
+
+
+class ProbeError(Exception):
+    """A probe step failed; the message says which and why."""
+
+
+class _Stream:
+    """Minimal buffered reader over a non-blocking socket."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket) -> None:
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+
+    async def read_exact(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            data = await self.loop.sock_recv(self.sock, MAX_RESPONSE_SIZE)
+            if not data:
+                raise ProbeError("proxy closed the connection")
+            self.buffer += data
+        result = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return result
+
+    async def read_until(self, separator: bytes) -> bytes:
+        while True:
+            index = self.buffer.find(separator)
+            if index >= 0:
+                end = index + len(separator)
+                result = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return result
+            if len(self.buffer) > MAX_RESPONSE_SIZE:
+                raise ProbeError("proxy response too large")
+            data = await self.loop.sock_recv(self.sock, MAX_RESPONSE_SIZE)
+            if not data:
+                raise ProbeError("proxy closed the connection")
+            self.buffer += data
+
+
+async def _handshake_http(stream: _Stream, profile: Dict[str, str], host: str, port: int) -> None:
+    lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+    if profile.get('username'):
+        credentials = f"{profile['username']}:{profile.get('password') or ''}".encode('utf-8')
+        lines.append(f"Proxy-Authorization: Basic {base64.b64encode(credentials).decode('ascii')}")
+    await stream.loop.sock_sendall(stream.sock, ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    response = parse_response_head(await stream.read_until(HEAD_TERMINATOR))
+    if not 200 <= response.status < 300:
+        raise ProbeError(f"CONNECT refused: {response.status} {response.reason}".rstrip())
+
+
+async def _handshake_socks5(stream: _Stream, profile: Dict[str, str], host: str, port: int) -> None:
+    loop, sock = stream.loop, stream.sock
+    username = (profile.get('username') or '').encode('utf-8')
+    password = (profile.get('password') or '').encode('utf-8')
+    methods = bytes([AUTH_NONE, AUTH_USERPASS]) if username else bytes([AUTH_NONE])
+    await loop.sock_sendall(sock, bytes([SOCKS5_VERSION, len(methods)]) + methods)
+    version, method = await stream.read_exact(2)
+    if version != SOCKS5_VERSION or method not in methods:
+        raise ProbeError("SOCKS5 authentication method rejected")
+    if method == AUTH_USERPASS:
+        await loop.sock_sendall(sock, bytes([1, len(username)]) + username + bytes([len(password)]) + password)
+        _, status = await stream.read_exact(2)
+        if status != 0:
+            raise ProbeError("SOCKS5 authentication failed")
+
+    await loop.sock_sendall(sock, bytes([SOCKS5_VERSION, CMD_CONNECT, 0]) + encode_address(host, port))
+    _, reply, _, atyp = await stream.read_exact(4)
+    if reply != REP_SUCCEEDED:
+        raise ProbeError(f"SOCKS5 CONNECT failed with reply 0x{reply:02x}")
+    # Consume the bound address so the tunnel starts clean
+    if atyp == ATYP_IPV4:
+        await stream.read_exact(6)
+    elif atyp == ATYP_IPV6:
+        await stream.read_exact(18)
+    else:
+        length = await stream.read_exact(1)
+        decode_address(bytes([atyp]) + length + await stream.read_exact(length[0] + 2))
+
+
+async def _handshake_socks4(stream: _Stream, profile: Dict[str, str], host: str, port: int) -> None:
+    user = (profile.get('username') or '').encode('utf-8') + b'\x00'
+    try:
+        address = socket.inet_aton(host)
+        suffix = b''
+    except OSError:
+        # SOCKS4a: invalid address 0.0.0.1 followed by the host name
+        address = b'\x00\x00\x00\x01'
+        suffix = host.encode('idna') + b'\x00'
+    request = struct.pack('!BBH', SOCKS4_VERSION, CMD_CONNECT, port) + address + user + suffix
+    await stream.loop.sock_sendall(stream.sock, request)
+    reply = await stream.read_exact(8)
+    if reply[1] != SOCKS4_GRANTED:
+        raise ProbeError(f"SOCKS4 CONNECT rejected (0x{reply[1]:02x})")
+
+
+HANDSHAKES = {
+    'http': _handshake_http,
+    'socks4': _handshake_socks4,
+    'socks5': _handshake_socks5,
+}
+
+
+def _parse_target(target: str) -> Tuple[str, str, int, str]:
+    """Split a target URL into (scheme, host, port, path)."""
+    parts = urllib.parse.urlsplit(target)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"Probe target must be an http:// or https:// URL: {target}")
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts.scheme, parts.hostname, port, path
+
+
+async def _connect(loop: asyncio.AbstractEventLoop, host: str, port: int) -> socket.socket:
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    error: Optional[OSError] = None
+    for family, type_, proto, _, address in infos:
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+        except BaseException:
+            sock.close()
+            raise
+    raise error or OSError(f"Could not resolve {host}")
+
+
+async def _probe_steps(profile: Dict[str, str], target: str, result: Dict[str, Any]) -> None:
+    loop = asyncio.get_running_loop()
+    scheme, host, port, path = _parse_target(target)
+    handshake = HANDSHAKES.get(profile.get('type', ''))
+    if handshake is None:
+        raise ProbeError(f"unsupported proxy type {profile.get('type')!r}")
+
+    result['step'] = 'connect'
+    started = time.perf_counter()
+    sock = await _connect(loop, profile['host'], int(profile['port']))
+    writer: Optional[asyncio.StreamWriter] = None
+    try:
+        result['connect_ms'] = (time.perf_counter() - started) * 1000
+
+        result['step'] = 'handshake'
+        started = time.perf_counter()
+        stream = _Stream(loop, sock)
+        await handshake(stream, profile, host, port)
+        result['handshake_ms'] = (time.perf_counter() - started) * 1000
+
+        result['step'] = 'first byte'
+        started = time.perf_counter()
+        context = ssl.create_default_context() if scheme == 'https' else None
+        reader, writer = await asyncio.open_connection(
+            sock=sock, ssl=context, server_hostname=host if context else None)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n"
+                     f"User-Agent: proxy-cli-probe\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+        if not await reader.read(1):
+            raise ProbeError("target closed the connection without a response")
+        result['ttfb_ms'] = (time.perf_counter() - started) * 1000
+    finally:
+        if writer is not None:
+            writer.close()
+        else:
+            sock.close()
+
+
+async def probe_profile(name: str, profile: Dict[str, str], target: str = DEFAULT_TARGET,
+                        timeout: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Probe one profile.
+
+    Args:
+        name: Profile name
+        profile: Profile record as returned by config_manager.get_profile()
+        target: URL fetched through the proxy for the time-to-first-byte step
+        timeout: Seconds allowed for the whole probe
+
+    Returns:
+        Result dict with ok, error, connect_ms, handshake_ms, ttfb_ms and total_ms
+    """
+    result: Dict[str, Any] = {
+        'name': name,
+        'type': profile.get('type', ''),
+        'address': f"{profile.get('host')}:{profile.get('port')}",
+        'ok': False,
+        'error': None,
+        'step': None,
+        'connect_ms': None,
+        'handshake_ms': None,
+        'ttfb_ms': None,
+        'total_ms': None,
+    }
+    try:
+        await asyncio.wait_for(_probe_steps(profile, target, result), timeout)
+        result['ok'] = True
+        result['total_ms'] = result['connect_ms'] + result['handshake_ms'] + result['ttfb_ms']
+    except asyncio.TimeoutError:
+        result['error'] = f"{result['step']} timed out after {timeout:g}s"
+    except (OSError, ProbeError, ValueError, ssl.SSLError) as e:
+        result['error'] = f"{result['step']}: {e}" if result['step'] else str(e)
+    for key in ('connect_ms', 'handshake_ms', 'ttfb_ms', 'total_ms'):
+        if result[key] is not None:
+            result[key] = round(result[key], 1)
+    del result['step']
+    return result
+
+
+async def probe_profiles_async(profiles: Dict[str, Dict[str, str]], target: str = DEFAULT_TARGET,
+                               timeout: float = DEFAULT_TIMEOUT,
+                               concurrency: int = DEFAULT_CONCURRENCY) -> List[Dict[str, Any]]:
+    """Probe many profiles at once, at most concurrency at a time."""
+    _parse_target(target)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _limited(name: str, profile: Dict[str, str]) -> Dict[str, Any]:
+        async with semaphore:
+            return await probe_profile(name, profile, target, timeout)
+
+    results = await asyncio.gather(*(_limited(name, profile) for name, profile in profiles.items()))
+    return sort_results(list(results))
+
+
+def probe_profiles(profiles: Dict[str, Dict[str, str]], target: str = DEFAULT_TARGET,
+                   timeout: float = DEFAULT_TIMEOUT, concurrency: int = DEFAULT_CONCURRENCY) -> List[Dict[str, Any]]:
+    """Blocking wrapper around probe_profiles_async().
+
+    Raises:
+        ValueError: If target is not an http(s) URL
+    """
+    return asyncio.run(probe_profiles_async(profiles, target, timeout, concurrency))
+
+
+def sort_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Order results fastest first, failed probes last."""
+    return sorted(results, key=lambda result: (not result['ok'], result['total_ms'] or 0.0, result['name']))
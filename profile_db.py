@@ -0,0 +1,244 @@
+"""
+Proxy Manager CLI - SQLite Profile Backend
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+SQLite storage for large proxy inventories. Profiles are indexed by name,
+type, group, region, tag and last measured latency, so filtered and sorted
+listings and single lookups stay fast with tens of thousands of rows. Probe
+results are kept as a health history. The database runs in WAL mode with a
+busy timeout, so concurrent CLI invocations (and a running local proxy) can
+read while another process writes.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config_manager import HEALTH_FIELDS, split_tags
+
+# Milliseconds a writer waits for another process's lock before failing
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    username TEXT NOT NULL DEFAULT '',
+    password TEXT NOT NULL DEFAULT '',
+    grp TEXT NOT NULL DEFAULT '',
+    region TEXT NOT NULL DEFAULT '',
+    latency_ms REAL,
+    checked_at REAL
+);
+CREATE INDEX IF NOT EXISTS profiles_type ON profiles (type);
+CREATE INDEX IF NOT EXISTS profiles_grp ON profiles (grp);
+CREATE INDEX IF NOT EXISTS profiles_region ON profiles (region);
+-- Matches the 'latency' order: measured profiles first, fastest first
+CREATE INDEX IF NOT EXISTS profiles_latency ON profiles (latency_ms IS NULL, latency_ms);
+
+CREATE TABLE IF NOT EXISTS profile_tags (
+    tag TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES profiles (name) ON DELETE CASCADE,
+    PRIMARY KEY (tag, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS profile_tags_name ON profile_tags (name);
+
+CREATE TABLE IF NOT EXISTS health (
+    name TEXT NOT NULL REFERENCES profiles (name) ON DELETE CASCADE,
+    checked_at REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    latency_ms REAL
+);
+CREATE INDEX IF NOT EXISTS health_name ON health (name, checked_at);
+"""
+
+_SELECT = """
+SELECT p.name, p.type, p.host, p.port, p.username, p.password, p.grp, p.region, p.latency_ms, p.checked_at,
+       (SELECT group_concat(t.tag, ',') FROM profile_tags t WHERE t.name = p.name) AS tags
+FROM profiles p
+"""
+
+_ORDER = {
+    'added': 'p.rowid',
+    'name': 'p.name',
+    'latency': 'p.latency_ms IS NULL, p.latency_ms, p.rowid',
+}
+
+
+def _record(row: sqlite3.Row) -> Dict[str, str]:
+    record = {
+        'type': row['type'],
+        'host': row['host'],
+        'port': str(row['port']),
+        'username': row['username'],
+        'password': row['password'],
+        'group': row['grp'],
+        'tags': ','.join(sorted(split_tags(row['tags'] or ''))),
+        'region': row['region'],
+    }
+    if row['checked_at'] is not None:
+        record['latency_ms'] = '' if row['latency_ms'] is None else f"{row['latency_ms']:.1f}"
+        record['checked_at'] = f"{row['checked_at']:.0f}"
+    return record
+
+
+class SqliteProfileStore:
+    """Profile store backed by a SQLite database, same interface as config_manager.ProfileStore.
+
+    Args:
+        path: Database file, created if missing
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        with self._transaction():
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    self._db.execute(statement)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run a write transaction, taking the database write lock up front."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _fetch(self, where: str = '', params: Tuple[Any, ...] = (), order: str = 'p.rowid',
+               limit: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        sql = f"{_SELECT} {where} ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return {row['name']: _record(row) for row in rows}
+
+    def _upsert(self, name: str, record: Dict[str, str]) -> None:
+        self._db.execute(
+            "INSERT INTO profiles (name, type, host, port, username, password, grp, region) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET type = excluded.type, host = excluded.host, port = excluded.port, "
+            "username = excluded.username, password = excluded.password, grp = excluded.grp, region = excluded.region",
+            (name, record['type'], record['host'], int(record['port']), record.get('username', ''),
+             record.get('password', ''), record.get('group', ''), record.get('region', '')))
+        self._db.execute("DELETE FROM profile_tags WHERE name = ?", (name,))
+        self._db.executemany("INSERT INTO profile_tags (tag, name) VALUES (?, ?)",
+                             [(tag, name) for tag in split_tags(record.get('tags', ''))])
+
+    def names(self) -> List[str]:
+        """Profile names in insertion order."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT name FROM profiles ORDER BY rowid")]
+
+    def get(self, name: str) -> Optional[Dict[str, str]]:
+        """One profile record, or None."""
+        return self._fetch("WHERE p.name = ?", (name,)).get(name)
+
+    def all(self) -> Dict[str, Dict[str, str]]:
+        """Every profile record keyed by name, in insertion order."""
+        return self._fetch()
+
+    def group(self, group: str) -> List[str]:
+        """Names of the profiles whose group is group."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT name FROM profiles WHERE grp = ? ORDER BY rowid", (group,))]
+
+    def query(self, proxy_type: Optional[str] = None, tag: Optional[str] = None, group: Optional[str] = None,
+              region: Optional[str] = None, sort: str = 'added', limit: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        """Profiles matching every given filter, in the requested order."""
+        clauses: List[str] = []
+        params: List[Any] = []
+        for column, value in (('p.type', proxy_type), ('p.grp', group), ('p.region', region)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if tag is not None:
+            clauses.append("p.name IN (SELECT name FROM profile_tags WHERE tag = ?)")
+            params.append(tag)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self._fetch(where, tuple(params), _ORDER[sort], limit)
+
+    def put(self, name: str, record: Dict[str, str]) -> None:
+        """Add or replace a profile, keeping its health data."""
+        with self._transaction():
+            self._upsert(name, record)
+
+    def put_many(self, records: Iterable[Tuple[str, Dict[str, str]]], overwrite: bool = True) -> Tuple[int, int, int]:
+        """Add or replace many profiles in one transaction.
+
+        Returns:
+            Counts of (added, updated, unchanged) profiles
+        """
+        added = updated = unchanged = 0
+        with self._transaction():
+            for name, record in records:
+                row = self._db.execute(f"{_SELECT} WHERE p.name = ?", (name,)).fetchone()
+                if row is None:
+                    added += 1
+                else:
+                    current = _record(row)
+                    for field in HEALTH_FIELDS:
+                        current.pop(field, None)
+                    if not overwrite or current == {field: record.get(field, '') for field in current}:
+                        unchanged += 1
+                        continue
+                    updated += 1
+                self._upsert(name, record)
+        return added, updated, unchanged
+
+    def record_health(self, results: Iterable[Tuple[str, bool, Optional[float]]]) -> None:
+        """Append probe outcomes to the health history and update each profile's latest latency."""
+        checked_at = time.time()
+        with self._transaction():
+            for name, ok, latency_ms in results:
+                latency = latency_ms if ok else None
+                cursor = self._db.execute("UPDATE profiles SET latency_ms = ?, checked_at = ? WHERE name = ?",
+                                          (latency, checked_at, name))
+                if cursor.rowcount:
+                    self._db.execute("INSERT INTO health (name, checked_at, ok, latency_ms) VALUES (?, ?, ?, ?)",
+                                     (name, checked_at, int(ok), latency))
+
+    def history(self, name: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent probe outcomes of a profile, newest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT checked_at, ok, latency_ms FROM health WHERE name = ? ORDER BY checked_at DESC LIMIT ?",
+                (name, limit)).fetchall()
+        return [{'checked_at': row['checked_at'], 'ok': bool(row['ok']), 'latency_ms': row['latency_ms']}
+                for row in rows]
+
+    def delete(self, name: str) -> bool:
+        """Remove a profile; returns whether it existed."""
+        with self._transaction():
+            return self._db.execute("DELETE FROM profiles WHERE name = ?", (name,)).rowcount > 0
+
+    def version(self) -> Tuple[int, int]:
+        """A value that changes whenever the database is written, by any process."""
+        with self._lock:
+            # data_version only moves for commits made by other connections
+            other = self._db.execute("PRAGMA data_version").fetchone()[0]
+            return (other, self._db.total_changes)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,205 @@
+"""
+Proxy Manager CLI - Upstream Proxy Authentication
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Proxy-Authorization for HTTP upstream proxies: Basic (RFC 7617) and Digest
+(RFC 7616). Every HTTP upstream with credentials gets one ProxyAuth, shared
+by all connections to it. The Basic header is built once and sent with the
+first request, so a Basic upstream never answers 407. When an upstream
+challenges for Digest instead, its nonce is kept and reused, with a rising
+nonce count, until the upstream marks it stale; only the first connection
+after that pays the extra 407 round trip.
+"""
+
+import base64
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from http_parser import ResponseHead
+
+# Status of an upstream asking for (other) credentials
+AUTH_REQUIRED = 407
+
+# Digest algorithms, most preferred first, with their hash functions
+DIGEST_ALGORITHMS: Dict[str, Callable[..., Any]] = {
+    'SHA-256': hashlib.sha256,
+    'SHA-256-SESS': hashlib.sha256,
+    'MD5': hashlib.md5,
+    'MD5-SESS': hashlib.md5,
+}
+
+# One challenge item: name=value or name="quoted value", or a bare scheme token
+_CHALLENGE_ITEM = re.compile(r'([^\s,=]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^\s,]*)|([^\s,=]+)')
+
+
+class ProxyAuthError(Exception):
+    """An upstream proxy rejected the profile's credentials, or asked for credentials the profile lacks."""
+
+
+def parse_challenges(values: List[str]) -> List[Tuple[str, Dict[str, str]]]:
+    """Parse Proxy-Authenticate header values.
+
+    Returns:
+        (lower-cased scheme, parameters with lower-cased names) per challenge
+    """
+    challenges: List[Tuple[str, Dict[str, str]]] = []
+    for value in values:
+        for match in _CHALLENGE_ITEM.finditer(value):
+            name, param, scheme = match.groups()
+            if scheme is not None:
+                challenges.append((scheme.lower(), {}))
+            elif challenges:
+                if param.startswith('"'):
+                    param = re.sub(r'\\(.)', r'\1', param[1:-1])
+                challenges[-1][1][name.lower()] = param
+    return challenges
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class _Digest:
+    """A Digest challenge being answered: its nonce, the nonce count so far and the cached HA1."""
+
+    __slots__ = ('realm', 'nonce', 'opaque', 'algorithm', 'qop', 'cnonce', 'count', 'ha1', 'hash')
+
+    def __init__(self, params: Dict[str, str], username: str, password: str) -> None:
+        self.realm = params.get('realm', '')
+        self.nonce = params.get('nonce', '')
+        self.opaque = params.get('opaque')
+        self.algorithm = params.get('algorithm', 'MD5').upper()
+        qops = {qop.strip().lower() for qop in params.get('qop', '').split(',')}
+        self.qop = 'auth' if 'auth' in qops else None
+        self.cnonce = os.urandom(8).hex()
+        self.count = 0
+        self.hash = DIGEST_ALGORITHMS[self.algorithm]
+        ha1 = self.digest(f"{username}:{self.realm}:{password}")
+        if self.algorithm.endswith('-SESS'):
+            ha1 = self.digest(f"{ha1}:{self.nonce}:{self.cnonce}")
+        self.ha1 = ha1
+
+    def digest(self, text: str) -> str:
+        return self.hash(text.encode('utf-8')).hexdigest()
+
+
+class ProxyAuth:
+    """Credentials for one HTTP upstream proxy and what it last asked for.
+
+    Thread-safe: both engines call it from many connections at once.
+
+    Args:
+        username: Upstream proxy username
+        password: Upstream proxy password (may be empty)
+    """
+
+    def __init__(self, username: str, password: Optional[str] = None) -> None:
+        self.username = username
+        self.password = password or ''
+        self.basic = 'Basic ' + base64.b64encode(f"{username}:{self.password}".encode('utf-8')).decode('ascii')
+        self.challenges = 0
+        self._digest: Optional[_Digest] = None
+        self._lock = threading.Lock()
+
+    def header(self, method: str, uri: str) -> str:
+        """Proxy-Authorization value for a request.
+
+        Args:
+            method: Request method, e.g. 'CONNECT'
+            uri: Request target as sent to the upstream (host:port for CONNECT)
+        """
+        with self._lock:
+            digest = self._digest
+            if digest is None:
+                return self.basic
+            digest.count += 1
+            count = digest.count
+        ha2 = digest.digest(f"{method}:{uri}")
+        fields = [
+            f"username={_quote(self.username)}",
+            f"realm={_quote(digest.realm)}",
+            f"nonce={_quote(digest.nonce)}",
+            f"uri={_quote(uri)}",
+            f"algorithm={digest.algorithm}",
+        ]
+        if digest.qop is not None:
+            nc = f"{count:08x}"
+            response = digest.digest(f"{digest.ha1}:{digest.nonce}:{nc}:{digest.cnonce}:{digest.qop}:{ha2}")
+            fields += [f"qop={digest.qop}", f"nc={nc}", f"cnonce={_quote(digest.cnonce)}"]
+        else:
+            response = digest.digest(f"{digest.ha1}:{digest.nonce}:{ha2}")
+        fields.append(f"response={_quote(response)}")
+        if digest.opaque is not None:
+            fields.append(f"opaque={_quote(digest.opaque)}")
+        return 'Digest ' + ', '.join(fields)
+
+    def challenge(self, response: ResponseHead, sent: str) -> None:
+        """Learn from a 407 answer to a request that carried sent, so header() answers the challenge.
+
+        Raises:
+            ProxyAuthError: If the upstream rejected credentials it had asked for,
+                or offers no scheme this module speaks
+        """
+        challenges = parse_challenges(response.get_all('proxy-authenticate'))
+        digests = [params for scheme, params in challenges
+                   if scheme == 'digest' and params.get('algorithm', 'MD5').upper() in DIGEST_ALGORITHMS]
+        digests.sort(key=lambda params: list(DIGEST_ALGORITHMS).index(params.get('algorithm', 'MD5').upper()))
+        with self._lock:
+            self.challenges += 1
+            if digests:
+                params = digests[0]
+                stale = params.get('stale', '').lower() == 'true'
+                if sent.startswith('Digest ') and f"nonce={_quote(params.get('nonce', ''))}" in sent and not stale:
+                    raise ProxyAuthError("Upstream proxy rejected the Digest credentials")
+                self._digest = _Digest(params, self.username, self.password)
+            elif any(scheme == 'basic' for scheme, _ in challenges):
+                if sent == self.basic:
+                    raise ProxyAuthError("Upstream proxy rejected the Basic credentials")
+                self._digest = None
+            else:
+                schemes = ', '.join(scheme for scheme, _ in challenges) or 'none'
+                raise ProxyAuthError(f"Upstream proxy asks for unsupported authentication ({schemes})")
+
+
+def answer_challenge(auth: Optional[ProxyAuth], response: ResponseHead, sent: Optional[str], retried: bool) -> None:
+    """Handle a 407 from an upstream so a retry carries the credentials it asked for.
+
+    Args:
+        auth: The upstream's credentials, None if its profile has none
+        response: The 407 response head
+        sent: Proxy-Authorization value of the refused request
+        retried: Whether this request was already retried after a 407 from this upstream
+
+    Raises:
+        ProxyAuthError: If retrying cannot help
+    """
+    if auth is None:
+        raise ProxyAuthError("Upstream proxy requires authentication, but the profile has no credentials")
+    if retried:
+        raise ProxyAuthError("Upstream proxy rejected the credentials")
+    auth.challenge(response, sent or '')
+
+
+def authorize(headers: List[Tuple[str, str]], auth: Optional[ProxyAuth],
+              method: str, uri: str) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+    """Add the upstream's Proxy-Authorization to request headers.
+
+    Without auth the headers pass unchanged, so a client's own
+    Proxy-Authorization still reaches an upstream the profile has no
+    credentials for.
+
+    Returns:
+        (headers, the Proxy-Authorization value added or None)
+    """
+    if auth is None:
+        return headers, None
+    value = auth.header(method, uri)
+    headers = [(name, field) for name, field in headers if name.lower() != 'proxy-authorization']
+    headers.append(('Proxy-Authorization', value))
+    return headers, value
@@ -8,129 +8,564 @@ Powered By: REZ LAB
 Implements local proxy server functionality that forwards to upstream proxy.
 """
 
+import selectors
 import socket
+import socketserver
 import threading
+import time
 import urllib.parse
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import List, Optional, Tuple, Any, cast
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Any, cast
 import socks
-import select
+
+from connections import STATE_ACTIVE, STATE_IDLE, ConnectionTracker, ProgressCallback
+from http_cache import (
+    CACHE_BYPASS,
+    CACHE_HIT,
+    CACHE_REVALIDATE,
+    CACHE_UNAVAILABLE,
+    COALESCE_TIMEOUT,
+    BodyCollector,
+    CacheEntry,
+    HTTPCache,
+    Lookup,
+    create_cache,
+)
+from http_parser import (
+    MAX_HEADER_SIZE,
+    BODY_NONE,
+    BODY_LENGTH,
+    BODY_CHUNKED,
+    BODY_UNTIL_CLOSE,
+    BadRequestBody,
+    RequestHead,
+    ResponseHead,
+    ResponseHeadParser,
+    parse_response_head,
+    build_head,
+    refusal_head,
+    request_framing,
+    response_framing,
+    parse_chunk_size,
+    check_chunk_end,
+)
+from metrics import (
+    CONNECTIONS_ACTIVE,
+    CONNECTIONS_TOTAL,
+    ERRORS_TOTAL,
+    REQUESTS_TOTAL,
+    TUNNEL_SECONDS,
+    UPSTREAM_CONNECT_SECONDS,
+    record_bytes,
+    record_error,
+    record_tunnel,
+    unwatch_server,
+    watch_server,
+)
+from proxy_auth import AUTH_REQUIRED, ProxyAuthError, answer_challenge, authorize
+from relay import DEFAULT_RELAY_MODE, DEFAULT_WATERMARKS, Shaping, Watermarks, resolve_mode, relay_blocking
+from resolver import connect, is_loopback, listen_address
+from shaping import RateLimits
+from socks_server import (
+    CMD_CONNECT,
+    CMD_UDP_ASSOCIATE,
+    SOCKS5_VERSION,
+    REP_SUCCEEDED,
+    REP_COMMAND_NOT_SUPPORTED,
+    REP_NOT_ALLOWED,
+    HANDSHAKE_TIMEOUT,
+    PROXY_TYPES,
+    BlockingReader,
+    SocksError,
+    associate_group,
+    connect_group,
+    negotiate_blocking,
+    reply_code_for,
+)
+from upstream_pool import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_IDLE_TIMEOUT,
+    ConnectionPool,
+    UpstreamConnection,
+)
+from upstreams import DEFAULT_POLICY, Upstream, UpstreamGroup
+from defaults import (
+    ENGINES,
+    DEFAULT_ENGINE,
+    DEFAULT_DRAIN_TIMEOUT,
+    DEFAULT_BACKLOG,
+    DEFAULT_LISTEN_HOST,
+    DEFAULT_RELAY_HIGH_WATER,
+    DEFAULT_RELAY_LOW_WATER,
+)
+
+# Seconds a server waits for its handlers to exit after closing their connections
+CLOSE_TIMEOUT = 5.0
+
+# Size of a single socket read when streaming bodies
+BUFFER_SIZE = 65536
+
+def _read_head(rfile: Any) -> bytes:
+    """Read a raw header block, line by line, from a binary file object."""
+    lines = []
+    size = 0
+    while True:
+        line = rfile.readline(MAX_HEADER_SIZE + 1)
+        if not line:
+            raise ConnectionError("Connection closed before end of headers")
+        size += len(line)
+        if size > MAX_HEADER_SIZE:
+            raise ValueError("Header block too large")
+        lines.append(line)
+        if line in (b"\r\n", b"\n"):
+            return b"".join(lines)
+
+def _copy_exact(rfile: Any, write: Callable[[bytes], Any], remaining: int) -> int:
+    total = remaining
+    while remaining > 0:
+        data = rfile.read(min(remaining, BUFFER_SIZE))
+        if not data:
+            raise ConnectionError("Connection closed mid-body")
+        write(data)
+        remaining -= len(data)
+    return total
+
+def _copy_body(rfile: Any, write: Callable[[bytes], Any], framing: str, length: int = 0) -> int:
+    """Stream a message body from rfile to write() without buffering it.
+
+    Args:
+        rfile: Binary file object positioned at the start of the body
+        write: Callable that sends bytes to the other side
+        framing: One of the http_parser BODY_* framing kinds
+        length: Body length for BODY_LENGTH framing
+
+    Returns:
+        Bytes written, including chunk framing
+    """
+    copied = 0
+    if framing == BODY_LENGTH:
+        copied = _copy_exact(rfile, write, length)
+    elif framing == BODY_CHUNKED:
+        end = b""  # CRLF after the previous chunk's data, sent along with the next size line
+        while True:
+            line = rfile.readline(MAX_HEADER_SIZE + 1)
+            size = parse_chunk_size(line)
+            write(end + line)
+            copied += len(end) + len(line)
+            if size == 0:
+                # Last chunk: forward the trailer section up to the blank line
+                while line != b"\r\n":
+                    line = rfile.readline(MAX_HEADER_SIZE + 1)
+                    if not line:
+                        raise ConnectionError("Connection closed mid-body")
+                    write(line)
+                    copied += len(line)
+                break
+            copied += _copy_exact(rfile, write, size)
+            end = rfile.read(2)
+            check_chunk_end(end)
+    elif framing == BODY_UNTIL_CLOSE:
+        while True:
+            data = rfile.read1(BUFFER_SIZE)
+            if not data:
+                break
+            write(data)
+            copied += len(data)
+    return copied
+
+class DrainableServerMixIn:
+    """socketserver mix-in for graceful shutdown.
+
+    Handlers register their connections in ``connections``. serve_forever()
+    is replaced by a loop that stop_accepting() wakes at once, instead of
+    after the next poll interval, and shutdown() closes the connections
+    still open rather than abandoning their handler threads.
+    """
+
+    socket: socket.socket
+
+    def server_activate(self) -> None:
+        super().server_activate()  # type: ignore[misc]
+        self.connections = ConnectionTracker()
+        self._accepting = True
+        self._stopped = threading.Event()
+        self._wakeup = socket.socketpair()
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.socket, selectors.EVENT_READ)
+                selector.register(self._wakeup[0], selectors.EVENT_READ)
+                while self._accepting:
+                    for key, _ in selector.select():
+                        if key.fileobj is self.socket and self._accepting:
+                            self._handle_request_noblock()  # type: ignore[attr-defined]
+        finally:
+            self._stopped.set()
+
+    def stop_accepting(self) -> None:
+        """Stop the accept loop and close the listening socket; open connections carry on."""
+        if self._accepting:
+            self._accepting = False
+            self._wakeup[1].send(b"\0")
+        self._stopped.wait()
+        self.socket.close()
+
+    def shutdown(self) -> None:
+        """Stop accepting and close every open connection, waiting briefly for the handlers."""
+        self.stop_accepting()
+        self.connections.start_draining()
+        self.connections.abort_all()
+        self.connections.wait(time.monotonic() + CLOSE_TIMEOUT)
+
+    def server_close(self) -> None:
+        super().server_close()  # type: ignore[misc]
+        for sock in self._wakeup:
+            sock.close()
+
 
 class HTTPProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Small keep-alive responses must not wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.tracked = self.server.connections.open(self.connection)
+        CONNECTIONS_TOTAL.inc(frontend='http')
+        CONNECTIONS_ACTIVE.inc(frontend='http')
+
+    def finish(self):
+        CONNECTIONS_ACTIVE.dec(frontend='http')
+        self.server.connections.close(self.tracked)
+        super().finish()
+
+    def handle(self):
+        """Serve requests until the connection closes, marking it idle between them"""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.server.connections.set_state(self.tracked, STATE_IDLE)
+            self.handle_one_request()
+
+    def _acquire_upstream(self, tried: List[Upstream]) -> Tuple[Upstream, UpstreamConnection]:
+        """Pick an upstream not in tried and return a pooled or new connection to it"""
+        group = self.server.upstreams
+        error: Optional[OSError] = None
+        while True:
+            upstream = group.pick(tried)
+            if upstream is None:
+                raise error or OSError("No upstream proxy available")
+            connection = self.server.pool.acquire(upstream.key)
+            if connection is not None:
+                return upstream, connection
+            started = time.monotonic()
+            try:
+                upstream_sock = connect(upstream.host, upstream.port)
+            except OSError as e:
+                # Unreachable upstream: count the failure and fail over to the next one
+                group.record_failure(upstream)
+                record_error('upstream_connect', e)
+                tried.append(upstream)
+                error = e
+                continue
+            elapsed = time.monotonic() - started
+            group.record_success(upstream, elapsed)
+            UPSTREAM_CONNECT_SECONDS.observe(elapsed, upstream=upstream.name)
+            return upstream, UpstreamConnection(upstream_sock, upstream_sock.makefile('rb'))
+
     def do_CONNECT(self):
         """Handle CONNECT request for HTTPS connections"""
+        self.close_connection = True
+        self.server.connections.set_state(self.tracked, STATE_ACTIVE)
+        REQUESTS_TOTAL.inc(frontend='http', kind='connect')
+        rate_limits = getattr(self.server, 'rate_limits', None)
+        if rate_limits is not None and not rate_limits.allow_connect(self.client_address[0]):
+            ERRORS_TOTAL.inc(stage='connect_rate', error='limited')
+            self.send_error(429, "Too many new connections")
+            return
         try:
-            # Establish connection to upstream proxy
-            upstream_host = getattr(self.server, 'upstream_host', None)
-            upstream_port = getattr(self.server, 'upstream_port', None)
+            group = self.server.upstreams
+            tried: List[Upstream] = []
+            challenged: List[Upstream] = []
+            refusal: Optional[ResponseHead] = None
+            while True:
+                # Reuse an idle pooled connection to an upstream proxy when possible
+                try:
+                    upstream, connection = self._acquire_upstream(tried)
+                except OSError as e:
+                    if refusal is not None:
+                        # Out of upstreams: pass on the last refusal (and any challenge) as is
+                        self.connection.sendall(refusal_head(refusal))
+                    else:
+                        self.send_error(502, f"Upstream proxy connection failed: {e}")
+                    return
+                upstream_sock = connection.sock
+                headers, credentials = authorize([('Host', self.path)], upstream.auth, 'CONNECT', self.path)
+                started = time.monotonic()
+                try:
+                    # Send CONNECT request to upstream proxy
+                    upstream_sock.sendall(build_head(f"CONNECT {self.path} HTTP/1.1", headers))
 
-            if not upstream_host or not upstream_port:
-                self.send_error(500, "Proxy server not properly configured")
-                return
-            
-            # Create socket to upstream proxy
-            upstream_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            upstream_sock.connect((upstream_host, int(upstream_port)))
-            
-            # Send CONNECT request to upstream proxy
-            connect_request = f"CONNECT {self.path} HTTP/1.1\r\nHost: {self.path}\r\n\r\n"
-            upstream_sock.send(connect_request.encode())
-            
-            # Receive response from upstream proxy
-            response = upstream_sock.recv(4096)
-            if b"200 Connection established" in response:
-                # Send successful response to client
-                self.send_response(200, "Connection established")
-                self.end_headers()
-                
-                # Start forwarding data between client and upstream proxy
-                self._forward_data(self.connection, upstream_sock)
-            else:
-                self.send_error(502, "Upstream proxy connection failed")
+                    # Receive the response head, however the upstream splits it into segments
+                    parser = ResponseHeadParser()
+                    response = None
+                    while response is None:
+                        data = upstream_sock.recv(BUFFER_SIZE)
+                        if not data:
+                            raise ConnectionError("Upstream proxy closed the connection during CONNECT")
+                        response = parser.feed(data)
+                except (OSError, ValueError) as e:
+                    record_error('upstream_handshake', e)
+                    response = None
+                if response is None:
+                    connection.close()
+                    if not connection.reused:
+                        group.record_failure(upstream)
+                        tried.append(upstream)
+                    continue  # Stale pooled connection, retry on a fresh one
+                if response.status == AUTH_REQUIRED:
+                    connection.close()
+                    try:
+                        answer_challenge(upstream.auth, response, credentials, upstream in challenged)
+                    except ProxyAuthError as e:
+                        record_error('upstream_auth', e)
+                        refusal = response
+                        tried.append(upstream)
+                        continue
+                    challenged.append(upstream)
+                    continue  # Retry with the credentials the upstream asked for
+                if not 200 <= response.status < 300:
+                    # The upstream refused this destination; try the next one
+                    ERRORS_TOTAL.inc(stage='upstream_refused', error=f"HTTP {response.status}")
+                    connection.close()
+                    refusal = response
+                    tried.append(upstream)
+                    continue
+                group.record_success(upstream, time.monotonic() - started)
+                break
+
+            self.server.connections.attach(self.tracked, upstream_sock)
+            try:
+                with group.using(upstream, self.connection, upstream_sock):
+                    # Forward what the client already sent (e.g. its TLS ClientHello) right away,
+                    # then answer it along with any tunnel bytes that came with the upstream's head
+                    early = self._take_buffered()
+                    if early:
+                        upstream_sock.sendall(early)
+                    self.send_response(200, "Connection established")
+                    self.end_headers()
+                    if parser.rest:
+                        self.connection.sendall(parser.rest)
+
+                    # Start forwarding data between client and upstream proxy
+                    started = time.monotonic()
+                    shaping = rate_limits.tunnel(self.client_address[0], upstream.name) if rate_limits else None
+                    moved = self._forward_data(self.connection, upstream_sock, shaping)
+                    record_tunnel('http', time.monotonic() - started,
+                                  (moved[0] + len(early), moved[1] + len(parser.rest)))
+            finally:
+                connection.close()
         except Exception as e:
+            record_error('connect', e)
             self.send_error(500, f"Error: {str(e)}")
     
-    def do_GET(self):
-        """Handle GET request through upstream proxy"""
-        try:
-            upstream_host = getattr(self.server, 'upstream_host', None)
-            upstream_port = getattr(self.server, 'upstream_port', None)
+    def _cache_lookup(self, request: RequestHead) -> Lookup:
+        """Ask the cache about a request, waiting for another request's fetch of the same URL"""
+        cache = self.server.cache
+        lookup = cache.lookup(request)
+        if lookup.flight is not None:
+            lookup.flight.wait(COALESCE_TIMEOUT)
+            lookup = cache.lookup(request, coalesce=False)
+            cache.count_coalesced(lookup)
+        return lookup
 
-            if not upstream_host or not upstream_port:
-                self.send_error(500, "Proxy server not properly configured")
+    def _send_cached(self, request: RequestHead, lookup: Lookup) -> None:
+        """Answer a request from a cache entry: the body from memory or with sendfile() from disk"""
+        entry = cast(CacheEntry, lookup.entry)
+        not_modified = entry.not_modified(request)
+        keep_alive = request.keep_alive(self.request_version)
+        headers = entry.response_headers(time.time(), not_modified) + [('X-Cache', 'HIT')]
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+        elif self.request_version == 'HTTP/1.0':
+            headers.append(('Connection', 'keep-alive'))
+        head = build_head('HTTP/1.1 304 Not Modified' if not_modified else entry.status_line, headers)
+        self.wfile.write(head)
+        sent = len(head)
+        if not not_modified and self.command == 'GET' and entry.length:
+            if entry.body is not None:
+                self.wfile.write(entry.body)
+            else:
+                self.connection.sendfile(cast(BinaryIO, lookup.body_file), 0, entry.length)
+            sent += entry.length
+        record_bytes('http', 0, sent)
+        self.close_connection = not keep_alive
+
+    def _proxy_request(self):
+        """Relay a plain HTTP request through an upstream proxy, streaming both bodies"""
+        self.close_connection = True
+        headers_sent = False
+        connection = None
+        lookup: Optional[Lookup] = None
+        collector: Optional[BodyCollector] = None
+        self.server.connections.set_state(self.tracked, STATE_ACTIVE)
+        REQUESTS_TOTAL.inc(frontend='http', kind='http')
+        try:
+            group = self.server.upstreams
+            request = RequestHead(self.requestline, self.headers.items())
+            try:
+                framing, length = request_framing(request)
+            except ValueError:
+                self.send_error(400, "Bad request body framing")
                 return
-            
-            # Create socket to upstream proxy
-            upstream_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            upstream_sock.connect((upstream_host, int(upstream_port)))
-            
-            # Prepare request to send to upstream proxy
-            request = f"GET {self.path} HTTP/1.1\r\nHost: {self.headers['Host']}\r\n"
-            for header in self.headers:
-                if header.lower() not in ['connection', 'proxy-connection']:
-                    request += f"{header}: {self.headers[header]}\r\n"
-            request += "Connection: close\r\n\r\n"
-            
-            # Send request to upstream proxy
-            upstream_sock.send(request.encode())
-            
-            # Receive response from upstream proxy
-            response = upstream_sock.recv(4096)
-            
-            # Parse response to get status line
-            response_str = response.decode('utf-8', errors='ignore')
-            status_line = response_str.split('\r\n')[0]
-            status_code = int(status_line.split()[1])
-            
-            # Send response to client
-            self.send_response(status_code)
-            
-            # Forward headers
-            for line in response_str.split('\r\n')[1:]:
-                if line:
-                    header_parts = line.split(':', 1)
-                    if len(header_parts) == 2:
-                        self.send_header(header_parts[0], header_parts[1].strip())
-                else:
-                    break
-            
-            self.end_headers()
-            
-            # Send body response
-            body_start = response_str.find('\r\n\r\n') + 4
-            if body_start > 3:  # If we found the body
-                self.wfile.write(response[body_start:])
-            
-            # Forward remaining data
+
+            cache = self.server.cache
+            headers = request.forward_headers()
+            if cache is not None:
+                lookup = self._cache_lookup(request)
+                if lookup.action == CACHE_HIT:
+                    self._send_cached(request, lookup)
+                    return
+                if lookup.action == CACHE_UNAVAILABLE:
+                    self.send_error(504, "Not in cache")
+                    return
+                headers = lookup.forward_headers(headers)
+            tried: List[Upstream] = []
+            challenged: List[Upstream] = []
+            auth_error: Optional[ProxyAuthError] = None
             while True:
-                more_data = upstream_sock.recv(4096)
-                if not more_data:
-                    break
-                self.wfile.write(more_data)
-                
+                try:
+                    upstream, connection = self._acquire_upstream(tried)
+                except OSError:
+                    if auth_error is not None:
+                        raise auth_error
+                    raise
+                upstream_headers, credentials = authorize(headers, upstream.auth, self.command, self.path)
+                head = build_head(f"{self.command} {self.path} HTTP/1.1", upstream_headers)
+                self.server.connections.attach(self.tracked, connection.sock)
+                with group.using(upstream, self.connection, connection.sock):
+                    started = time.monotonic()
+                    try:
+                        # Send request head and stream the body to the upstream proxy
+                        connection.sock.sendall(head)
+                        try:
+                            sent = len(head) + _copy_body(self.rfile, connection.sock.sendall, framing, length)
+                        except ValueError as e:
+                            raise BadRequestBody(str(e)) from e
+
+                        # Read the final response head, relaying interim 1xx responses
+                        while True:
+                            raw_head = _read_head(connection.reader)
+                            response = parse_response_head(raw_head)
+                            if 100 <= response.status < 200 and response.status != 101:
+                                self.wfile.write(raw_head)
+                                continue
+                            break
+                    except (OSError, ConnectionError) as e:
+                        connection.close()
+                        record_error('upstream_request', e)
+                        if framing != BODY_NONE:
+                            raise
+                        # The upstream may close a pooled connection while it sits idle; replay
+                        # on a fresh connection, or on another upstream if a fresh one failed
+                        if not connection.reused:
+                            group.record_failure(upstream)
+                            tried.append(upstream)
+                        continue
+                    if response.status == AUTH_REQUIRED and upstream.auth is not None:
+                        connection.close()
+                        try:
+                            answer_challenge(upstream.auth, response, credentials, upstream in challenged)
+                            if framing != BODY_NONE:
+                                raise ProxyAuthError("Upstream proxy asked for other credentials after the request body was sent")
+                        except ProxyAuthError as e:
+                            record_error('upstream_auth', e)
+                            auth_error = e
+                            tried.append(upstream)
+                            if framing != BODY_NONE:
+                                raise
+                            continue
+                        challenged.append(upstream)
+                        continue  # Retry with the credentials the upstream asked for
+                    if framing == BODY_NONE:
+                        group.record_success(upstream, time.monotonic() - started)
+                    record_bytes('http', sent, 0)
+                    framing, length = response_framing(response, self.command)
+
+                    if lookup is not None and lookup.action == CACHE_REVALIDATE and response.status == 304:
+                        # Still current: refresh the entry and answer from it
+                        cache.refresh(lookup, response)
+                        self._send_cached(request, lookup)
+                        headers_sent = True
+                    else:
+                        keep_alive = request.keep_alive(self.request_version) and framing != BODY_UNTIL_CLOSE
+                        headers = response.forward_headers()
+                        if lookup is not None and lookup.action != CACHE_BYPASS:
+                            headers.append(('X-Cache', 'MISS'))
+                            collector = cache.collector(lookup, request, response, framing, length)
+                        if not keep_alive:
+                            headers.append(('Connection', 'close'))
+                        elif self.request_version == 'HTTP/1.0':
+                            headers.append(('Connection', 'keep-alive'))
+                        response_head = build_head(response.start_line, headers)
+                        self.wfile.write(response_head)
+                        headers_sent = True
+                        write = self.wfile.write if collector is None else collector.tee(self.wfile.write)
+                        copied = _copy_body(connection.reader, write, framing, length)
+                        record_bytes('http', 0, len(response_head) + copied)
+                        if collector is not None:
+                            cache.store(collector)
+                        self.close_connection = not keep_alive
+
+                    if response.keep_alive(response.version) and framing != BODY_UNTIL_CLOSE:
+                        self.server.connections.detach(self.tracked, connection.sock)
+                        self.server.pool.release(upstream.key, connection)
+                        connection = None
+                    return
+        except ProxyAuthError as e:
+            if not headers_sent:
+                self.send_error(502, f"Upstream proxy authentication failed: {e}")
+        except BadRequestBody as e:
+            record_error('client_request', e)
+            self.send_error(400, f"Bad request body: {e}")
         except Exception as e:
-            self.send_error(500, f"Error: {str(e)}")
-    
-    def _forward_data(self, client_sock, upstream_sock):
-        """Forward data between client and upstream proxy"""
+            record_error('request', e)
+            if not headers_sent:
+                self.send_error(502, f"Error: {str(e)}")
+        finally:
+            if connection is not None:
+                self.server.connections.detach(self.tracked, connection.sock)
+                connection.close()
+            if collector is not None:
+                collector.abandon()  # No-op once stored
+            if lookup is not None:
+                lookup.release()
+
+    do_GET = _proxy_request
+    do_HEAD = _proxy_request
+    do_POST = _proxy_request
+    do_PUT = _proxy_request
+    do_DELETE = _proxy_request
+    do_OPTIONS = _proxy_request
+    do_PATCH = _proxy_request
+
+    def _take_buffered(self) -> bytes:
+        """Return client bytes already read past the request head, without waiting for more"""
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0.0)
         try:
-            while True:
-                # Use select to handle data in both directions
-                ready, _, _ = select.select([client_sock, upstream_sock], [], [], 1)
-                
-                if client_sock in ready:
-                    data = client_sock.recv(4096)
-                    if not data:
-                        break
-                    upstream_sock.send(data)
-                
-                if upstream_sock in ready:
-                    data = upstream_sock.recv(4096)
-                    if not data:
-                        break
-                    client_sock.send(data)
-        except Exception:
-            pass  # Connection closed
+            return self.rfile.read1(BUFFER_SIZE) or b""
+        except OSError:
+            return b""
+        finally:
+            self.connection.settimeout(timeout)
+
+    def _forward_data(self, client_sock, upstream_sock, shaping: Optional[Shaping] = None) -> Tuple[int, int]:
+        """Forward data between client and upstream proxy, returning bytes moved each way"""
+        try:
+            return relay_blocking(client_sock, upstream_sock, getattr(self.server, 'relay_mode', DEFAULT_RELAY_MODE),
+                                  getattr(self.server, 'relay_watermarks', DEFAULT_WATERMARKS), shaping)
         finally:
             client_sock.close()
             upstream_sock.close()
@@ -138,82 +573,456 @@ class HTTPProxyHandler(BaseHTTPRequestHandler):
 # Global list to keep track of running servers for proper shutdown
 running_servers: List[Any] = []
 
-def start_http_proxy(local_port: int, upstream_host: str, upstream_port: int) -> Any:
+def _listen_address(local_host: str, local_port: int, allow_remote: bool) -> Tuple[int, Any]:
+    """Resolve a listen address, refusing one other hosts can reach unless allow_remote is set.
+
+    Raises:
+        ValueError: If the address is not a loopback address and allow_remote is not set
+    """
+    family, address = listen_address(local_host, local_port)
+    if not allow_remote and not is_loopback(address[0]):
+        raise ValueError(f"Refusing to listen on {local_host}: other hosts could use the proxy without "
+                         f"authenticating (pass --allow-remote to allow it)")
+    return family, address
+
+def start_http_proxy(local_port: int, upstream_host: str, upstream_port: int, engine: str = DEFAULT_ENGINE,
+                     pool_size: int = DEFAULT_POOL_SIZE, pool_idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                     relay_mode: str = DEFAULT_RELAY_MODE, reuse_port: bool = False,
+                     upstreams: Optional[UpstreamGroup] = None, cache_memory: int = 0, cache_disk: int = 0,
+                     cache_dir: Optional[str] = None, local_host: str = DEFAULT_LISTEN_HOST,
+                     backlog: int = DEFAULT_BACKLOG, cache: Optional[HTTPCache] = None,
+                     username: Optional[str] = None, password: Optional[str] = None,
+                     relay_high_water: int = DEFAULT_RELAY_HIGH_WATER,
+                     relay_low_water: int = DEFAULT_RELAY_LOW_WATER, global_rate: int = 0, listener_rate: int = 0,
+                     client_rate: int = 0, upstream_rate: Optional[str] = None, connect_rate: float = 0,
+                     allow_remote: bool = False) -> Any:
     """Start an HTTP proxy server that forwards to upstream proxy.
 
     Args:
         local_port: Local port to listen on
         upstream_host: Upstream proxy hostname/IP
         upstream_port: Upstream proxy port
+        engine: Forwarding engine, one of ENGINES
+        pool_size: Idle keep-alive connections kept to the upstream (0 disables pooling)
+        pool_idle_timeout: Seconds a pooled connection may stay idle
+        relay_mode: CONNECT tunnel relay, one of relay.RELAY_MODES
+        reuse_port: Bind with SO_REUSEPORT so worker processes can share the port
+        upstreams: Group of HTTP upstreams to balance across; replaces upstream_host/upstream_port
+        cache_memory: MiB of plain HTTP GET responses cached in memory (0 and no cache_disk: no cache)
+        cache_disk: MiB of responses cached on disk (0 disables the disk tier)
+        cache_dir: Directory of the disk tier (default: http_cache.DEFAULT_CACHE_DIR)
+        local_host: Local address to listen on, a name or an IPv4/IPv6 address
+        backlog: Listen backlog, the connections the kernel queues during accept bursts
+        cache: Response cache shared with other listeners; replaces cache_memory/cache_disk/cache_dir
+        username: Optional upstream authentication username
+        password: Optional upstream authentication password
+        relay_high_water: KiB a tunnel buffers per direction before it stops reading
+        relay_low_water: KiB the buffer drains to before reading resumes
+        global_rate: Tunnel bytes per second each way for all listeners in this process (0: unlimited)
+        listener_rate: Tunnel bytes per second each way for this listener (0: unlimited)
+        client_rate: Tunnel bytes per second each way for each client address (0: unlimited)
+        upstream_rate: Tunnel bytes per second each way per upstream profile, see shaping.parse_upstream_rates()
+        connect_rate: New tunnels per second from each client address (0: unlimited)
+        allow_remote: Allow listening on an address other hosts can reach (the proxy has no client authentication)
 
     Returns:
-        The proxy server instance
+        The proxy server instance; its ``pool`` attribute reports hit/miss counters,
+        ``cache`` the response cache (or None) and ``upstreams`` the per-upstream counters
     """
-    class Proxy(HTTPServer):
+    resolve_mode(relay_mode)
+    family, address = _listen_address(local_host, local_port, allow_remote)
+    watermarks = Watermarks.from_kib(relay_high_water, relay_low_water)
+    rate_limits = RateLimits.create(global_rate, listener_rate, client_rate, upstream_rate, connect_rate)
+    if cache is None:
+        cache = create_cache(cache_memory, cache_disk, cache_dir)
+    if upstreams is None:
+        upstreams = UpstreamGroup.single('http', upstream_host, upstream_port, username, password)
+    if any(upstream.proxy_type != 'http' for upstream in upstreams.upstreams):
+        raise ValueError("The HTTP front-end can only forward to HTTP upstreams")
+
+    if engine == 'asyncio':
+        from async_engine import AsyncHTTPProxy
+        server = AsyncHTTPProxy((local_host, local_port), upstreams, pool_size, pool_idle_timeout, reuse_port, backlog)
+        server.relay_mode = relay_mode
+        server.relay_watermarks = watermarks
+        server.rate_limits = rate_limits
+        server.cache = cache
+        server.serve()
+        watch_server(server)
+        running_servers.append(server)
+        return server
+
+    class Proxy(DrainableServerMixIn, ThreadingHTTPServer):
+        frontend = 'http'
+        address_family = family
+        request_queue_size = backlog
+
         def __init__(self, server_address: Tuple[str, int], handler_class: Any) -> None:
             super().__init__(server_address, handler_class)
-            self.upstream_host = upstream_host
-            self.upstream_port = upstream_port
+            self.upstreams = upstreams
+            self.pool = ConnectionPool(pool_size, pool_idle_timeout)
+            self.relay_mode = relay_mode
+            self.relay_watermarks = watermarks
+            self.rate_limits = rate_limits
+            self.cache = cache
 
-    server = Proxy(('localhost', local_port), HTTPProxyHandler)
+        def server_bind(self) -> None:
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            super().server_bind()
+
+        def server_close(self) -> None:
+            super().server_close()
+            self.pool.close_all()
+
+    server = Proxy(address, HTTPProxyHandler)
     thread = threading.Thread(target=server.serve_forever)
     thread.daemon = True
     thread.start()
+    watch_server(server)
 
     # Add to running servers list for potential cleanup
     running_servers.append(server)
 
     return server
 
-def stop_all_servers() -> None:
-    """Stop all running proxy servers"""
-    for server in running_servers:
+def start_profile_proxy(profiles: Dict[str, Dict[str, str]], local_port: int, policy: str = DEFAULT_POLICY,
+                        **options: Any) -> Any:
+    """Start the local proxy server for one or more profiles.
+
+    With several profiles the server balances connections across them. The
+    local endpoint is an HTTP proxy when every profile is an HTTP proxy and a
+    SOCKS server otherwise.
+
+    Args:
+        profiles: Profile records keyed by profile name, as returned by config_manager.get_profile()
+        local_port: Local port to listen on
+        policy: Balancing policy, one of upstreams.POLICIES
+        **options: Extra keyword arguments for start_http_proxy/start_socks_proxy
+
+    Returns:
+        The proxy server instance
+    """
+    upstreams = build_upstreams(profiles, policy)
+    first = upstreams.upstreams[0]
+    if all(upstream.proxy_type == 'http' for upstream in upstreams.upstreams):
+        return start_http_proxy(local_port, first.host, first.port, upstreams=upstreams, **options)
+    for option in ('pool_size', 'pool_idle_timeout', 'cache_memory', 'cache_disk', 'cache_dir', 'cache'):
+        options.pop(option, None)
+    return start_socks_proxy(local_port, first.host, first.port, upstreams=upstreams, **options)
+
+def share_cache(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the cache sizing options by one cache, so several listeners share it (and its disk tier).
+
+    Args:
+        options: Keyword arguments for start_profile_proxy()
+
+    Returns:
+        A copy of options with a ``cache`` entry instead of cache_memory/cache_disk/cache_dir
+    """
+    options = dict(options)
+    options['cache'] = create_cache(options.pop('cache_memory', 0), options.pop('cache_disk', 0),
+                                    options.pop('cache_dir', None))
+    return options
+
+def start_listeners(listeners: List[Tuple[str, int, Dict[str, Dict[str, str]]]], **options: Any) -> List[Any]:
+    """Start a local proxy for each listener, all in this process.
+
+    With the asyncio engine every listener is served by the one shared event
+    loop, so adding listeners adds no threads. The HTTP listeners share one
+    response cache.
+
+    Args:
+        listeners: (local host, local port, profile records keyed by name) per listener
+        **options: Extra keyword arguments for start_profile_proxy()
+
+    Returns:
+        The proxy server instances, in listener order
+
+    Raises:
+        OSError: If a listener cannot be bound; the ones already started are stopped
+        ValueError: If a listener's profiles cannot be served
+    """
+    options = share_cache(options)
+    options.pop('local_host', None)
+    servers: List[Any] = []
+    try:
+        for host, port, profiles in listeners:
+            servers.append(start_profile_proxy(profiles, port, local_host=host, **options))
+    except BaseException:
+        stop_servers(servers)
+        raise
+    return servers
+
+def build_upstreams(profiles: Dict[str, Dict[str, str]], policy: str = DEFAULT_POLICY) -> UpstreamGroup:
+    """Build the upstream group for one or more profile records keyed by name."""
+    if not profiles:
+        raise ValueError("At least one profile is required")
+    return UpstreamGroup([Upstream.from_profile(name, profile) for name, profile in profiles.items()], policy)
+
+def switch_profiles(server: Any, profiles: Dict[str, Dict[str, str]], policy: str = DEFAULT_POLICY,
+                    grace: Optional[float] = None) -> UpstreamGroup:
+    """Point a running server at other profiles.
+
+    The server's upstream group is replaced in one assignment: new
+    connections use the new profiles, while established tunnels keep the
+    upstream they were opened with and drain on their own.
+
+    Args:
+        server: A server returned by start_profile_proxy()
+        profiles: Profile records keyed by profile name
+        policy: Balancing policy, one of upstreams.POLICIES
+        grace: Seconds established tunnels may keep running before they are
+            closed; None lets them run until either side closes
+
+    Returns:
+        The upstream group that was replaced
+
+    Raises:
+        ValueError: If the profiles need a different front-end than the server has
+    """
+    upstreams = build_upstreams(profiles, policy)
+    if server.frontend == 'http' and any(upstream.proxy_type != 'http' for upstream in upstreams.upstreams):
+        raise ValueError("An HTTP front-end can only switch to HTTP profiles")
+    previous, server.upstreams = server.upstreams, upstreams
+    if grace is not None:
+        timer = threading.Timer(grace, previous.close_connections)
+        timer.daemon = True
+        timer.start()
+    return previous
+
+def stop_server(server: Any, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+                progress: Optional[ProgressCallback] = None) -> int:
+    """Stop one running proxy server and forget it.
+
+    See stop_servers() for the arguments.
+    """
+    return stop_servers([server], drain_timeout, progress)
+
+def stop_servers(servers: List[Any], drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+                 progress: Optional[ProgressCallback] = None) -> int:
+    """Stop proxy servers, letting their open connections finish first.
+
+    Every server stops accepting at once and closes its idle keep-alive
+    connections. Connections serving a request or tunnel get up to
+    drain_timeout seconds to finish; the rest are then closed.
+
+    Args:
+        servers: Servers returned by start_profile_proxy() and friends
+        drain_timeout: Seconds to wait for open connections (0 closes them at once)
+        progress: Called about once a second while waiting, with the number
+            of connections still open and the seconds left
+
+    Returns:
+        Number of connections that were closed at the deadline
+    """
+    stopping = []
+    for server in servers:
+        unwatch_server(server)
+        try:
+            server.stop_accepting()
+            server.connections.start_draining()
+            stopping.append(server)
+        except Exception as e:
+            print(f"Error stopping server: {e}")
+        if server in running_servers:
+            running_servers.remove(server)
+
+    deadline = time.monotonic() + drain_timeout
+    report = None
+    if progress is not None:
+        report = lambda _, left: progress(sum(len(server.connections) for server in stopping), left)
+    for server in stopping:
+        if server.connections.wait(deadline, report):
+            break  # Out of time; every server closes what is left
+
+    closed = 0
+    for server in stopping:
+        closed += len(server.connections)
         try:
             server.shutdown()
             server.server_close()
         except Exception as e:
             print(f"Error stopping server: {e}")
+    return closed
 
-    # Clear the list
-    running_servers.clear()
+def stop_all_servers(drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+                     progress: Optional[ProgressCallback] = None) -> int:
+    """Stop all running proxy servers, see stop_servers()."""
+    return stop_servers(list(running_servers), drain_timeout, progress)
+
+def start_socks_proxy(local_port: int, upstream_host: str, upstream_port: int, username: Optional[str] = None, password: Optional[str] = None,
+                      engine: str = DEFAULT_ENGINE, proxy_type: str = 'socks5', relay_mode: str = DEFAULT_RELAY_MODE,
+                      reuse_port: bool = False, upstreams: Optional[UpstreamGroup] = None,
+                      local_host: str = DEFAULT_LISTEN_HOST, backlog: int = DEFAULT_BACKLOG,
+                      relay_high_water: int = DEFAULT_RELAY_HIGH_WATER,
+                      relay_low_water: int = DEFAULT_RELAY_LOW_WATER, global_rate: int = 0, listener_rate: int = 0,
+                      client_rate: int = 0, upstream_rate: Optional[str] = None, connect_rate: float = 0,
+                      allow_remote: bool = False) -> Any:
+    """Start a SOCKS4/4a/5 proxy server that chains to the upstream proxy.
+
+    Args:
+        local_port: Local port to listen on
+        upstream_host: Upstream proxy hostname/IP
+        upstream_port: Upstream proxy port
+        username: Optional upstream authentication username
+        password: Optional upstream authentication password
+        engine: Forwarding engine, one of ENGINES
+        proxy_type: Upstream profile type (socks4, socks5 or http)
+        relay_mode: Tunnel relay, one of relay.RELAY_MODES
+        reuse_port: Bind with SO_REUSEPORT so worker processes can share the port
+        upstreams: Group of upstreams to balance across; replaces the single upstream arguments
+        local_host: Local address to listen on, a name or an IPv4/IPv6 address
+        backlog: Listen backlog, the connections the kernel queues during accept bursts
+        relay_high_water: KiB a tunnel buffers per direction before it stops reading
+        relay_low_water: KiB the buffer drains to before reading resumes
+        global_rate: Tunnel bytes per second each way for all listeners in this process (0: unlimited)
+        listener_rate: Tunnel bytes per second each way for this listener (0: unlimited)
+        client_rate: Tunnel bytes per second each way for each client address (0: unlimited)
+        upstream_rate: Tunnel bytes per second each way per upstream profile, see shaping.parse_upstream_rates()
+        connect_rate: New tunnels per second from each client address (0: unlimited)
+        allow_remote: Allow listening on an address other hosts can reach (the proxy has no client authentication)
+
+    Returns:
+        The proxy server instance
+    """
+    resolve_mode(relay_mode)
+    family, address = _listen_address(local_host, local_port, allow_remote)
+    watermarks = Watermarks.from_kib(relay_high_water, relay_low_water)
+    rate_limits = RateLimits.create(global_rate, listener_rate, client_rate, upstream_rate, connect_rate)
+    if upstreams is None:
+        upstreams = UpstreamGroup.single(proxy_type, upstream_host, upstream_port, username, password)
+    for upstream in upstreams.upstreams:
+        if upstream.proxy_type not in PROXY_TYPES:
+            raise ValueError(f"Unsupported upstream proxy type: {upstream.proxy_type}")
+
+    if engine == 'asyncio':
+        from async_engine import AsyncSocksProxy
+        server = AsyncSocksProxy((local_host, local_port), upstreams, reuse_port, backlog)
+        server.relay_mode = relay_mode
+        server.relay_watermarks = watermarks
+        server.rate_limits = rate_limits
+        server.serve()
+        watch_server(server)
+        running_servers.append(server)
+        return server
 
-def start_socks_proxy(local_port: int, upstream_host: str, upstream_port: int, username: Optional[str] = None, password: Optional[str] = None) -> Any:
-    """Start a SOCKS proxy server that forwards to upstream proxy"""
-    import socketserver
-    
     class SocksProxyHandler(socketserver.BaseRequestHandler):
+        def setup(self):
+            try:
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+            self.tracked = self.server.connections.open(self.request)
+            CONNECTIONS_TOTAL.inc(frontend='socks')
+            CONNECTIONS_ACTIVE.inc(frontend='socks')
+
+        def finish(self):
+            CONNECTIONS_ACTIVE.dec(frontend='socks')
+            self.server.connections.close(self.tracked)
+
         def handle(self):
-            # This is a simplified SOCKS proxy implementation
-            # For a fully functional SOCKS proxy, a more complex implementation is needed
-            upstream_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            upstream_sock.connect((upstream_host, int(upstream_port)))
-            
-            # Forward data between client and upstream proxy
+            client = self.request
+            upstreams = self.server.upstreams  # Fixed for this connection even if the server is switched
+            reader = BlockingReader(client)
+            # An idle or slow client must not hold its thread forever
+            client.settimeout(HANDSHAKE_TIMEOUT)
             try:
-                while True:
-                    ready, _, _ = select.select([self.request, upstream_sock], [], [], 1)
-                    
-                    if self.request in ready:
-                        data = self.request.recv(4096)
-                        if not data:
-                            break
-                        upstream_sock.send(data)
-                    
-                    if upstream_sock in ready:
-                        data = upstream_sock.recv(4096)
-                        if not data:
-                            break
-                        self.request.send(data)
-            except Exception:
-                pass  # Connection closed
-            finally:
-                self.request.close()
-                upstream_sock.close()
-    
-    server = socketserver.TCPServer(('localhost', local_port), SocksProxyHandler)
+                request = negotiate_blocking(reader)
+            except SocksError as e:
+                record_error('handshake', e)
+                reply = e.failure_reply()
+                if reply:
+                    try:
+                        client.sendall(reply)
+                    except OSError:
+                        pass
+                return
+            except (OSError, ValueError) as e:
+                record_error('handshake', e)
+                return
+            client.settimeout(None)
+            self.server.connections.set_state(self.tracked, STATE_ACTIVE)
+
+            if request.command == CMD_CONNECT:
+                REQUESTS_TOTAL.inc(frontend='socks', kind='connect')
+                client_ip = self.client_address[0]
+                if rate_limits is not None and not rate_limits.allow_connect(client_ip):
+                    ERRORS_TOTAL.inc(stage='connect_rate', error='limited')
+                    client.sendall(request.reply(REP_NOT_ALLOWED))
+                    return
+                try:
+                    upstream, upstream_sock = connect_group(upstreams, request.host, request.port)
+                except (OSError, socks.ProxyError) as e:
+                    client.sendall(request.reply(reply_code_for(e)))
+                    return
+
+                # Forward data between client and upstream proxy
+                self.server.connections.attach(self.tracked, upstream_sock)
+                try:
+                    with upstreams.using(upstream, client, upstream_sock):
+                        client.sendall(request.reply(REP_SUCCEEDED))
+                        pending = reader.take_buffer()
+                        if pending:
+                            upstream_sock.sendall(pending)
+                        started = time.monotonic()
+                        shaping = rate_limits.tunnel(client_ip, upstream.name) if rate_limits else None
+                        moved = relay_blocking(client, upstream_sock, relay_mode, watermarks, shaping)
+                        record_tunnel('socks', time.monotonic() - started, (moved[0] + len(pending), moved[1]))
+                finally:
+                    upstream_sock.close()
+            elif request.command == CMD_UDP_ASSOCIATE and request.version == SOCKS5_VERSION:
+                REQUESTS_TOTAL.inc(frontend='socks', kind='udp')
+                try:
+                    upstream, association = associate_group(upstreams, client.getpeername()[0],
+                                                            client.getsockname()[0])
+                except SocksError as e:
+                    client.sendall(request.reply(e.reply))
+                    return
+                except (OSError, socks.ProxyError) as e:
+                    client.sendall(request.reply(reply_code_for(e)))
+                    return
+
+                # The association lives as long as the control connection
+                try:
+                    with upstreams.using(upstream, client):
+                        client.sendall(request.reply(REP_SUCCEEDED, *association.bound_address))
+                        association.start()
+                        started = time.monotonic()
+                        try:
+                            while client.recv(4096):
+                                pass
+                        finally:
+                            TUNNEL_SECONDS.observe(time.monotonic() - started, frontend='socks')
+                except OSError as e:
+                    record_error('client', e)
+                finally:
+                    association.close()
+            else:
+                client.sendall(request.reply(REP_COMMAND_NOT_SUPPORTED))
+
+    class SocksProxy(DrainableServerMixIn, socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+        frontend = 'socks'
+        address_family = family
+        request_queue_size = backlog
+
+        def __init__(self, server_address: Tuple[str, int], handler_class: Any) -> None:
+            super().__init__(server_address, handler_class)
+            self.upstreams = upstreams
+            self.rate_limits = rate_limits
+
+        def server_bind(self) -> None:
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            super().server_bind()
+
+    server = SocksProxy(address, SocksProxyHandler)
     thread = threading.Thread(target=server.serve_forever)
     thread.daemon = True
     thread.start()
+    watch_server(server)
     
     # Add to running servers list for potential cleanup
     running_servers.append(server)
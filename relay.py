@@ -0,0 +1,575 @@
+"""
+Proxy Manager CLI - Tunnel Relay
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Byte relays for established tunnels. One readiness loop drives both
+directions of a tunnel: a poll() loop in the connection's thread for the
+threaded engine, reader/writer callbacks for the asyncio engine. On Linux
+with Python 3.10+ tunnel bytes move socket -> pipe -> socket with
+os.splice() and never enter userspace; elsewhere they are copied through a
+buffer that only holds what the receiver has not taken yet, reading with
+recv_into() into a scratch buffer that each thread reuses. Either way each
+direction holds at most its high watermark, so an idle tunnel costs next to
+nothing and a stalled one a bounded amount. A direction that is rate limited
+draws tokens before each read; when they run out it stops reading until a
+timer says the buckets have refilled.
+"""
+
+import asyncio
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from defaults import RELAY_MODES, DEFAULT_RELAY_MODE, DEFAULT_RELAY_HIGH_WATER, DEFAULT_RELAY_LOW_WATER
+from metrics import record_error
+import shaping
+
+# Most bytes moved per recv()/splice() call
+BUFFER_SIZE = 65536
+
+# Pipe capacity assumed when it cannot be queried (the Linux default)
+DEFAULT_PIPE_SIZE = 65536
+
+# Reads one readiness event may do before yielding to other tunnels
+READS_PER_EVENT = 16
+
+SPLICE_FLAGS = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+
+
+def splice_supported() -> bool:
+    """Whether os.splice() is available (Linux, Python 3.10+)."""
+    return hasattr(os, 'splice') and sys.platform.startswith('linux')
+
+
+def resolve_mode(mode: str) -> str:
+    """Resolve 'auto' to the concrete relay mode for this platform.
+
+    Raises:
+        ValueError: If splice is requested but not supported
+    """
+    if mode not in RELAY_MODES:
+        raise ValueError(f"Unknown relay mode: {mode}")
+    if mode == 'auto':
+        return 'splice' if splice_supported() else 'copy'
+    if mode == 'splice' and not splice_supported():
+        raise ValueError("splice relay requires Linux and Python 3.10+")
+    return mode
+
+
+class Watermarks:
+    """Bounds on the bytes a tunnel holds for each direction.
+
+    Reading from a side stops once high bytes wait to be written to the
+    other side and resumes when they drain to low, so a fast sender facing
+    a slow receiver costs at most high bytes per direction.
+
+    Args:
+        high: Bytes buffered per direction before reading pauses
+        low: Buffered bytes at which reading resumes
+
+    Raises:
+        ValueError: Unless 0 <= low <= high and high > 0
+    """
+
+    __slots__ = ('high', 'low')
+
+    def __init__(self, high: int = DEFAULT_RELAY_HIGH_WATER * 1024, low: int = DEFAULT_RELAY_LOW_WATER * 1024) -> None:
+        if high <= 0:
+            raise ValueError("The relay high watermark must be positive")
+        if not 0 <= low <= high:
+            raise ValueError("The relay low watermark must be between 0 and the high watermark")
+        self.high = high
+        self.low = low
+
+    @classmethod
+    def from_kib(cls, high: int, low: int) -> 'Watermarks':
+        """Watermarks given in KiB, as on the command line."""
+        return cls(high * 1024, low * 1024)
+
+
+DEFAULT_WATERMARKS = Watermarks()
+
+# Buckets drawn from by each direction of a tunnel: (client -> upstream, upstream -> client)
+Shaping = Tuple[shaping.Buckets, shaping.Buckets]
+
+
+def _open_pipe(size: int) -> Tuple[int, int, int]:
+    """Open a pipe of about size bytes.
+
+    Returns:
+        (read end, write end, capacity in bytes)
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        import fcntl
+        try:
+            fcntl.fcntl(write_fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), size)
+        except OSError:
+            pass  # Above /proc/sys/fs/pipe-max-size: keep the default capacity
+        capacity = fcntl.fcntl(write_fd, getattr(fcntl, 'F_GETPIPE_SZ', 1032))
+    except (ImportError, OSError):
+        capacity = DEFAULT_PIPE_SIZE
+    return read_fd, write_fd, capacity
+
+
+_local = threading.local()
+
+
+def _scratch() -> memoryview:
+    """The calling thread's read buffer, allocated on its first read.
+
+    A copy direction hands what it reads on (or into its own buffer) before
+    returning, so every tunnel served by a thread can share it.
+    """
+    view = getattr(_local, 'scratch', None)
+    if view is None:
+        view = _local.scratch = memoryview(bytearray(BUFFER_SIZE))
+    return view
+
+
+def _half_close(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def _abort(*socks: socket.socket) -> None:
+    for sock in socks:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _Half:
+    """One direction of a tunnel: bytes read from source and not yet written to destination.
+
+    Both sockets must be non-blocking. read() and write() do what the
+    sockets allow without waiting; the caller polls for readiness in between.
+    """
+
+    __slots__ = ('source', 'destination', 'high', 'low', 'moved', 'paused', 'eof', 'buckets', 'throttled', 'resume_at')
+
+    def __init__(self, source: socket.socket, destination: socket.socket, watermarks: Watermarks) -> None:
+        self.source = source
+        self.destination = destination
+        self.high = watermarks.high
+        self.low = watermarks.low
+        self.moved = 0
+        self.paused = False
+        self.eof = False
+        self.buckets: shaping.Buckets = ()
+        self.throttled = False
+        self.resume_at = 0.0
+
+    def pending(self) -> int:
+        """Bytes read but not yet written."""
+        raise NotImplementedError
+
+    def reading(self) -> bool:
+        """Whether the source should be polled for reading."""
+        return not (self.eof or self.paused or self.throttled)
+
+    def done(self) -> bool:
+        """Whether the source reached EOF and everything was written."""
+        return self.eof and not self.pending()
+
+    def read(self) -> None:
+        """Read what the source has, up to the high watermark, and pass it on.
+
+        Stops after READS_PER_EVENT reads so one busy tunnel cannot hold
+        the event loop; the source is still readable and gets polled again.
+        A rate-limited direction reads no more than its buckets grant and
+        is throttled until resume_at once they are empty.
+        """
+        for _ in range(READS_PER_EVENT):
+            size = self.high - self.pending()
+            if self.buckets:
+                size = shaping.take(self.buckets, size)
+                if not size:
+                    self.throttled = True
+                    self.resume_at = time.monotonic() + shaping.delay(self.buckets)
+                    return
+            try:
+                received = self._receive(size)
+            except BlockingIOError:
+                shaping.give_back(self.buckets, size)
+                self._blocked()
+                return
+            if self.buckets and received < size:
+                shaping.give_back(self.buckets, size - received)
+            if received:
+                self.moved += received
+            else:
+                self.eof = True
+            self.write()
+            if not self.reading():
+                return
+
+    def write(self) -> None:
+        """Write buffered bytes until the destination would block."""
+        try:
+            while self.pending() and self._send():
+                pass
+        except BlockingIOError:
+            pass
+        pending = self.pending()
+        if self.paused:
+            self.paused = pending > self.low
+        else:
+            self.paused = pending >= self.high
+        if self.eof and not pending:
+            _half_close(self.destination)
+
+    def close(self) -> None:
+        """Release what the direction holds."""
+
+    def _blocked(self) -> None:
+        """The source was reported readable, but reading would block."""
+
+    def _receive(self, size: int) -> int:
+        """Read at most size bytes from the source, returning the count (0 at EOF)."""
+        raise NotImplementedError
+
+    def _send(self) -> bool:
+        """Write buffered bytes, returning whether all of them were taken."""
+        raise NotImplementedError
+
+
+class _CopyHalf(_Half):
+    """A direction relayed through userspace; the buffer only holds what the destination has not taken yet.
+
+    Reads land in the thread's scratch buffer, so a tunnel keeps no read
+    buffer of its own and no bytes object is allocated per read.
+    """
+
+    __slots__ = ('buffer',)
+
+    def __init__(self, source: socket.socket, destination: socket.socket, watermarks: Watermarks) -> None:
+        super().__init__(source, destination, watermarks)
+        self.buffer = bytearray()
+
+    def pending(self) -> int:
+        return len(self.buffer)
+
+    def _receive(self, size: int) -> int:
+        scratch = _scratch()
+        received = self.source.recv_into(scratch, min(size, BUFFER_SIZE))
+        data = scratch[:received]
+        sent = 0
+        if received and not self.buffer:
+            # Hand the bytes straight on; only what the destination refuses is buffered
+            try:
+                sent = self.destination.send(data)
+            except BlockingIOError:
+                pass
+        self.buffer += data[sent:]
+        return received
+
+    def _send(self) -> bool:
+        sent = self.destination.send(self.buffer)
+        del self.buffer[:sent]  # Drops the front without moving the rest; an empty buffer frees its memory
+        return not self.buffer
+
+
+class _SpliceHalf(_Half):
+    """A direction relayed socket -> pipe -> socket inside the kernel.
+
+    The pipe is the buffer. Each splice from a socket may take a pipe slot
+    of its own, so the pipe can fill before the high watermark; read() then
+    pauses until the destination drains it.
+    """
+
+    __slots__ = ('read_fd', 'write_fd', 'queued')
+
+    def __init__(self, source: socket.socket, destination: socket.socket, watermarks: Watermarks) -> None:
+        super().__init__(source, destination, watermarks)
+        self.read_fd, self.write_fd, capacity = _open_pipe(self.high)
+        self.high = min(self.high, capacity)
+        self.low = min(self.low, self.high)
+        self.queued = 0
+
+    def pending(self) -> int:
+        return self.queued
+
+    def close(self) -> None:
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def _blocked(self) -> None:
+        if self.queued:
+            self.paused = True  # The pipe filled up before the high watermark
+
+    def _receive(self, size: int) -> int:
+        received = os.splice(self.source.fileno(), self.write_fd, size, flags=SPLICE_FLAGS)
+        self.queued += received
+        return received
+
+    def _send(self) -> bool:
+        self.queued -= os.splice(self.read_fd, self.destination.fileno(), self.queued, flags=SPLICE_FLAGS)
+        return not self.queued
+
+
+class _Tunnel:
+    """Both directions of a tunnel, driven by readiness events on its two sockets."""
+
+    __slots__ = ('client', 'upstream', 'outbound', 'inbound')
+
+    def __init__(self, client: socket.socket, upstream: socket.socket, mode: str,
+                 watermarks: Optional[Watermarks], shaping_buckets: Optional[Shaping] = None) -> None:
+        half = _SpliceHalf if resolve_mode(mode) == 'splice' else _CopyHalf
+        watermarks = watermarks or DEFAULT_WATERMARKS
+        self.client = client
+        self.upstream = upstream
+        self.outbound = half(client, upstream, watermarks)
+        try:
+            self.inbound = half(upstream, client, watermarks)
+        except OSError:
+            self.outbound.close()
+            raise
+        if shaping_buckets:
+            self.outbound.buckets, self.inbound.buckets = shaping_buckets
+
+    def _halves(self, sock: socket.socket) -> Tuple[_Half, _Half]:
+        """(direction reading from sock, direction writing to sock)"""
+        if sock is self.client:
+            return self.outbound, self.inbound
+        return self.inbound, self.outbound
+
+    def events(self, sock: socket.socket) -> int:
+        """Readiness events to wait for on sock (selectors.EVENT_* flags)."""
+        reading, writing = self._halves(sock)
+        return ((selectors.EVENT_READ if reading.reading() else 0)
+                | (selectors.EVENT_WRITE if writing.pending() else 0))
+
+    def ready(self, sock: socket.socket, events: int) -> None:
+        """Act on readiness events reported for sock.
+
+        Raises:
+            OSError: If a read or write fails
+        """
+        reading, writing = self._halves(sock)
+        if events & selectors.EVENT_WRITE and writing.pending():
+            writing.write()
+        if events & selectors.EVENT_READ and reading.reading():
+            reading.read()
+
+    def unthrottle(self) -> Optional[float]:
+        """Let throttled directions whose buckets have refilled read again.
+
+        Returns:
+            Seconds until the next direction still throttled may resume, or None if none is
+        """
+        wait = None
+        now = time.monotonic()
+        for half in (self.outbound, self.inbound):
+            if half.throttled:
+                if half.resume_at <= now:
+                    half.throttled = False
+                else:
+                    wait = min(wait, half.resume_at - now) if wait is not None else half.resume_at - now
+        return wait
+
+    def finished(self) -> bool:
+        return self.outbound.done() and self.inbound.done()
+
+    def moved(self) -> Tuple[int, int]:
+        return self.outbound.moved, self.inbound.moved
+
+    def close(self) -> None:
+        self.outbound.close()
+        self.inbound.close()
+
+
+def _poller() -> selectors.BaseSelector:
+    # poll() needs no descriptor of its own, unlike epoll and kqueue
+    return selectors.PollSelector() if hasattr(selectors, 'PollSelector') else selectors.SelectSelector()
+
+
+def relay_blocking(client: socket.socket, upstream: socket.socket, mode: str = DEFAULT_RELAY_MODE,
+                   watermarks: Optional[Watermarks] = None, shaping_buckets: Optional[Shaping] = None) -> Tuple[int, int]:
+    """Relay data in both directions from the calling thread until both sides finish.
+
+    A clean EOF on one side only half-closes the other so in-flight data in
+    the opposite direction still arrives; an error on either side tears the
+    whole tunnel down.
+
+    Args:
+        mode: One of RELAY_MODES
+        watermarks: Per-direction buffer bounds (default: DEFAULT_WATERMARKS)
+        shaping_buckets: Token buckets limiting each direction (default: unlimited)
+
+    Returns:
+        Bytes moved (client -> upstream, upstream -> client)
+    """
+    tunnel = _Tunnel(client, upstream, mode, watermarks, shaping_buckets)
+    timeouts = client.gettimeout(), upstream.gettimeout()
+    selector = _poller()
+    interest: Dict[socket.socket, int] = {}
+    try:
+        client.setblocking(False)
+        upstream.setblocking(False)
+        while not tunnel.finished():
+            timeout = tunnel.unthrottle()
+            for sock in (client, upstream):
+                events, registered = tunnel.events(sock), interest.get(sock, 0)
+                if events != registered:
+                    if not registered:
+                        selector.register(sock, events)
+                    elif not events:
+                        selector.unregister(sock)
+                    else:
+                        selector.modify(sock, events)
+                    interest[sock] = events
+            if not any(interest.values()):
+                time.sleep(timeout or 0)  # Both directions throttled, nothing to write
+                continue
+            for key, events in selector.select(timeout):
+                tunnel.ready(key.fileobj, events)
+    except OSError as e:
+        record_error('relay', e)
+        _abort(client, upstream)
+    finally:
+        selector.close()
+        tunnel.close()
+        for sock, timeout in zip((client, upstream), timeouts):
+            try:
+                sock.settimeout(timeout)
+            except OSError:
+                pass
+    return tunnel.moved()
+
+
+async def _copy_async(loop: asyncio.AbstractEventLoop, source: socket.socket, destination: socket.socket,
+                      size: int, moved: List[int], buckets: shaping.Buckets) -> None:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    while True:
+        granted = shaping.take(buckets, size) if buckets else size
+        while not granted:
+            await asyncio.sleep(shaping.delay(buckets))
+            granted = shaping.take(buckets, size)
+        received = await loop.sock_recv_into(source, view[:granted])
+        if buckets and received < granted:
+            shaping.give_back(buckets, granted - received)
+        if not received:
+            break
+        moved[0] += received
+        await loop.sock_sendall(destination, view[:received])
+    _half_close(destination)
+
+
+async def _relay_tasks(loop: asyncio.AbstractEventLoop, client: socket.socket, upstream: socket.socket,
+                       watermarks: Watermarks, shaping_buckets: Optional[Shaping]) -> Tuple[int, int]:
+    """Copy relay with a task per direction, for event loops without add_reader (Windows' proactor)."""
+    size = min(BUFFER_SIZE, watermarks.high)
+    outbound, inbound = shaping_buckets or ((), ())
+    upstream_bytes, downstream_bytes = [0], [0]
+    tasks = [
+        loop.create_task(_copy_async(loop, client, upstream, size, upstream_bytes, outbound)),
+        loop.create_task(_copy_async(loop, upstream, client, size, downstream_bytes, inbound)),
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            error = task.exception()
+            if error is not None:
+                record_error('relay', error)
+        return upstream_bytes[0], downstream_bytes[0]
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def relay_async(loop: asyncio.AbstractEventLoop, client: socket.socket, upstream: socket.socket,
+                      mode: str = DEFAULT_RELAY_MODE, watermarks: Optional[Watermarks] = None,
+                      shaping_buckets: Optional[Shaping] = None) -> Tuple[int, int]:
+    """Relay data in both directions until both sides finish.
+
+    Readiness callbacks on the loop drive both directions; no task or
+    future is created per read or write, and a throttled tunnel is woken by
+    a single timer. A clean EOF on one side only
+    half-closes the other so in-flight data in the opposite direction still
+    arrives; an error on either side tears the whole tunnel down.
+
+    Args:
+        mode: One of RELAY_MODES
+        watermarks: Per-direction buffer bounds (default: DEFAULT_WATERMARKS)
+        shaping_buckets: Token buckets limiting each direction (default: unlimited)
+
+    Returns:
+        Bytes moved (client -> upstream, upstream -> client)
+    """
+    watermarks = watermarks or DEFAULT_WATERMARKS
+    if not isinstance(loop, asyncio.SelectorEventLoop):
+        return await _relay_tasks(loop, client, upstream, watermarks, shaping_buckets)
+    tunnel = _Tunnel(client, upstream, mode, watermarks, shaping_buckets)
+    finished = loop.create_future()
+    interest: Dict[socket.socket, int] = {}
+    timer: Optional[asyncio.TimerHandle] = None
+
+    def wake() -> None:
+        nonlocal timer
+        timer = None
+        update()
+
+    def update() -> None:
+        nonlocal timer
+        if not finished.done() and tunnel.finished():
+            finished.set_result(None)
+        if not finished.done():
+            wait = tunnel.unthrottle()
+            if wait is not None:
+                when = loop.time() + wait
+                if timer is None or timer.when() > when:
+                    if timer is not None:
+                        timer.cancel()
+                    timer = loop.call_at(when, wake)
+        for sock in (client, upstream):
+            events = 0 if finished.done() else tunnel.events(sock)
+            changed = events ^ interest.get(sock, 0)
+            if changed & selectors.EVENT_READ:
+                if events & selectors.EVENT_READ:
+                    loop.add_reader(sock.fileno(), ready, sock, selectors.EVENT_READ)
+                else:
+                    loop.remove_reader(sock.fileno())
+            if changed & selectors.EVENT_WRITE:
+                if events & selectors.EVENT_WRITE:
+                    loop.add_writer(sock.fileno(), ready, sock, selectors.EVENT_WRITE)
+                else:
+                    loop.remove_writer(sock.fileno())
+            interest[sock] = events
+
+    def ready(sock: socket.socket, events: int) -> None:
+        try:
+            tunnel.ready(sock, events)
+        except OSError as e:
+            record_error('relay', e)
+            _abort(client, upstream)
+            finished.set_result(None)
+        update()
+
+    try:
+        update()
+        await finished
+    finally:
+        if not finished.done():
+            finished.cancel()
+        if timer is not None:
+            timer.cancel()
+        update()
+        tunnel.close()
+    return tunnel.moved()
@@ -0,0 +1,138 @@
+"""
+Proxy Manager CLI - Profile Reloading
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Keeps running local proxies in step with the profile store. A
+ProfileBinding ties a server to the profile names it was started with and
+switches it when they resolve to different profiles; a ReloadTrigger says
+when to look again: on SIGHUP, or when the store was written by any process
+(profiles.ini edited by hand, `add`, `import`, ...).
+
+A switch only affects new connections. Established tunnels drain through
+the upstream they were opened with, and are closed after an optional grace
+timeout.
+"""
+
+import signal
+import threading
+from typing import Any, Dict, List, Optional
+
+from config_manager import HEALTH_FIELDS, resolve_profiles, store_version
+from upstreams import DEFAULT_POLICY, UpstreamGroup
+
+# Seconds between checks of the profile store
+WATCH_INTERVAL = 1.0
+
+
+def connection_profiles(names: List[str]) -> Dict[str, Dict[str, str]]:
+    """Look up profiles, leaving out health data so a probe does not count as a change.
+
+    Raises:
+        ValueError: If a name or @group matches no profile
+    """
+    try:
+        profiles = resolve_profiles(names)
+    except KeyError as e:
+        raise ValueError(f"Profile or group '{e.args[0]}' not found") from None
+    return {name: {field: value for field, value in record.items() if field not in HEALTH_FIELDS}
+            for name, record in profiles.items()}
+
+
+class ProfileBinding:
+    """A running server, the profile names it serves and the profiles they resolved to.
+
+    Args:
+        server: A server returned by proxy_server.start_profile_proxy()
+        names: Profile names and @group references
+        profiles: What names resolved to when the server was started
+        policy: Balancing policy, one of upstreams.POLICIES
+        grace: Seconds tunnels opened before a switch may keep running;
+            None lets them run until either side closes
+    """
+
+    def __init__(self, server: Any, names: List[str], profiles: Dict[str, Dict[str, str]],
+                 policy: str = DEFAULT_POLICY, grace: Optional[float] = None) -> None:
+        self.server = server
+        self.names = list(names)
+        self.profiles = profiles
+        self.policy = policy
+        self.grace = grace
+        self._draining: List[UpstreamGroup] = []
+
+    def _apply(self, profiles: Dict[str, Dict[str, str]]) -> None:
+        from proxy_server import switch_profiles
+
+        previous = switch_profiles(self.server, profiles, self.policy, self.grace)
+        self._draining.append(previous)
+        self.profiles = profiles
+
+    def switch(self, names: List[str]) -> None:
+        """Serve other profiles from now on.
+
+        Raises:
+            ValueError: If a profile is unknown or needs another front-end
+        """
+        self._apply(connection_profiles(names))
+        self.names = list(names)
+
+    def reload(self) -> bool:
+        """Resolve the names again and switch if the profiles changed.
+
+        Returns:
+            Whether the server was switched
+
+        Raises:
+            ValueError: If a profile is gone or now needs another front-end
+        """
+        profiles = connection_profiles(self.names)
+        if profiles == self.profiles:
+            return False
+        self._apply(profiles)
+        return True
+
+    def draining(self) -> int:
+        """Number of tunnels still open through profiles switched away from."""
+        self._draining = [group for group in self._draining if group.active_connections()]
+        return sum(group.active_connections() for group in self._draining)
+
+
+class ReloadTrigger:
+    """Decides when the profiles behind running servers should be re-read.
+
+    Args:
+        watch: Also reload when the profile store has been written
+    """
+
+    def __init__(self, watch: bool = True) -> None:
+        self.watch = watch
+        self._requested = threading.Event()
+        self._version = store_version() if watch else None
+
+    def request(self) -> None:
+        """Ask for a reload at the next check; safe to call from a signal handler."""
+        self._requested.set()
+
+    def install_signal_handler(self) -> bool:
+        """Request a reload on SIGHUP. Must be called from the main thread.
+
+        Returns:
+            Whether the platform has SIGHUP
+        """
+        if not hasattr(signal, 'SIGHUP'):
+            return False
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.request())
+        return True
+
+    def due(self) -> bool:
+        """Whether a reload was requested or the store changed since the last call."""
+        requested = self._requested.is_set()
+        self._requested.clear()
+        if self.watch:
+            version = store_version()
+            if version != self._version:
+                self._version = version
+                return True
+        return requested
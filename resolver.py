@@ -0,0 +1,340 @@
+"""
+Proxy Manager CLI - Resolver
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Caching name resolution and Happy Eyeballs connects for upstream proxies.
+Profile hosts are usually names, and without a cache every new upstream
+connection paid a full getaddrinfo() round trip. Answers are kept for a
+fixed TTL (getaddrinfo does not report the record TTL), failures for a
+shorter one, and concurrent lookups of the same name share one query.
+Connects race the resolved addresses (RFC 8305): the next address starts
+HAPPY_EYEBALLS_DELAY after the previous one, alternating IPv6 and IPv4, and
+the first to connect wins. The asyncio engine resolves on the executor, so
+a slow DNS server never stalls the event loop.
+"""
+
+import asyncio
+import errno
+import ipaddress
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import watch_resolver
+
+# Seconds a successful lookup is reused
+DEFAULT_TTL = 60.0
+
+# Seconds a failed lookup is remembered
+NEGATIVE_TTL = 5.0
+
+# Cached names, least recently used evicted first
+MAX_ENTRIES = 1024
+
+# Seconds to wait for one address before racing the next (RFC 8305 recommends 250 ms)
+HAPPY_EYEBALLS_DELAY = 0.25
+
+# connect_ex() results meaning the connect is under way
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, 'WSAEWOULDBLOCK', -1)}
+
+# getaddrinfo() results: (family, type, proto, canonname, sockaddr)
+AddressInfo = Tuple[Any, ...]
+
+
+def interleave(infos: List[AddressInfo]) -> List[AddressInfo]:
+    """Order addresses for a connect race, alternating families after the first (RFC 8305)."""
+    families: Dict[int, List[AddressInfo]] = {}
+    for info in infos:
+        families.setdefault(info[0], []).append(info)
+    queues = list(families.values())
+    ordered = []
+    while queues:
+        for queue in list(queues):
+            ordered.append(queue.pop(0))
+            if not queue:
+                queues.remove(queue)
+    return ordered
+
+
+class _Entry:
+    """A cached answer (addresses) or failure (error), valid until expires."""
+
+    __slots__ = ('addresses', 'error', 'expires')
+
+    def __init__(self, addresses: List[AddressInfo], error: Optional[socket.gaierror], expires: float) -> None:
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+
+
+class Resolver:
+    """Thread-safe getaddrinfo() cache with negative caching and shared in-flight lookups.
+
+    Args:
+        ttl: Seconds a successful lookup is reused
+        negative_ttl: Seconds a failed lookup is remembered
+        max_entries: Most names kept
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 max_entries: int = MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.failures = 0
+        self._entries: 'OrderedDict[Tuple[str, int], _Entry]' = OrderedDict()
+        self._inflight: Dict[Tuple[str, int], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key: Tuple[str, int]) -> Optional[List[AddressInfo]]:
+        """Return a fresh cached answer, raise a fresh cached failure, or return None. Call with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        if entry.error is not None:
+            self.negative_hits += 1
+            raise socket.gaierror(entry.error.errno, entry.error.strerror)
+        self.hits += 1
+        return entry.addresses
+
+    def cached(self, host: str, port: int) -> Optional[List[AddressInfo]]:
+        """The cached addresses of host:port, without resolving on a miss.
+
+        Raises:
+            socket.gaierror: If the name recently failed to resolve
+        """
+        with self._lock:
+            return self._cached((host, port))
+
+    def resolve(self, host: str, port: int) -> List[AddressInfo]:
+        """Resolve host:port to TCP addresses, from the cache when possible (blocking on a miss).
+
+        Raises:
+            socket.gaierror: If the name does not resolve
+        """
+        key = (host, port)
+        while True:
+            with self._lock:
+                addresses = self._cached(key)
+                if addresses is not None:
+                    return addresses
+                pending = self._inflight.get(key)
+                if pending is None:
+                    self.misses += 1
+                    self._inflight[key] = threading.Event()
+                    break
+            # Another thread is resolving this name; use its answer
+            pending.wait()
+
+        addresses, error, ttl = [], None, self.negative_ttl
+        try:
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            ttl = self.ttl
+        except socket.gaierror as e:
+            error = e
+        finally:
+            with self._lock:
+                if error is not None or addresses:
+                    self._entries[key] = _Entry(addresses, error, time.monotonic() + ttl)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                if error is not None:
+                    self.failures += 1
+                self._inflight.pop(key).set()
+        if error is not None:
+            raise error
+        return addresses
+
+    async def resolve_async(self, loop: asyncio.AbstractEventLoop, host: str, port: int) -> List[AddressInfo]:
+        """resolve() for the event loop: cache hits return at once, misses run on the executor."""
+        addresses = self.cached(host, port)
+        if addresses is not None:
+            return addresses
+        return await loop.run_in_executor(None, self.resolve, host, port)
+
+    def clear(self) -> None:
+        """Forget every cached answer."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache counters."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'failures': self.failures,
+                'entries': len(self._entries),
+            }
+
+
+def listen_address(host: str, port: int) -> Tuple[int, Any]:
+    """Resolve a local listen address (host may be a name, an IPv4 or IPv6 address).
+
+    A name with both IPv4 and IPv6 addresses (such as localhost) binds its
+    IPv4 address, whichever order the system resolver returns them in.
+
+    Returns:
+        (address family, socket address) to create and bind the listening socket with
+
+    Raises:
+        socket.gaierror: If host does not resolve
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)
+    family, _, _, _, address = next((info for info in infos if info[0] == socket.AF_INET), infos[0])
+    return family, address
+
+
+def is_loopback(address: str) -> bool:
+    """Whether a numeric address (as bound by listen_address) only accepts clients on this host."""
+    try:
+        return ipaddress.ip_address(address.split('%', 1)[0]).is_loopback
+    except ValueError:
+        return False
+
+
+# Shared by every server in the process
+RESOLVER = Resolver()
+watch_resolver(RESOLVER)
+
+
+def _set_nodelay(sock: socket.socket) -> None:
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+def connect(host: str, port: int, timeout: Optional[float] = None, delay: float = HAPPY_EYEBALLS_DELAY,
+            resolver: Resolver = RESOLVER) -> socket.socket:
+    """Open a TCP connection to host:port, racing its addresses (blocking).
+
+    Args:
+        host: Hostname or address
+        port: TCP port
+        timeout: Seconds allowed for the whole connect (None: the OS limit)
+        delay: Seconds before the next address joins the race
+        resolver: Resolver to look host up in
+
+    Returns:
+        A connected blocking socket
+
+    Raises:
+        OSError: The last connect error, socket.timeout, or socket.gaierror
+    """
+    queue = interleave(resolver.resolve(host, port))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    error: OSError = OSError(f"No address for {host}")
+    attempts: Dict[socket.socket, AddressInfo] = {}
+    with selectors.DefaultSelector() as selector:
+        try:
+            next_start = time.monotonic()
+            while queue or attempts:
+                now = time.monotonic()
+                if queue and (not attempts or now >= next_start):
+                    family, type_, proto, _, address = queue.pop(0)
+                    sock = socket.socket(family, type_, proto)
+                    sock.setblocking(False)
+                    result = sock.connect_ex(address)
+                    if result == 0:
+                        attempts[sock] = (family, type_, proto, '', address)
+                        return _won(sock, attempts)
+                    if result not in _IN_PROGRESS:
+                        sock.close()
+                        error = OSError(result, f"{errno.errorcode.get(result, result)} connecting to {address[0]}")
+                        continue  # Failed at once: start the next address now
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    attempts[sock] = (family, type_, proto, '', address)
+                    next_start = now + delay
+                if deadline is not None and now >= deadline:
+                    raise socket.timeout(f"Connecting to {host}:{port} timed out")
+                wake = [deadline] if deadline is not None else []
+                if queue:
+                    wake.append(next_start)
+                wait = max(0.0, min(wake) - now) if wake else None
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj  # type: ignore[assignment]
+                    selector.unregister(sock)
+                    result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if result == 0:
+                        return _won(sock, attempts)
+                    error = OSError(result, f"{errno.errorcode.get(result, result)} connecting to {attempts[sock][4][0]}")
+                    del attempts[sock]
+                    sock.close()
+                    next_start = time.monotonic()  # A failure lets the next address start now
+            raise error
+        finally:
+            for sock in attempts:
+                sock.close()
+
+
+def _won(sock: socket.socket, attempts: Dict[socket.socket, AddressInfo]) -> socket.socket:
+    """Take the winning socket out of the race; the others are closed by the caller."""
+    del attempts[sock]
+    sock.setblocking(True)
+    _set_nodelay(sock)
+    return sock
+
+
+async def connect_async(loop: asyncio.AbstractEventLoop, host: str, port: int,
+                        delay: float = HAPPY_EYEBALLS_DELAY, resolver: Resolver = RESOLVER) -> socket.socket:
+    """Open a TCP connection to host:port on the event loop, racing its addresses.
+
+    Returns:
+        A connected non-blocking socket
+
+    Raises:
+        OSError: The last connect error, or socket.gaierror
+    """
+    queue = interleave(await resolver.resolve_async(loop, host, port))
+
+    async def attempt(info: AddressInfo) -> socket.socket:
+        family, type_, proto, _, address = info
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    error: BaseException = OSError(f"No address for {host}")
+    pending: set = set()
+    winner: Optional[socket.socket] = None
+    try:
+        while (queue or pending) and winner is None:
+            if queue:
+                pending.add(loop.create_task(attempt(queue.pop(0))))
+            done, pending = await asyncio.wait(pending, timeout=delay if queue else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()  # type: ignore[assignment]
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().close()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, socket.socket):
+                    result.close()
+    if winner is None:
+        raise error
+    _set_nodelay(winner)
+    return winner
@@ -0,0 +1,338 @@
+"""
+Proxy Manager CLI - Bandwidth Shaping
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Token buckets for the local proxy: byte rates, each way, for all traffic in
+the process, for each listener, for each client address and for each
+upstream profile, plus a cap on new tunnels per second from each client
+address. A bucket refills from the clock whenever it is drawn from, so
+shaping costs a few arithmetic operations per read and nothing per byte. A
+tunnel whose buckets run dry stops reading and is woken by a timer once
+they hold enough for a worthwhile read again.
+
+Imports nothing beyond the standard library basics, so the command line
+can parse rates without loading the proxy.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds of traffic a bucket may save up, and the least it may hold
+BURST_SECONDS = 0.2
+MIN_BURST = 16 * 1024
+
+# A dry bucket wakes its readers once it holds this fraction of its burst
+RESUME_FRACTION = 0.25
+
+# Seconds over which the current rate is measured
+RATE_WINDOW = 1.0
+
+# Client addresses tracked per listener before idle ones are forgotten
+MAX_CLIENTS = 4096
+
+# Rate suffixes (bytes per second)
+RATE_UNITS = {'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024}
+
+# Scopes a byte rate can apply to, outermost first
+SCOPES = ('global', 'listener', 'client', 'upstream')
+
+# Directions, as in the proxy_bytes_total metric: in is client to upstream, out is upstream to client
+DIRECTIONS = ('in', 'out')
+
+
+def parse_rate(text: str) -> int:
+    """Parse a byte rate such as 500k, 2m or 1048576 (bytes per second; k/m/g are KiB/MiB/GiB).
+
+    Raises:
+        ValueError: If text is not a non-negative rate
+    """
+    value = text.strip().lower()
+    for suffix in ('/s', 'b'):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+    scale = 1
+    if value and value[-1] in RATE_UNITS:
+        scale = RATE_UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        rate = int(float(value) * scale)
+    except (ValueError, OverflowError):  # OverflowError: inf, 1e400
+        raise ValueError(f"Invalid rate: {text!r} (expected e.g. 500k or 2m)") from None
+    if rate < 0:
+        raise ValueError(f"Invalid rate: {text!r} (must not be negative)")
+    return rate
+
+
+def parse_upstream_rates(text: str) -> Dict[str, int]:
+    """Parse an upstream rate spec: RATE for every upstream, NAME=RATE for one, comma-separated.
+
+    Returns:
+        Rate per profile name; the '' entry applies to profiles not named
+
+    Raises:
+        ValueError: If an item is malformed
+    """
+    rates: Dict[str, int] = {}
+    for item in text.split(','):
+        name, _, rate = item.rpartition('=')
+        if not rate.strip():
+            raise ValueError(f"Invalid upstream rate: {text!r} (expected RATE or NAME=RATE)")
+        rates[name.strip()] = parse_rate(rate)
+    return rates
+
+
+def format_rate(rate: float) -> str:
+    """Format bytes per second for people, e.g. 2.0 MiB/s."""
+    for unit, scale in (('GiB/s', RATE_UNITS['g']), ('MiB/s', RATE_UNITS['m']), ('KiB/s', RATE_UNITS['k'])):
+        if rate >= scale:
+            return f"{rate / scale:.1f} {unit}"
+    return f"{rate:.0f} B/s"
+
+
+class TokenBucket:
+    """A token bucket filled at rate tokens per second, holding at most burst.
+
+    Thread-safe: buckets are shared by every connection they limit.
+
+    Args:
+        rate: Tokens added per second (bytes, or connections for the connect limit)
+        burst: Most tokens the bucket holds (default: BURST_SECONDS of rate, at least MIN_BURST)
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp', 'window_start', 'window_taken', 'last_rate', 'lock')
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate * BURST_SECONDS, MIN_BURST)
+        self.tokens = self.burst
+        self.stamp = self.window_start = time.monotonic()
+        self.window_taken = 0
+        self.last_rate = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if now - self.window_start >= RATE_WINDOW:
+            self.last_rate = self.window_taken / (now - self.window_start)
+            self.window_start = now
+            self.window_taken = 0
+
+    def take(self, amount: int) -> int:
+        """Take up to amount whole tokens, returning how many were granted."""
+        with self.lock:
+            self._refill(time.monotonic())
+            granted = min(amount, int(self.tokens))
+            self.tokens -= granted
+            self.window_taken += granted
+            return granted
+
+    def give_back(self, amount: int) -> None:
+        """Return tokens taken but not used."""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + amount)
+            self.window_taken = max(0, self.window_taken - amount)
+
+    def delay(self) -> float:
+        """Seconds until the bucket holds RESUME_FRACTION of its burst."""
+        with self.lock:
+            self._refill(time.monotonic())
+            return max(0.0, (self.burst * RESUME_FRACTION - self.tokens) / self.rate)
+
+    def idle(self) -> bool:
+        """Whether the bucket is full, i.e. nothing drew from it for a while."""
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.burst
+
+    def current_rate(self) -> float:
+        """Tokens taken per second over the last RATE_WINDOW or so."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            elapsed = now - self.window_start
+            if elapsed >= RATE_WINDOW / 2:
+                return self.window_taken / elapsed
+            return self.last_rate
+
+
+Buckets = Tuple[TokenBucket, ...]
+
+
+def take(buckets: Buckets, amount: int) -> int:
+    """Take the same number of tokens from every bucket, as many as the emptiest one grants."""
+    granted: List[int] = []
+    for bucket in buckets:
+        amount = bucket.take(amount)
+        granted.append(amount)
+        if not amount:
+            break
+    for bucket, extra in zip(buckets, granted):
+        if extra > amount:
+            bucket.give_back(extra - amount)
+    return amount
+
+
+def give_back(buckets: Buckets, amount: int) -> None:
+    """Return tokens taken from every bucket but not used."""
+    if amount:
+        for bucket in buckets:
+            bucket.give_back(amount)
+
+
+def delay(buckets: Buckets) -> float:
+    """Seconds until every bucket is worth reading from again."""
+    return max(bucket.delay() for bucket in buckets)
+
+
+class _Pair:
+    """The two buckets of one scope: client to upstream (in) and upstream to client (out)."""
+
+    __slots__ = ('incoming', 'outgoing')
+
+    def __init__(self, rate: float) -> None:
+        self.incoming = TokenBucket(rate)
+        self.outgoing = TokenBucket(rate)
+
+    def idle(self) -> bool:
+        return self.incoming.idle() and self.outgoing.idle()
+
+
+# Buckets of the global scope, shared by every listener in the process with the same rate
+_global_pairs: Dict[float, _Pair] = {}
+_global_lock = threading.Lock()
+
+
+def _global_pair(rate: float) -> _Pair:
+    with _global_lock:
+        pair = _global_pairs.get(rate)
+        if pair is None:
+            pair = _global_pairs[rate] = _Pair(rate)
+        return pair
+
+
+class RateLimits:
+    """The rate limits of one listener and the buckets that enforce them.
+
+    A rate of 0 leaves its scope unlimited.
+
+    Args:
+        global_rate: Bytes per second each way for all listeners in this process together
+        listener_rate: Bytes per second each way for this listener
+        client_rate: Bytes per second each way for each client address
+        upstream_rates: Bytes per second each way per upstream profile name ('' for the others)
+        connect_rate: New tunnels per second from each client address
+    """
+
+    __slots__ = ('global_rate', 'listener_rate', 'client_rate', 'upstream_rates', 'connect_rate',
+                 '_global', '_listener', '_clients', '_upstreams', '_connects', '_lock')
+
+    def __init__(self, global_rate: float = 0, listener_rate: float = 0, client_rate: float = 0,
+                 upstream_rates: Optional[Dict[str, float]] = None, connect_rate: float = 0) -> None:
+        self.global_rate = global_rate
+        self.listener_rate = listener_rate
+        self.client_rate = client_rate
+        self.upstream_rates = {name: rate for name, rate in (upstream_rates or {}).items() if rate}
+        self.connect_rate = connect_rate
+        self._global = _global_pair(global_rate) if global_rate else None
+        self._listener = _Pair(listener_rate) if listener_rate else None
+        self._clients: Dict[str, _Pair] = {}
+        self._upstreams: Dict[str, _Pair] = {}
+        self._connects: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, global_rate: float = 0, listener_rate: float = 0, client_rate: float = 0,
+               upstream_rate: Optional[str] = None, connect_rate: float = 0) -> Optional['RateLimits']:
+        """Build the limits from the local proxy options, or None when nothing is limited.
+
+        Raises:
+            ValueError: If upstream_rate is malformed or a rate is negative
+        """
+        upstream_rates = parse_upstream_rates(upstream_rate) if upstream_rate else {}
+        rates = [global_rate, listener_rate, client_rate, connect_rate, *upstream_rates.values()]
+        if any(rate < 0 for rate in rates):
+            raise ValueError("Rate limits must not be negative")
+        if not any(rates):
+            return None
+        return cls(global_rate, listener_rate, client_rate, upstream_rates, connect_rate)
+
+    def _client_entry(self, table: Dict[str, Any], client: str, factory: Callable[[float], Any], rate: float) -> Any:
+        entry = table.get(client)
+        if entry is None:
+            if len(table) >= MAX_CLIENTS:
+                # Forget clients whose buckets have refilled; they start afresh if they come back
+                for key in [key for key, value in table.items() if value.idle()]:
+                    del table[key]
+            entry = table[client] = factory(rate)
+        return entry
+
+    def allow_connect(self, client: str) -> bool:
+        """Whether a client may open another tunnel now (takes one token if so)."""
+        if not self.connect_rate:
+            return True
+        with self._lock:
+            bucket = self._client_entry(self._connects, client,
+                                        lambda rate: TokenBucket(rate, max(rate, 1.0)), self.connect_rate)
+        return bucket.take(1) == 1
+
+    def tunnel(self, client: str, upstream: str) -> Optional[Tuple[Buckets, Buckets]]:
+        """Buckets a tunnel draws from, or None when its bytes are not limited.
+
+        Args:
+            client: Client address
+            upstream: Name of the upstream profile the tunnel uses
+
+        Returns:
+            (buckets for client -> upstream, buckets for upstream -> client)
+        """
+        pairs: List[_Pair] = [pair for pair in (self._global, self._listener) if pair is not None]
+        with self._lock:
+            if self.client_rate:
+                pairs.append(self._client_entry(self._clients, client, _Pair, self.client_rate))
+            rate = self.upstream_rates.get(upstream, self.upstream_rates.get(''))
+            if rate:
+                pair = self._upstreams.get(upstream)
+                if pair is None:
+                    pair = self._upstreams[upstream] = _Pair(rate)
+                pairs.append(pair)
+        if not pairs:
+            return None
+        return tuple(pair.incoming for pair in pairs), tuple(pair.outgoing for pair in pairs)
+
+    def stats(self) -> List[Dict[str, object]]:
+        """Configured and current rate of every limited scope.
+
+        Returns:
+            One entry per scope and key: scope, key, limit (bytes/s each way),
+            and the current in and out rates
+        """
+        with self._lock:
+            entries: List[Tuple[str, str, Optional[_Pair]]] = [('global', '', self._global),
+                                                               ('listener', '', self._listener)]
+            entries += [('client', client, pair) for client, pair in self._clients.items()]
+            entries += [('upstream', name, pair) for name, pair in self._upstreams.items()]
+        return [{
+            'scope': scope,
+            'key': key,
+            'limit': pair.incoming.rate,
+            'in': pair.incoming.current_rate(),
+            'out': pair.outgoing.current_rate(),
+        } for scope, key, pair in entries if pair is not None]
+
+    def describe(self) -> Iterable[str]:
+        """The configured limits for people, e.g. 'client 1.0 MiB/s'."""
+        if self.global_rate:
+            yield f"global {format_rate(self.global_rate)}"
+        if self.listener_rate:
+            yield f"listener {format_rate(self.listener_rate)}"
+        if self.client_rate:
+            yield f"per client {format_rate(self.client_rate)}"
+        for name, rate in self.upstream_rates.items():
+            yield f"upstream {name or '(each)'} {format_rate(rate)}"
+        if self.connect_rate:
+            yield f"{self.connect_rate:g} new tunnels/s per client"
@@ -0,0 +1,546 @@
+"""
+Proxy Manager CLI - SOCKS Server
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+SOCKS4/4a/5 front-end for the local proxy. Client handshakes are parsed here
+and every request is chained to the upstream proxy with PySocks using the
+profile's credentials.
+"""
+
+import socket
+import struct
+import threading
+import time
+from typing import Any, Generator, List, Optional, Tuple
+
+import socks
+
+from metrics import UPSTREAM_CONNECT_SECONDS, record_error
+from resolver import RESOLVER, interleave
+from upstreams import Upstream, UpstreamGroup
+
+SOCKS4_VERSION = 0x04
+SOCKS5_VERSION = 0x05
+
+CMD_CONNECT = 0x01
+CMD_BIND = 0x02
+CMD_UDP_ASSOCIATE = 0x03
+
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+AUTH_NONE = 0x00
+AUTH_USERPASS = 0x02
+AUTH_NO_ACCEPTABLE = 0xFF
+
+# SOCKS5 reply codes (RFC 1928 section 6)
+REP_SUCCEEDED = 0x00
+REP_GENERAL_FAILURE = 0x01
+REP_NOT_ALLOWED = 0x02
+REP_NETWORK_UNREACHABLE = 0x03
+REP_HOST_UNREACHABLE = 0x04
+REP_CONNECTION_REFUSED = 0x05
+REP_COMMAND_NOT_SUPPORTED = 0x07
+REP_ADDRESS_NOT_SUPPORTED = 0x08
+
+# SOCKS4 reply codes
+SOCKS4_GRANTED = 0x5A
+SOCKS4_REJECTED = 0x5B
+
+# Profile types that can be chained to, mapped to PySocks proxy types
+PROXY_TYPES = {
+    'socks4': socks.SOCKS4,
+    'socks5': socks.SOCKS5,
+    'http': socks.HTTP,
+}
+
+# Seconds allowed for the upstream handshake
+CONNECT_TIMEOUT = 30.0
+
+# Seconds a client may take over its own handshake before it is dropped
+HANDSHAKE_TIMEOUT = 30.0
+
+# Longest user id / domain name accepted in a SOCKS4/4a request
+MAX_FIELD_SIZE = 1024
+
+# Largest UDP datagram relayed through an association
+MAX_DATAGRAM_SIZE = 65535
+
+# Seconds UdpAssociation.close() waits for each relay thread to stop
+RELAY_JOIN_TIMEOUT = 1.0
+
+
+class SocksError(Exception):
+    """Handshake failure, carrying the SOCKS5 reply code for the client.
+
+    version is the SOCKS version the client spoke, when the failure happened
+    at a point where that version expects a reply.
+    """
+
+    def __init__(self, message: str, reply: int = REP_GENERAL_FAILURE, version: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.reply = reply
+        self.version = version
+
+    def failure_reply(self) -> bytes:
+        """Build the reply that tells the client the request failed, or b'' if none is due."""
+        if self.version is None:
+            return b''
+        return SocksRequest(self.version, 0, '0.0.0.0', 0).reply(self.reply)
+
+
+class SocksRequest:
+    """A negotiated client request."""
+
+    __slots__ = ('version', 'command', 'host', 'port')
+
+    def __init__(self, version: int, command: int, host: str, port: int) -> None:
+        self.version = version
+        self.command = command
+        self.host = host
+        self.port = port
+
+    def reply(self, code: int, host: str = '0.0.0.0', port: int = 0) -> bytes:
+        """Build the reply for this request in the client's protocol version."""
+        if self.version == SOCKS4_VERSION:
+            status = SOCKS4_GRANTED if code == REP_SUCCEEDED else SOCKS4_REJECTED
+            try:
+                address = socket.inet_aton(host)
+            except OSError:
+                address = b"\x00\x00\x00\x00"
+            return struct.pack('!BBH4s', 0, status, port, address)
+        return bytes([SOCKS5_VERSION, code, 0]) + encode_address(host, port)
+
+
+def encode_address(host: str, port: int) -> bytes:
+    """Encode host/port as a SOCKS5 ATYP + address + port field."""
+    try:
+        return bytes([ATYP_IPV4]) + socket.inet_aton(host) + struct.pack('!H', port)
+    except OSError:
+        pass
+    try:
+        return bytes([ATYP_IPV6]) + socket.inet_pton(socket.AF_INET6, host) + struct.pack('!H', port)
+    except (OSError, ValueError):
+        pass
+    name = host.encode('idna')
+    return bytes([ATYP_DOMAIN, len(name)]) + name + struct.pack('!H', port)
+
+
+def decode_address(data: bytes, offset: int = 0) -> Tuple[str, int, int]:
+    """Decode a SOCKS5 ATYP + address + port field.
+
+    Returns:
+        Tuple of (host, port, offset just past the field)
+    """
+    atyp = data[offset]
+    offset += 1
+    if atyp == ATYP_IPV4:
+        host = socket.inet_ntoa(data[offset:offset + 4])
+        offset += 4
+    elif atyp == ATYP_IPV6:
+        host = socket.inet_ntop(socket.AF_INET6, data[offset:offset + 16])
+        offset += 16
+    elif atyp == ATYP_DOMAIN:
+        length = data[offset]
+        host = data[offset + 1:offset + 1 + length].decode('idna')
+        offset += 1 + length
+    else:
+        raise SocksError("Unsupported address type", REP_ADDRESS_NOT_SUPPORTED)
+    if len(data) < offset + 2:
+        raise SocksError("Truncated address")
+    port = struct.unpack('!H', data[offset:offset + 2])[0]
+    return host, port, offset + 2
+
+
+def reply_code_for(error: BaseException) -> int:
+    """Map an upstream connection error to a SOCKS5 reply code."""
+    # PySocks wraps the underlying error in GeneralProxyError
+    while isinstance(error, socks.ProxyError) and not isinstance(error, socks.SOCKS5Error) \
+            and error.socket_err is not None:
+        error = error.socket_err
+    if isinstance(error, socks.SOCKS5Error):
+        try:
+            return int(str(error.msg).split(':', 1)[0], 16)
+        except ValueError:
+            return REP_GENERAL_FAILURE
+    if isinstance(error, ConnectionRefusedError):
+        return REP_CONNECTION_REFUSED
+    if isinstance(error, (socket.timeout, socket.gaierror)):
+        return REP_HOST_UNREACHABLE
+    if isinstance(error, OSError) and error.errno is not None:
+        return REP_NETWORK_UNREACHABLE
+    return REP_GENERAL_FAILURE
+
+
+# A negotiation step: ('read', size), ('read_until', delimiter) or ('send', data)
+Step = Tuple[str, Any]
+
+
+def negotiate() -> Generator[Step, Optional[bytes], SocksRequest]:
+    """Server side of the SOCKS4/4a/5 handshake as an I/O-free generator.
+
+    The generator yields the I/O it needs and receives the bytes read;
+    negotiate_async() and negotiate_blocking() drive it for each engine.
+    Username/password sub-negotiation is accepted with any credentials:
+    the listener only serves loopback unless started with allow_remote,
+    and the profile credentials are used upstream.
+    """
+    version = (yield ('read', 1))[0]
+
+    if version == SOCKS4_VERSION:
+        command, port, address = struct.unpack('!BH4s', (yield ('read', 7)))
+        yield ('read_until', b"\x00")  # User id, unused
+        host = socket.inet_ntoa(address)
+        if address[:3] == b"\x00\x00\x00" and address[3] != 0:
+            # SOCKS4a: the destination name follows the user id
+            try:
+                host = (yield ('read_until', b"\x00"))[:-1].decode('idna')
+            except UnicodeError:
+                raise SocksError("Invalid destination name", version=SOCKS4_VERSION) from None
+        return SocksRequest(SOCKS4_VERSION, command, host, port)
+
+    if version != SOCKS5_VERSION:
+        raise SocksError(f"Unsupported SOCKS version {version}")
+
+    count = (yield ('read', 1))[0]
+    methods = yield ('read', count)
+    if AUTH_NONE in methods:
+        yield ('send', bytes([SOCKS5_VERSION, AUTH_NONE]))
+    elif AUTH_USERPASS in methods:
+        yield ('send', bytes([SOCKS5_VERSION, AUTH_USERPASS]))
+        _, username_length = yield ('read', 2)
+        yield ('read', username_length)
+        password_length = (yield ('read', 1))[0]
+        yield ('read', password_length)
+        yield ('send', b"\x01\x00")
+    else:
+        yield ('send', bytes([SOCKS5_VERSION, AUTH_NO_ACCEPTABLE]))
+        raise SocksError("No acceptable authentication method")
+
+    _, command, _, atyp = yield ('read', 4)
+    if atyp == ATYP_IPV4:
+        field = yield ('read', 4 + 2)
+    elif atyp == ATYP_IPV6:
+        field = yield ('read', 16 + 2)
+    elif atyp == ATYP_DOMAIN:
+        length = yield ('read', 1)
+        field = length + (yield ('read', length[0] + 2))
+    else:
+        raise SocksError("Unsupported address type", REP_ADDRESS_NOT_SUPPORTED, SOCKS5_VERSION)
+    try:
+        host, port, _ = decode_address(bytes([atyp]) + field)
+    except UnicodeError:
+        raise SocksError("Invalid destination name", version=SOCKS5_VERSION) from None
+    return SocksRequest(SOCKS5_VERSION, command, host, port)
+
+
+async def negotiate_async(reader: Any) -> SocksRequest:
+    """Run negotiate() over an async_engine.SocketReader."""
+    steps = negotiate()
+    data: Optional[bytes] = None
+    while True:
+        try:
+            action, argument = steps.send(data)
+        except StopIteration as stop:
+            return stop.value
+        if action == 'send':
+            await reader.loop.sock_sendall(reader.sock, argument)
+            data = None
+        elif action == 'read':
+            data = await reader.read_exact(argument)
+        else:
+            data = await reader.read_until(argument, limit=MAX_FIELD_SIZE)
+
+
+class BlockingReader:
+    """Buffered reader over a blocking socket, mirroring SocketReader."""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def _fill(self) -> None:
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("Connection closed unexpectedly")
+        self.buffer += data
+
+    def read_exact(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_until(self, separator: bytes, limit: int = MAX_FIELD_SIZE) -> bytes:
+        while separator not in self.buffer:
+            if len(self.buffer) > limit:
+                raise ValueError("Field too large")
+            self._fill()
+        end = self.buffer.index(separator) + len(separator)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def take_buffer(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def negotiate_blocking(reader: BlockingReader) -> SocksRequest:
+    """Run negotiate() over a BlockingReader."""
+    steps = negotiate()
+    data: Optional[bytes] = None
+    while True:
+        try:
+            action, argument = steps.send(data)
+        except StopIteration as stop:
+            return stop.value
+        if action == 'send':
+            reader.sock.sendall(argument)
+            data = None
+        elif action == 'read':
+            data = reader.read_exact(argument)
+        else:
+            data = reader.read_until(argument)
+
+
+class SocksChain:
+    """Upstream proxy settings used to chain client requests.
+
+    Args:
+        proxy_type: Upstream profile type (socks4, socks5 or http)
+        host: Upstream proxy hostname/IP
+        port: Upstream proxy port
+        username: Optional upstream username
+        password: Optional upstream password
+    """
+
+    def __init__(self, proxy_type: str, host: str, port: int,
+                 username: Optional[str] = None, password: Optional[str] = None) -> None:
+        if proxy_type not in PROXY_TYPES:
+            raise ValueError(f"Unsupported upstream proxy type: {proxy_type}")
+        self.proxy_type = proxy_type
+        self.host = host
+        self.port = int(port)
+        self.username = username or None
+        self.password = password or None
+
+    @classmethod
+    def for_upstream(cls, upstream: Upstream) -> 'SocksChain':
+        """Chain through one member of an upstream group."""
+        return cls(upstream.proxy_type, upstream.host, upstream.port, upstream.username, upstream.password)
+
+    def connect(self, host: str, port: int, timeout: float = CONNECT_TIMEOUT) -> socket.socket:
+        """Open a tunnel to host:port through the upstream proxy (blocking).
+
+        Returns:
+            A plain blocking socket connected end-to-end to the destination
+        """
+        # PySocks resolves proxy_addr on every call; hand it cached addresses
+        # instead, in Happy Eyeballs order (tried one after another, since
+        # PySocks cannot take over an already connected socket)
+        error: Optional[OSError] = None
+        for address in interleave(RESOLVER.resolve(self.host, self.port)):
+            try:
+                upstream = socks.create_connection(
+                    (host, port),
+                    timeout=timeout,
+                    proxy_type=PROXY_TYPES[self.proxy_type],
+                    proxy_addr=address[4][0],
+                    proxy_port=self.port,
+                    proxy_rdns=True,
+                    proxy_username=self.username,
+                    proxy_password=self.password,
+                )
+                break
+            except socks.ProxyConnectionError as e:
+                error = e  # This address is unreachable: try the next one
+        else:
+            raise error or OSError(f"No address for {self.host}")
+        # Hand the connected descriptor over to a plain socket so the relay
+        # does not go through PySocks' per-call wrappers
+        sock = socket.socket(upstream.family, upstream.type, upstream.proto, fileno=upstream.detach())
+        sock.settimeout(None)
+        return sock
+
+    def associate_udp(self, client_host: str, bind_host: str) -> 'UdpAssociation':
+        """Open a UDP association through the upstream proxy (blocking)."""
+        if self.proxy_type != 'socks5':
+            raise SocksError("UDP requires a SOCKS5 upstream", REP_COMMAND_NOT_SUPPORTED)
+        return UdpAssociation(self, client_host, bind_host)
+
+
+def _root_error(error: BaseException) -> BaseException:
+    """Unwrap the GeneralProxyError PySocks puts around the actual failure."""
+    while isinstance(error, socks.GeneralProxyError) and error.socket_err is not None:
+        error = error.socket_err
+    return error
+
+
+def _refused_by_upstream(error: BaseException) -> bool:
+    """Whether the upstream answered but refused the destination (vs. being unreachable)."""
+    return isinstance(_root_error(error), (socks.SOCKS5Error, socks.SOCKS4Error, socks.HTTPError))
+
+
+def connect_group(group: UpstreamGroup, host: str, port: int,
+                  timeout: float = CONNECT_TIMEOUT) -> Tuple[Upstream, socket.socket]:
+    """Open a tunnel to host:port through the group, failing over between upstreams (blocking).
+
+    An upstream that cannot be reached counts as a connect failure; one that
+    refuses the destination is left healthy but the next upstream is tried.
+
+    Returns:
+        Tuple of (upstream used, connected socket)
+
+    Raises:
+        OSError, socks.ProxyError: The error from the last upstream tried
+    """
+    tried: List[Upstream] = []
+    error: BaseException = OSError("No upstream proxy available")
+    while True:
+        upstream = group.pick(tried)
+        if upstream is None:
+            raise error
+        tried.append(upstream)
+        started = time.monotonic()
+        try:
+            sock = SocksChain.for_upstream(upstream).connect(host, port, timeout)
+        except (OSError, socks.ProxyError) as e:
+            if _refused_by_upstream(e):
+                group.record_success(upstream)
+                record_error('upstream_refused', _root_error(e))
+            else:
+                group.record_failure(upstream)
+                record_error('upstream_connect', e)
+            error = e
+            continue
+        elapsed = time.monotonic() - started
+        group.record_success(upstream, elapsed)
+        UPSTREAM_CONNECT_SECONDS.observe(elapsed, upstream=upstream.name)
+        return upstream, sock
+
+
+def associate_group(group: UpstreamGroup, client_host: str, bind_host: str) -> Tuple[Upstream, 'UdpAssociation']:
+    """Open a UDP association through the first reachable SOCKS5 upstream of the group (blocking)."""
+    tried: List[Upstream] = []
+    error: BaseException = OSError("No upstream proxy available")
+    while True:
+        upstream = group.pick(tried, accept=lambda candidate: candidate.proxy_type == 'socks5')
+        if upstream is None:
+            if not tried:
+                raise SocksError("UDP requires a SOCKS5 upstream", REP_COMMAND_NOT_SUPPORTED)
+            raise error
+        tried.append(upstream)
+        try:
+            association = SocksChain.for_upstream(upstream).associate_udp(client_host, bind_host)
+        except (OSError, socks.ProxyError) as e:
+            if not _refused_by_upstream(e):
+                group.record_failure(upstream)
+            record_error('upstream_associate', e)
+            error = e
+            continue
+        group.record_success(upstream)
+        return upstream, association
+
+
+class UdpAssociation:
+    """Relays SOCKS5 UDP datagrams between one client and the upstream proxy.
+
+    Datagrams from the client carry the SOCKS5 UDP header; they are
+    re-wrapped by PySocks for the upstream's own UDP relay. Two daemon
+    threads move datagrams until close() stops them.
+    """
+
+    def __init__(self, chain: SocksChain, client_host: str, bind_host: str) -> None:
+        self.client_host = client_host
+        self.client_address: Optional[Tuple[Any, ...]] = None
+        self.closed = False
+        self.threads: List[threading.Thread] = []
+        family = socket.AF_INET6 if ':' in bind_host else socket.AF_INET
+        self.local = socket.socket(family, socket.SOCK_DGRAM)
+        self.upstream = socks.socksocket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.local.bind((bind_host, 0))
+            self.upstream.set_proxy(socks.SOCKS5, chain.host, chain.port, True, chain.username, chain.password)
+            self.upstream.settimeout(CONNECT_TIMEOUT)
+            # Binding performs the UDP ASSOCIATE handshake with the upstream
+            self.upstream.bind(('', 0))
+            self.upstream.settimeout(None)
+        except BaseException:
+            self.close()
+            raise
+        self.bound_address = self.local.getsockname()[:2]
+
+    def start(self) -> None:
+        for target in (self._client_to_upstream, self._upstream_to_client):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _client_to_upstream(self) -> None:
+        while True:
+            try:
+                data, address = self.local.recvfrom(MAX_DATAGRAM_SIZE)
+            except OSError:
+                return
+            if self.closed:
+                return
+            # Only the client that opened the association may use it
+            if address[0] != self.client_host or len(data) < 4:
+                continue
+            if data[2] != 0:
+                continue  # Fragmented datagrams are not supported
+            try:
+                host, port, offset = decode_address(data, 3)
+                self.client_address = address
+                self.upstream.sendto(data[offset:], (host, port))
+            except (SocksError, IndexError, OSError, UnicodeError):
+                continue
+
+    def _upstream_to_client(self) -> None:
+        while True:
+            try:
+                payload, (host, port) = self.upstream.recvfrom(MAX_DATAGRAM_SIZE)
+            except (socket.timeout, NotImplementedError, TypeError):
+                # PySocks raises TypeError on an empty read, as after shutdown()
+                if self.closed:
+                    return
+                continue
+            except OSError:
+                if self.closed or self.upstream.fileno() < 0:
+                    return
+                continue  # Datagram from an unexpected peer
+            if self.closed:
+                return
+            if self.client_address is None:
+                continue
+            try:
+                self.local.sendto(b"\x00\x00\x00" + encode_address(host, port) + payload, self.client_address)
+            except OSError:
+                return
+
+    def close(self) -> None:
+        """Stop the relay threads and release both sockets."""
+        self.closed = True
+        for sock in (self.local, self.upstream):
+            # close() alone does not wake a thread blocked in recvfrom(), which would keep
+            # the thread and the bound port; shutdown() does, though it reports ENOTCONN
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in self.threads:
+            thread.join(RELAY_JOIN_TIMEOUT)
+        for sock in (self.local, self.upstream):
+            try:
+                sock.close()
+            except OSError:
+                pass
+
@@ -0,0 +1,136 @@
+"""
+Proxy Manager CLI - Upstream Connection Pool
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Keeps idle keep-alive connections to upstream proxies so plain HTTP requests
+can skip the TCP handshake. The pool is I/O agnostic and shared by both
+forwarding engines.
+"""
+
+import select
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+class UpstreamConnection:
+    """A connection to an upstream proxy plus the reader buffering its input."""
+
+    __slots__ = ('sock', 'reader', 'reused')
+
+    def __init__(self, sock: Any, reader: Any) -> None:
+        self.sock = sock
+        self.reader = reader
+        self.reused = False
+
+    def close(self) -> None:
+        try:
+            # Binary socket files hold a reference that keeps the socket open
+            if hasattr(self.reader, 'close'):
+                self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def socket_is_alive(connection: UpstreamConnection) -> bool:
+    """Health check for an idle connection.
+
+    An idle keep-alive connection must have nothing to read: readability
+    means the upstream closed it or sent unsolicited data.
+    """
+    # The asyncio engine's SocketReader keeps unread bytes in .buffer
+    if getattr(connection.reader, 'buffer', None):
+        return False
+    try:
+        if connection.sock.fileno() < 0:
+            return False
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class ConnectionPool:
+    """Per-upstream pool of idle persistent connections.
+
+    Args:
+        max_size: Maximum idle connections kept per upstream (0 disables pooling)
+        idle_timeout: Seconds an idle connection may stay in the pool
+        health_check: Callable deciding whether an idle connection is reusable
+    """
+
+    def __init__(self, max_size: int = DEFAULT_POOL_SIZE, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 health_check: Callable[[UpstreamConnection], bool] = socket_is_alive) -> None:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._idle: Dict[Hashable, Deque[Tuple[float, UpstreamConnection]]] = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, idle: Deque[Tuple[float, UpstreamConnection]], now: float) -> None:
+        # Oldest entries sit on the left
+        while idle and now - idle[0][0] > self.idle_timeout:
+            _, connection = idle.popleft()
+            connection.close()
+            self.discarded += 1
+
+    def acquire(self, key: Hashable) -> Optional[UpstreamConnection]:
+        """Return a healthy idle connection for key, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                self._expire(idle, now)
+                if not idle:
+                    break
+                _, connection = idle.pop()
+                if self.health_check(connection):
+                    self.hits += 1
+                    connection.reused = True
+                    return connection
+                connection.close()
+                self.discarded += 1
+            self.misses += 1
+            return None
+
+    def release(self, key: Hashable, connection: UpstreamConnection) -> None:
+        """Return a connection to the pool, closing it if the pool is full."""
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            self._expire(idle, now)
+            if len(idle) >= self.max_size:
+                connection.close()
+                self.discarded += 1
+                return
+            idle.append((now, connection))
+
+    def close_all(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            for idle in self._idle.values():
+                for _, connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return pool counters."""
+        with self._lock:
+            idle = sum(len(entries) for entries in self._idle.values())
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'discarded': self.discarded,
+            'idle': idle,
+        }
@@ -0,0 +1,236 @@
+"""
+Proxy Manager CLI - Upstream Groups
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Load balancing and failover across several equivalent upstream proxies.
+A group picks an upstream per connection with a selectable policy, ejects
+upstreams after consecutive connect failures and lets them back in after an
+exponential backoff. The group is I/O agnostic and shared by both engines;
+it only keeps hold of each open connection's sockets, so a group that was
+switched out can cut its remaining tunnels short.
+"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Set, Tuple
+
+# Selection policies
+POLICY_ROUND_ROBIN = 'round-robin'
+POLICY_LEAST_CONNECTIONS = 'least-connections'
+POLICY_EWMA = 'ewma'
+POLICIES = (POLICY_ROUND_ROBIN, POLICY_LEAST_CONNECTIONS, POLICY_EWMA)
+DEFAULT_POLICY = POLICY_ROUND_ROBIN
+
+# Consecutive connect failures before an upstream is ejected
+DEFAULT_MAX_FAILURES = 3
+
+# Ejection backoff, doubled each time an upstream is ejected again
+MIN_EJECT_TIME = 1.0
+MAX_EJECT_TIME = 60.0
+
+# Weight of the newest sample in the latency moving average
+EWMA_ALPHA = 0.3
+
+
+class Upstream:
+    """One upstream proxy of a group, with its live counters."""
+
+    __slots__ = ('name', 'proxy_type', 'host', 'port', 'username', 'password', 'auth',
+                 'active', 'total', 'failures', 'consecutive_failures',
+                 'ejections', 'ejected_until', 'eject_time', 'latency')
+
+    def __init__(self, name: str, proxy_type: str, host: str, port: int,
+                 username: Optional[str] = None, password: Optional[str] = None) -> None:
+        self.name = name
+        self.proxy_type = proxy_type
+        self.host = host
+        self.port = int(port)
+        self.username = username or None
+        self.password = password or None
+        # Proxy-Authorization state, for HTTP upstreams with credentials
+        self.auth: Any = None
+        if proxy_type == 'http' and self.username:
+            from proxy_auth import ProxyAuth  # Here, so quick commands do not load hashlib
+            self.auth = ProxyAuth(self.username, self.password)
+        self.active = 0
+        self.total = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.eject_time = MIN_EJECT_TIME
+        # Moving average of connect/response latency in seconds, None until measured
+        self.latency: Optional[float] = None
+
+    @classmethod
+    def from_profile(cls, name: str, profile: Dict[str, str]) -> 'Upstream':
+        """Build an upstream from a config_manager profile record."""
+        return cls(name, profile['type'], profile['host'], int(profile['port']),
+                   profile.get('username'), profile.get('password'))
+
+    @property
+    def key(self) -> tuple:
+        """Connection pool key for this upstream."""
+        return (self.host, self.port)
+
+    def __repr__(self) -> str:
+        return f"Upstream({self.name!r}, {self.host}:{self.port})"
+
+
+class UpstreamGroup:
+    """A set of equivalent upstreams and the policy choosing between them.
+
+    Args:
+        upstreams: Members of the group
+        policy: Selection policy, one of POLICIES
+        max_failures: Consecutive connect failures that eject an upstream
+    """
+
+    def __init__(self, upstreams: List[Upstream], policy: str = DEFAULT_POLICY,
+                 max_failures: int = DEFAULT_MAX_FAILURES) -> None:
+        if not upstreams:
+            raise ValueError("An upstream group needs at least one upstream")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown balancing policy: {policy}")
+        self.upstreams = list(upstreams)
+        self.policy = policy
+        self.max_failures = max_failures
+        self._cursor = itertools.count()
+        self._lock = threading.Lock()
+        self._connections: Set[Tuple[Any, ...]] = set()
+
+    @classmethod
+    def single(cls, proxy_type: str, host: str, port: int, username: Optional[str] = None,
+               password: Optional[str] = None) -> 'UpstreamGroup':
+        """Group holding one upstream, used when a single profile is active."""
+        return cls([Upstream(f"{host}:{port}", proxy_type, host, port, username, password)])
+
+    def __len__(self) -> int:
+        return len(self.upstreams)
+
+    def _score(self, upstream: Upstream) -> float:
+        if self.policy == POLICY_LEAST_CONNECTIONS:
+            return upstream.active
+        # Unmeasured upstreams score 0 so they get probed first; load
+        # multiplies the latency so a fast upstream is not swamped
+        return (upstream.latency or 0.0) * (upstream.active + 1)
+
+    def pick(self, exclude: Collection[Upstream] = (),
+             accept: Optional[Callable[[Upstream], bool]] = None) -> Optional[Upstream]:
+        """Choose an upstream for a new connection.
+
+        Ejected upstreams are skipped while a healthy one is available; if
+        every candidate is ejected the one due back first is tried anyway.
+
+        Args:
+            exclude: Upstreams already tried for this connection
+            accept: Optional filter, e.g. to require SOCKS5 for UDP
+
+        Returns:
+            The chosen upstream, or None if no candidate is left
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [upstream for upstream in self.upstreams
+                          if upstream not in exclude and (accept is None or accept(upstream))]
+            if not candidates:
+                return None
+            healthy = [upstream for upstream in candidates if upstream.ejected_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda upstream: upstream.ejected_until)
+            if self.policy == POLICY_ROUND_ROBIN:
+                return healthy[next(self._cursor) % len(healthy)]
+            start = next(self._cursor) % len(healthy)
+            # Rotate before min() so ties are spread instead of always hitting the first
+            rotated = healthy[start:] + healthy[:start]
+            return min(rotated, key=self._score)
+
+    @contextmanager
+    def using(self, upstream: Upstream, *sockets: Any) -> Iterator[Upstream]:
+        """Count a connection as active on upstream for the duration.
+
+        Args:
+            upstream: The upstream the connection goes through
+            sockets: The connection's client and upstream sockets, remembered
+                so close_connections() can end it
+        """
+        with self._lock:
+            upstream.active += 1
+            upstream.total += 1
+            if sockets:
+                self._connections.add(sockets)
+        try:
+            yield upstream
+        finally:
+            with self._lock:
+                upstream.active -= 1
+                self._connections.discard(sockets)
+
+    def active_connections(self) -> int:
+        """Number of connections currently open through the group."""
+        with self._lock:
+            return sum(upstream.active for upstream in self.upstreams)
+
+    def close_connections(self) -> int:
+        """Shut down every connection still open through the group.
+
+        The sockets are shut down rather than closed: whichever thread or
+        event loop relays the connection sees end-of-file and closes it.
+
+        Returns:
+            Number of connections shut down
+        """
+        import socket  # Not at the top: main.py imports this module for POLICIES alone
+
+        with self._lock:
+            connections = list(self._connections)
+        for sockets in connections:
+            for sock in sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass  # Already closed
+        return len(connections)
+
+    def record_success(self, upstream: Upstream, latency: Optional[float] = None) -> None:
+        """Record a successful connect or response, and its latency in seconds."""
+        with self._lock:
+            upstream.consecutive_failures = 0
+            upstream.ejected_until = 0.0
+            upstream.eject_time = MIN_EJECT_TIME
+            if latency is not None:
+                if upstream.latency is None:
+                    upstream.latency = latency
+                else:
+                    upstream.latency += EWMA_ALPHA * (latency - upstream.latency)
+
+    def record_failure(self, upstream: Upstream) -> None:
+        """Record a failed connect, ejecting the upstream after max_failures in a row."""
+        now = time.monotonic()
+        with self._lock:
+            upstream.failures += 1
+            upstream.consecutive_failures += 1
+            if upstream.consecutive_failures >= self.max_failures and upstream.ejected_until <= now:
+                upstream.ejected_until = now + upstream.eject_time
+                upstream.eject_time = min(upstream.eject_time * 2, MAX_EJECT_TIME)
+                upstream.ejections += 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return per-upstream counters."""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'name': upstream.name,
+                'address': f"{upstream.host}:{upstream.port}",
+                'active': upstream.active,
+                'total': upstream.total,
+                'failures': upstream.failures,
+                'ejections': upstream.ejections,
+                'ejected': upstream.ejected_until > now,
+                'latency_ms': None if upstream.latency is None else round(upstream.latency * 1000, 1),
+            } for upstream in self.upstreams]
@@ -0,0 +1,252 @@
+"""
+Proxy Manager CLI - Worker Processes
+
+Author: Rezaul Karim
+Email: work.rezaul@outlook.com
+Powered By: REZ LAB
+
+Multi-process local mode. Each worker process runs its own proxy server bound
+to the same port with SO_REUSEPORT, so the kernel spreads incoming
+connections across processes (and CPU cores) instead of one GIL. The
+supervisor restarts workers that die and stops them all on shutdown. Each
+worker reloads its profiles by itself (see reloader); the supervisor
+forwards SIGHUP to them.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional
+
+from defaults import DEFAULT_DRAIN_TIMEOUT
+from metrics import start_metrics_server
+from proxy_server import start_profile_proxy, stop_all_servers
+from reloader import WATCH_INTERVAL, ProfileBinding, ReloadTrigger, connection_profiles
+from upstreams import DEFAULT_POLICY
+
+# Seconds to wait for every worker to bind its listener
+START_TIMEOUT = 15.0
+
+# Restart backoff for crashing workers, doubled per consecutive crash
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+# A worker that ran this long before dying resets its backoff
+STABLE_AFTER = 10.0
+
+
+def reuse_port_supported() -> bool:
+    """Whether this platform lets several sockets bind one port (SO_REUSEPORT)."""
+    return hasattr(socket, 'SO_REUSEPORT') and not sys.platform.startswith('win')
+
+
+def _worker_main(profiles: Dict[str, Dict[str, str]], local_port: int, options: Dict[str, Any],
+                 ready: Connection, metrics_port: Optional[int] = None, names: Optional[List[str]] = None,
+                 reload_grace: Optional[float] = None, watch: bool = True, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> None:
+    """Entry point of a worker process.
+
+    Reports None on the ready pipe once the listener is bound, or the error
+    message if startup failed. Ctrl+C is left to the supervisor; the worker
+    stops on SIGTERM or when the supervisor goes away. With metrics_port the
+    worker also serves its own metrics there. With names the worker reloads
+    its profiles on SIGHUP and, if watch is set, when the store changes. On
+    SIGTERM open connections get drain_timeout seconds to finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    trigger = ReloadTrigger(watch)
+    trigger.install_signal_handler()
+    parent = os.getppid()
+    if names is not None:
+        try:
+            profiles = connection_profiles(names)  # A restarted worker starts from the current profiles
+        except ValueError:
+            pass
+
+    try:
+        server = start_profile_proxy(profiles, local_port, reuse_port=True, **options)
+        if metrics_port is not None:
+            start_metrics_server(metrics_port)
+    except (OSError, ValueError) as e:
+        ready.send(str(e))
+        ready.close()
+        sys.exit(1)
+    ready.send(None)
+    ready.close()
+
+    binding = None
+    if names is not None:
+        binding = ProfileBinding(server, names, profiles, options.get('policy', DEFAULT_POLICY), reload_grace)
+    while not stopping.wait(WATCH_INTERVAL) and os.getppid() == parent:
+        if binding is not None and trigger.due():
+            try:
+                binding.reload()
+            except ValueError as e:
+                print(f"Reload failed, keeping the current profiles: {e}", file=sys.stderr, flush=True)
+    stop_all_servers(drain_timeout, lambda remaining, left: print(
+        f"Worker {os.getpid()}: waiting for {remaining} connection(s) ({left:.0f}s left)", file=sys.stderr, flush=True))
+
+
+class _Worker:
+    """Bookkeeping for one worker slot."""
+
+    __slots__ = ('process', 'ready', 'started', 'backoff', 'restart_at')
+
+    def __init__(self) -> None:
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.ready: Optional[Connection] = None
+        self.started = 0.0
+        self.backoff = MIN_BACKOFF
+        self.restart_at: Optional[float] = None
+
+
+class WorkerSupervisor:
+    """Runs and supervises the local proxy in several worker processes.
+
+    Args:
+        profiles: Profile records keyed by name, see proxy_server.start_profile_proxy()
+        local_port: Local port every worker binds
+        options: Keyword arguments for proxy_server.start_profile_proxy()
+        workers: Number of worker processes
+        metrics_port: If set, worker N serves its metrics on metrics_port + N - 1
+        names: Profile names and @group references behind profiles; if set,
+            workers reload them on SIGHUP and when the store changes
+        reload_grace: Seconds tunnels may outlive a profile switch (None: until they close)
+        watch: Reload when the profile store changes
+        drain_timeout: Seconds a stopping worker gives its open connections
+    """
+
+    def __init__(self, profiles: Dict[str, Dict[str, str]], local_port: int, options: Dict[str, Any],
+                 workers: int, metrics_port: Optional[int] = None, names: Optional[List[str]] = None,
+                 reload_grace: Optional[float] = None, watch: bool = True, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT) -> None:
+        if workers < 1:
+            raise ValueError("At least one worker is required")
+        if not reuse_port_supported():
+            raise ValueError("Multiple workers need SO_REUSEPORT, which this platform does not support")
+        self.profiles = profiles
+        self.local_port = local_port
+        self.options = options
+        self.metrics_port = metrics_port
+        self.names = names
+        self.reload_grace = reload_grace
+        self.watch = watch
+        self.drain_timeout = drain_timeout
+        self.restarts = 0
+        self._slots: List[_Worker] = [_Worker() for _ in range(workers)]
+        self._context = multiprocessing.get_context()
+        self._stopping = threading.Event()
+
+    def _spawn(self, slot: _Worker) -> None:
+        receiver, sender = self._context.Pipe(duplex=False)
+        index = self._slots.index(slot)
+        metrics_port = None if self.metrics_port is None else self.metrics_port + index
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.profiles, self.local_port, self.options, sender, metrics_port,
+                  self.names, self.reload_grace, self.watch, self.drain_timeout),
+            name=f"proxy-worker-{index + 1}",
+            daemon=True,
+        )
+        process.start()
+        sender.close()
+        if slot.ready is not None:
+            slot.ready.close()
+        slot.process = process
+        slot.ready = receiver
+        slot.started = time.monotonic()
+        slot.restart_at = None
+
+    def pids(self) -> List[int]:
+        """Return the process ids of the live workers."""
+        return [slot.process.pid for slot in self._slots
+                if slot.process is not None and slot.process.is_alive() and slot.process.pid is not None]
+
+    def reload(self) -> None:
+        """Ask every live worker to reload its profiles (SIGHUP)."""
+        for pid in self.pids():
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def start(self, timeout: float = START_TIMEOUT) -> None:
+        """Start every worker and wait until each has bound the port.
+
+        Raises:
+            OSError: If a worker failed to start; all workers are stopped
+        """
+        for slot in self._slots:
+            self._spawn(slot)
+        deadline = time.monotonic() + timeout
+        for slot in self._slots:
+            assert slot.ready is not None and slot.process is not None
+            error: Optional[str] = None
+            try:
+                if slot.ready.poll(max(0.0, deadline - time.monotonic())):
+                    error = slot.ready.recv()
+                else:
+                    error = f"worker did not start within {timeout:g}s"
+            except EOFError:
+                error = f"worker exited with code {slot.process.exitcode}"
+            if error is not None:
+                self.stop()
+                raise OSError(error)
+
+    def _check(self, slot: _Worker, now: float) -> None:
+        process = slot.process
+        if process is None:
+            return
+        if process.is_alive():
+            if slot.ready is not None and slot.ready.poll(0):
+                try:
+                    slot.ready.recv()
+                except EOFError:
+                    pass
+                slot.ready.close()
+                slot.ready = None
+            return
+        if slot.restart_at is None:
+            # Crashed: schedule a restart, backing off while it keeps crashing
+            if now - slot.started >= STABLE_AFTER:
+                slot.backoff = MIN_BACKOFF
+            slot.restart_at = now + slot.backoff
+            slot.backoff = min(slot.backoff * 2, MAX_BACKOFF)
+        elif now >= slot.restart_at:
+            self.restarts += 1
+            self._spawn(slot)
+
+    def run(self, poll_interval: float = 0.5) -> None:
+        """Supervise the workers until stop() is called (or Ctrl+C)."""
+        while not self._stopping.wait(poll_interval):
+            now = time.monotonic()
+            for slot in self._slots:
+                self._check(slot, now)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Terminate every worker, killing those that do not exit in time.
+
+        Workers first drain their connections, so they get drain_timeout
+        seconds on top of timeout.
+        """
+        self._stopping.set()
+        processes = [slot.process for slot in self._slots if slot.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.drain_timeout + timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        for slot in self._slots:
+            if slot.ready is not None:
+                slot.ready.close()
+            slot.process = None
+            slot.ready = None